@@ -1,25 +1,44 @@
+# alembic/env.py
 from logging.config import fileConfig
-from sqlalchemy import engine_from_config
-from sqlalchemy import pool
+
+from sqlalchemy import create_engine, pool
 from alembic import context
+
+from database import DATABASE_URL
 from models import Base
-import os
 
 config = context.config
-fileConfig(config.config_file_name)
+# upgrade_schema() из приложения выключает настройку логов из alembic.ini
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name)
 target_metadata = Base.metadata
 
+# Тот же адрес, что у приложения; sqlalchemy.url в alembic.ini - только явная подмена
+DB_URL = config.get_main_option("sqlalchemy.url") or DATABASE_URL
+
+
+def _configure_options(url: str) -> dict:
+    # SQLite не умеет ALTER COLUMN: изменения таблиц идут через пересоздание (batch)
+    return {"target_metadata": target_metadata, "render_as_batch": url.startswith("sqlite")}
+
+
+def run_migrations_offline():
+    """SQL-скрипт без подключения к БД: alembic upgrade head --sql"""
+    context.configure(url=DB_URL, literal_binds=True, **_configure_options(DB_URL))
+    with context.begin_transaction():
+        context.run_migrations()
+
+
 def run_migrations_online():
-    connectable = engine_from_config(
-        config.get_section(config.config_ini_section),
-        prefix="sqlalchemy.",
-        poolclass=pool.NullPool,
-    )
+    connectable = create_engine(DB_URL, poolclass=pool.NullPool)
     with connectable.connect() as connection:
-        context.configure(
-            connection=connection, target_metadata=target_metadata
-        )
+        context.configure(connection=connection, **_configure_options(DB_URL))
         with context.begin_transaction():
             context.run_migrations()
+    connectable.dispose()
+
 
-run_migrations_online()
\ No newline at end of file
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,96 @@
+"""Базовая схема: users, rooms, messages, room_participants
+
+Раньше таблицы создавал main.py через create_all при импорте, а новые
+столбцы дописывал add_missing_columns. Ревизия приводит к одной схеме и
+новую БД, и такую уже существующую: недостающие таблицы, столбец
+rooms.media_relay и индекс истории сообщений создаются, имеющиеся не трогаются.
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2025-11-20 12:00:00
+
+"""
+from typing import Optional, Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001_baseline"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _inspector() -> Optional[sa.Inspector]:
+    # alembic upgrade --sql: подключения нет, скрипт создает все с нуля
+    return None if op.get_context().as_sql else sa.inspect(op.get_bind())
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = _inspector()
+    tables = set(inspector.get_table_names()) if inspector is not None else set()
+
+    if "users" not in tables:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("email", sa.String(), nullable=True),
+            sa.Column("name", sa.String(), nullable=True),
+            sa.Column("password_hash", sa.String(), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    if "rooms" not in tables:
+        op.create_table(
+            "rooms",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String(), nullable=True),
+            sa.Column("invite_link", sa.String(), nullable=True),
+            sa.Column("created_by", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.Column("is_active", sa.Boolean(), nullable=True),
+            sa.Column("media_relay", sa.Boolean(), server_default=sa.false(), nullable=False),
+        )
+        op.create_index("ix_rooms_id", "rooms", ["id"])
+        op.create_index("ix_rooms_invite_link", "rooms", ["invite_link"], unique=True)
+    elif "media_relay" not in {column["name"] for column in inspector.get_columns("rooms")}:
+        # БД, созданная до появления медиа-ретранслятора
+        op.add_column("rooms", sa.Column("media_relay", sa.Boolean(), server_default=sa.false(), nullable=False))
+
+    if "messages" not in tables:
+        op.create_table(
+            "messages",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("room_id", sa.Integer(), sa.ForeignKey("rooms.id"), nullable=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+            sa.Column("content", sa.String(), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        )
+        op.create_index("ix_messages_id", "messages", ["id"])
+        op.create_index("ix_messages_room_created_id", "messages", ["room_id", "created_at", "id"])
+    elif "ix_messages_room_created_id" not in {index["name"] for index in inspector.get_indexes("messages")}:
+        op.create_index("ix_messages_room_created_id", "messages", ["room_id", "created_at", "id"])
+
+    if "room_participants" not in tables:
+        op.create_table(
+            "room_participants",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("room_id", sa.Integer(), sa.ForeignKey("rooms.id"), nullable=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+            sa.Column("joined_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.Column("is_online", sa.Boolean(), nullable=True),
+        )
+        op.create_index("ix_room_participants_id", "room_participants", ["id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("room_participants")
+    op.drop_table("messages")
+    op.drop_table("rooms")
+    op.drop_table("users")
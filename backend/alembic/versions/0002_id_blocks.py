@@ -0,0 +1,41 @@
+"""Диапазоны id сообщений для воркеров (hi/lo)
+
+Каждый воркер резервирует у БД блок id для сообщений чата (chat_writer.py),
+поэтому воркеры не выдают одинаковые id.
+
+Revision ID: 0002_id_blocks
+Revises: 0001_baseline
+Create Date: 2025-11-21 12:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002_id_blocks"
+down_revision: Union[str, Sequence[str], None] = "0001_baseline"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    id_blocks = op.create_table(
+        "id_blocks",
+        sa.Column("name", sa.String(), primary_key=True),
+        sa.Column("next_id", sa.Integer(), nullable=False),
+    )
+    # Продолжаем после уже записанных сообщений
+    op.execute(id_blocks.insert().from_select(
+        ["name", "next_id"],
+        sa.select(sa.literal("messages"), sa.func.coalesce(sa.func.max(sa.column("id")), 0) + 1)
+        .select_from(sa.table("messages")),
+    ))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("id_blocks")
@@ -1,20 +1,19 @@
 # auth.py
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, WebSocket, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from database import get_db
-from models import User
+from token_cache import token_cache
+from user_cache import CachedUser, fetch_user, user_cache
 
 # Настройки
 SECRET_KEY = "your-secret-key-here"  # Замени в продакшене
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -28,6 +27,16 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def decode_token(token: str) -> Optional[Tuple[int, Optional[float]]]:
+    """Проверка подписи и срока токена: (user_id, exp) или None"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id: int = int(payload.get("sub"))
+        expires_at = payload.get("exp")
+        return user_id, float(expires_at) if expires_at is not None else None
+    except (JWTError, TypeError, ValueError):
+        return None
+
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
     """Верификация JWT токена"""
     credentials_exception = HTTPException(
@@ -36,18 +45,46 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security),
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-    except JWTError:
+    # Уже проверенный токен: без разбора подписи и поиска пользователя
+    user = token_cache.get(credentials.credentials)
+    if user is not None:
+        return user
+    
+    claims = decode_token(credentials.credentials)
+    if claims is None:
         raise credentials_exception
     
-    user = db.query(User).filter(User.id == user_id).first()
+    user = user_cache.load(db, claims[0])
     if user is None:
         raise credentials_exception
-    return user
+    return token_cache.put(credentials.credentials, user, claims[1])
+
+def websocket_token(websocket: WebSocket) -> Optional[str]:
+    """Токен рукопожатия: ?token=... (браузерный WebSocket не умеет заголовки) или Authorization: Bearer"""
+    token = websocket.query_params.get("token")
+    if token:
+        return token
+    scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and credentials:
+        return credentials
+    return None
+
+async def authenticate_websocket(websocket: WebSocket) -> Optional[CachedUser]:
+    """Пользователь по токену рукопожатия; None - токена нет или он недействителен"""
+    token = websocket_token(websocket)
+    if token is None:
+        return None
+    user = token_cache.get(token)
+    if user is not None:
+        return user
+    
+    claims = decode_token(token)
+    if claims is None:
+        return None
+    user = user_cache.get(claims[0]) or await fetch_user(claims[0])
+    if user is None:
+        return None
+    return token_cache.put(token, user, claims[1])
 
 def get_current_user(token: str = Depends(verify_token)):
     """Получение текущего пользователя"""
@@ -0,0 +1,337 @@
+# backplane.py
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from logging_setup import log_event
+
+logger = logging.getLogger(__name__)
+
+# memory - один процесс; socket - несколько воркеров на одной машине через unix-сокет
+BACKPLANE = os.getenv("BACKPLANE", "memory")
+BACKPLANE_SOCKET = os.getenv("BACKPLANE_SOCKET", "/tmp/conference-backplane.sock")
+
+# Кадры шины - JSON в одну строку; SDP занимает несколько КБ, берем с запасом
+FRAME_LIMIT = 4 * 1024 * 1024
+RECONNECT_DELAY = 0.5
+START_TIMEOUT = 5.0
+
+EventHandler = Callable[[dict], Awaitable[None]]
+
+
+def apply_presence(presence: Dict[str, Dict[str, str]], event: dict):
+    """Обновляет карту присутствия room_id -> {user_id -> node_id} по событию шины"""
+    op = event.get("op")
+    if op == "join":
+        presence.setdefault(event["room"], {})[event["user"]] = event["origin"]
+    elif op == "leave":
+        users = presence.get(event["room"])
+        # Уход засчитываем только от того воркера, где пользователь сейчас подключен
+        if users is not None and users.get(event["user"]) == event["origin"]:
+            del users[event["user"]]
+            if not users:
+                del presence[event["room"]]
+
+
+class Backplane:
+    """Шина между воркерами: рассылки по комнатам и общее присутствие участников.
+
+    События: join/leave (присутствие), broadcast и direct (готовый текст сообщения).
+    Собственные события узел применяет к присутствию сразу, а обработчику
+    менеджера передаются только события других узлов.
+    """
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+        self.presence: Dict[str, Dict[str, str]] = {}
+        # Сколько участников комнаты подключено к другим узлам (проверка на каждой рассылке)
+        self.remote_counts: Dict[str, int] = {}
+        self._on_event: Optional[EventHandler] = None
+
+    async def start(self, on_event: EventHandler):
+        self._on_event = on_event
+
+    async def stop(self):
+        self._on_event = None
+
+    def room_members(self, room_id: str) -> List[str]:
+        return list(self.presence.get(room_id, {}))
+
+    def has_members(self, room_id: str) -> bool:
+        return room_id in self.presence
+
+    def has_remote_members(self, room_id: str) -> bool:
+        return self.remote_counts.get(room_id, 0) > 0
+
+    def user_node(self, room_id: str, user_id: str) -> Optional[str]:
+        return self.presence.get(room_id, {}).get(user_id)
+
+    def local_presence(self) -> Dict[str, List[str]]:
+        return {
+            room_id: [user_id for user_id, node_id in users.items() if node_id == self.node_id]
+            for room_id, users in self.presence.items()
+        }
+
+    async def join(self, room_id: str, user_id: str):
+        await self.publish({"op": "join", "room": room_id, "user": user_id})
+
+    async def leave(self, room_id: str, user_id: str):
+        await self.publish({"op": "leave", "room": room_id, "user": user_id})
+
+    async def publish(self, event: dict):
+        event["origin"] = self.node_id
+        self._apply(event)
+        await self._send(event)
+
+    async def _receive(self, event: dict):
+        self._apply(event)
+        if self._on_event is not None:
+            await self._on_event(event)
+
+    def _apply(self, event: dict):
+        if event.get("op") not in ("join", "leave"):
+            return
+        room_id = event["room"]
+        owner_before = self.presence.get(room_id, {}).get(event["user"])
+        apply_presence(self.presence, event)
+        owner_after = self.presence.get(room_id, {}).get(event["user"])
+        delta = self._is_remote(owner_after) - self._is_remote(owner_before)
+        if delta:
+            count = self.remote_counts.get(room_id, 0) + delta
+            if count:
+                self.remote_counts[room_id] = count
+            else:
+                del self.remote_counts[room_id]
+
+    def _is_remote(self, node_id: Optional[str]) -> int:
+        return int(node_id is not None and node_id != self.node_id)
+
+    def _recount(self):
+        self.remote_counts = {}
+        for room_id, users in self.presence.items():
+            count = sum(self._is_remote(node_id) for node_id in users.values())
+            if count:
+                self.remote_counts[room_id] = count
+
+    async def _send(self, event: dict):
+        raise NotImplementedError
+
+
+class InMemoryHub:
+    """Общая точка для узлов в одном процессе"""
+
+    def __init__(self):
+        self.nodes: List["InMemoryBackplane"] = []
+
+
+class InMemoryBackplane(Backplane):
+    """Шина внутри процесса. С собственным хабом ведет себя как один воркер"""
+
+    def __init__(self, hub: Optional[InMemoryHub] = None):
+        super().__init__()
+        self.hub = hub or InMemoryHub()
+        self.hub.nodes.append(self)
+
+    async def _send(self, event: dict):
+        for node in self.hub.nodes:
+            if node is not self:
+                await node._receive(event)
+
+
+class _SocketHub:
+    """Ретранслятор шины, работает в одном из воркеров (выбирается через flock)"""
+
+    def __init__(self):
+        self.clients: Dict[asyncio.StreamWriter, str] = {}
+        self.presence: Dict[str, Dict[str, str]] = {}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        node_id = None
+        try:
+            hello = json.loads(await reader.readline())
+            node_id = hello["origin"]
+            self.clients[writer] = node_id
+            for room_id, users in hello.get("presence", {}).items():
+                for user_id in users:
+                    event = {"op": "join", "room": room_id, "user": user_id, "origin": node_id}
+                    apply_presence(self.presence, event)
+                    await self._forward(event, exclude=writer)
+            await self._write(writer, {"op": "snapshot", "presence": self.presence})
+
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                event = json.loads(line)
+                apply_presence(self.presence, event)
+                await self._forward(event, exclude=writer)
+        except asyncio.CancelledError:
+            # Ретранслятор останавливается вместе со своим воркером
+            node_id = None
+        except (ConnectionError, ValueError, KeyError) as e:
+            logger.warning("Backplane client %s failed: %r", node_id, e)
+        finally:
+            self.clients.pop(writer, None)
+            writer.close()
+            if node_id is not None:
+                await self._drop_node(node_id)
+
+    def close(self):
+        for writer in list(self.clients):
+            writer.close()
+        self.clients.clear()
+
+    async def _drop_node(self, node_id: str):
+        """Пользователи отвалившегося воркера покидают комнаты"""
+        for room_id, users in list(self.presence.items()):
+            for user_id, owner in list(users.items()):
+                if owner == node_id:
+                    event = {"op": "leave", "room": room_id, "user": user_id,
+                             "origin": node_id, "reason": "node_lost"}
+                    apply_presence(self.presence, event)
+                    await self._forward(event)
+
+    async def _forward(self, event: dict, exclude: Optional[asyncio.StreamWriter] = None):
+        await asyncio.gather(*(
+            self._write(writer, event) for writer in list(self.clients) if writer is not exclude
+        ))
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, event: dict):
+        try:
+            writer.write(json.dumps(event, separators=(",", ":")).encode() + b"\n")
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+class LocalSocketBackplane(Backplane):
+    """Шина для нескольких воркеров на одной машине через unix-сокет.
+
+    Воркер, захвативший lock-файл, поднимает ретранслятор; все воркеры (включая
+    его самого) подключаются к нему как клиенты. Если ретранслятор пропал,
+    клиенты переизбирают его и заново объявляют своих участников.
+    """
+
+    def __init__(self, path: str = BACKPLANE_SOCKET):
+        super().__init__()
+        self.path = path
+        self._lock_file = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._hub: Optional[_SocketHub] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._stopped = False
+
+    async def start(self, on_event: EventHandler):
+        await super().start(on_event)
+        self._stopped = False
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=START_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Backplane at %s is not reachable yet, continuing in background", self.path)
+
+    async def stop(self):
+        self._stopped = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            self._hub.close()
+            self._hub = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        await super().stop()
+
+    async def _run(self):
+        while not self._stopped:
+            try:
+                await self._ensure_hub()
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=FRAME_LIMIT)
+            except OSError as e:
+                logger.debug("Backplane connect failed: %r", e)
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+
+            await _SocketHub._write(writer, {
+                "op": "hello",
+                "origin": self.node_id,
+                "presence": self.local_presence(),
+            })
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    event = json.loads(line)
+                    if event["op"] == "snapshot":
+                        await self._apply_snapshot(event["presence"])
+                        self._writer = writer
+                        self._ready.set()
+                        logger.info("Backplane node %s connected to %s", self.node_id, self.path)
+                    else:
+                        await self._receive(event)
+            except (ConnectionError, ValueError) as e:
+                logger.warning("Backplane connection lost: %r", e)
+            finally:
+                self._writer = None
+                writer.close()
+            if not self._stopped:
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _apply_snapshot(self, presence: Dict[str, Dict[str, str]]):
+        """Принимает состояние ретранслятора; пропавшие участники считаются ушедшими"""
+        previous, self.presence = self.presence, presence
+        self._recount()
+        for room_id, users in previous.items():
+            for user_id, node_id in users.items():
+                if node_id != self.node_id and user_id not in presence.get(room_id, {}):
+                    if self._on_event is not None:
+                        await self._on_event({"op": "leave", "room": room_id, "user": user_id,
+                                              "origin": node_id, "reason": "node_lost"})
+
+    async def _ensure_hub(self):
+        if self._server is not None:
+            return
+        if self._lock_file is None:
+            self._lock_file = open(self.path + ".lock", "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        # Lock наш: сокет, если остался, принадлежит умершему ретранслятору
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._hub = _SocketHub()
+        self._server = await asyncio.start_unix_server(self._hub.handle, self.path, limit=FRAME_LIMIT)
+        logger.info("Backplane hub started at %s", self.path)
+
+    async def _send(self, event: dict):
+        if self._writer is None:
+            log_event(logger, logging.WARNING, "backplane.local", "Backplane is not connected, %s event stays local",
+                      event["op"], room_id=event.get("room"))
+            return
+        await _SocketHub._write(self._writer, event)
+
+
+def create_backplane() -> Backplane:
+    if BACKPLANE == "memory":
+        return InMemoryBackplane()
+    if BACKPLANE == "socket":
+        return LocalSocketBackplane()
+    raise ValueError(f"Unknown BACKPLANE {BACKPLANE!r}, expected 'memory' or 'socket'")
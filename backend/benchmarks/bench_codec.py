@@ -0,0 +1,101 @@
+# bench_codec.py
+"""Стоимость обработки одного сигнального сообщения на сервере по кодекам.
+
+Запуск из каталога backend:
+
+    python benchmarks/bench_codec.py
+    python benchmarks/bench_codec.py --rounds 50000 --json > result.json
+
+reencode - прежний путь: разбор, копия с from_user_id и повторная сериализация;
+forward - разбор и дописывание from_user_id к исходному тексту (ConnectionManager.with_sender).
+Сообщения - offer с SDP на ~2 КБ, одиночный ICE-кандидат и сообщение чата.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from codec import JsonCodec, OrjsonCodec, append_field, orjson  # noqa: E402
+
+SDP_LINES = [
+    "v=0", "o=- 4611731400430051336 2 IN IP4 127.0.0.1", "s=-", "t=0 0",
+    "a=group:BUNDLE 0 1", "a=extmap-allow-mixed", "a=msid-semantic: WMS stream",
+]
+for mid, kind in ((0, "audio"), (1, "video")):
+    SDP_LINES += [
+        f"m={kind} 9 UDP/TLS/RTP/SAVPF 111 63 103 104 9 0 8 106 105 13 110 112 113 126",
+        "c=IN IP4 0.0.0.0", "a=rtcp:9 IN IP4 0.0.0.0",
+        "a=ice-ufrag:EsAw", "a=ice-pwd:bP+XJMM09aR8AiX1jdukzR6Y", "a=ice-options:trickle",
+        "a=fingerprint:sha-256 D2:FA:0E:C3:22:59:5E:14:95:69:92:3D:13:B4:84:24:2C:C2:A2:C0:3E:FD:34:8E:5E:EA:6F:AF:52:CE:E6:0F",
+        "a=setup:actpass", f"a=mid:{mid}", "a=sendrecv", "a=rtcp-mux",
+    ] + [f"a=rtpmap:{pt} codec{pt}/90000" for pt in range(96, 118)]
+SDP = "\r\n".join(SDP_LINES) + "\r\n"
+
+MESSAGES = {
+    "offer": {"type": "offer", "to_user_id": "17", "offer": {"type": "offer", "sdp": SDP}},
+    "ice-candidate": {"type": "ice-candidate", "to_user_id": "17", "candidate": {
+        "candidate": "candidate:842163049 1 udp 1677729535 203.0.113.7 46154 typ srflx "
+                     "raddr 0.0.0.0 rport 0 generation 0 ufrag EsAw network-cost 999",
+        "sdpMid": "0", "sdpMLineIndex": 0,
+    }},
+    "chat_message": {"type": "chat_message", "message": "Привет! Слышно меня?"},
+}
+
+
+def reencode(codec, raw: str, user_id: str) -> str:
+    data = codec.loads(raw)
+    return codec.dumps({**data, "from_user_id": user_id})
+
+
+def forward(codec, raw: str, user_id: str) -> str:
+    data = codec.loads(raw)
+    data["from_user_id"] = user_id
+    return append_field(raw, '"from_user_id":' + codec.dumps(user_id))
+
+
+def measure(codec, path, raw: str, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        path(codec, raw, "42")
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def run(rounds: int) -> list:
+    codecs = [JsonCodec()] + ([OrjsonCodec()] if orjson is not None else [])
+    results = []
+    for name, message in MESSAGES.items():
+        raw = json.dumps(message)
+        for codec in codecs:
+            for path in (reencode, forward):
+                results.append({
+                    "message": name,
+                    "bytes": len(raw.encode()),
+                    "codec": codec.name,
+                    "path": path.__name__,
+                    "us": round(measure(codec, path, raw, rounds), 3),
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=20000)
+    parser.add_argument("--json", action="store_true", help="вывод в JSON")
+    args = parser.parse_args()
+
+    results = run(args.rounds)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    baseline = {row["message"]: row["us"] for row in results if row["codec"] == "json" and row["path"] == "reencode"}
+    print(f"{'message':>14} {'bytes':>7} {'codec':>7} {'path':>9} {'us':>9} {'speedup':>8}")
+    for row in results:
+        print(f"{row['message']:>14} {row['bytes']:>7} {row['codec']:>7} {row['path']:>9} {row['us']:>9} "
+              f"{baseline[row['message']] / row['us']:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# bench_connection_manager.py
+"""Стоимость входа, выхода и рассылки в ConnectionManager в зависимости от размера комнаты.
+
+Запуск из каталога backend:
+
+    python benchmarks/bench_connection_manager.py --sizes 10 100 1000 5000
+    python benchmarks/bench_connection_manager.py --json > result.json
+
+join/leave - вход и выход одного дополнительного участника в комнату из N человек
+(включая рассылку user_joined/user_left остальным), broadcast - постановка одного
+сообщения в очереди всех участников. Отправка в сеть не измеряется: сокеты фиктивные.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backplane import InMemoryBackplane  # noqa: E402
+from websocket import OUTBOUND_QUEUE_SIZE, ConnectionManager  # noqa: E402
+
+
+class FakeWebSocket:
+    # Без предложенных subprotocol: соединение работает текстовыми JSON-кадрами
+    scope = {}
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def drain(manager: ConnectionManager):
+    """Ждет, пока писатели соединений разберут очереди"""
+    while any(connection.queue for connection in manager.connections.values()):
+        await asyncio.sleep(0)
+
+
+async def fill_room(manager: ConnectionManager, room_id: str, size: int):
+    for index in range(size):
+        await manager.connect(FakeWebSocket(), room_id, f"user-{index}")
+        if index % 100 == 99:
+            await drain(manager)
+    await drain(manager)
+
+
+async def measure_room(size: int, rounds: int) -> dict:
+    manager = ConnectionManager(backplane=InMemoryBackplane())
+    await manager.start()
+    room_id = f"bench_{size}"
+    await fill_room(manager, room_id, size)
+
+    join_total = leave_total = 0.0
+    for index in range(rounds):
+        websocket = FakeWebSocket()
+        user_id = f"guest-{index}"
+        start = time.perf_counter()
+        await manager.connect(websocket, room_id, user_id)
+        join_total += time.perf_counter() - start
+        await drain(manager)
+        start = time.perf_counter()
+        await manager.disconnect(websocket, room_id, user_id)
+        leave_total += time.perf_counter() - start
+        await drain(manager)
+
+    # Пачками меньше очереди соединения, чтобы никого не отключить как медленного
+    batch = max(1, min(100, OUTBOUND_QUEUE_SIZE // 2))
+    message = {"type": "chat_message", "user_id": "user-0", "message": "x" * 64}
+    broadcast_total = 0.0
+    sent = 0
+    while sent < rounds:
+        count = min(batch, rounds - sent)
+        start = time.perf_counter()
+        for _ in range(count):
+            await manager.broadcast(message, room_id)
+        broadcast_total += time.perf_counter() - start
+        sent += count
+        await drain(manager)
+
+    for connection in list(manager.connections.values()):
+        await manager.disconnect(connection.websocket, room_id, connection.user_id)
+    await manager.stop()
+
+    return {
+        "room_size": size,
+        "rounds": rounds,
+        "join_us": round(join_total / rounds * 1e6, 2),
+        "leave_us": round(leave_total / rounds * 1e6, 2),
+        "broadcast_us": round(broadcast_total / rounds * 1e6, 2),
+        "broadcast_per_recipient_ns": round(broadcast_total / rounds / size * 1e9, 1),
+    }
+
+
+async def run(sizes, rounds: int):
+    return [await measure_room(size, rounds) for size in sizes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="вывод в JSON")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    results = asyncio.run(run(args.sizes, args.rounds))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'room':>8} {'join, us':>12} {'leave, us':>12} {'broadcast, us':>15} {'per recipient, ns':>19}")
+    for row in results:
+        print(f"{row['room_size']:>8} {row['join_us']:>12} {row['leave_us']:>12} "
+              f"{row['broadcast_us']:>15} {row['broadcast_per_recipient_ns']:>19}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,453 @@
+# load_test.py
+"""Нагрузочный тест сигнализации и чата: N комнат по M участников.
+
+Участники ведут себя как WebRTCManager во фронтенде: получив existing_users,
+отправляют offer каждому участнику (to_user_id), на offer отвечают answer,
+после обмена шлют ICE-кандидаты, затем пишут в чат.
+
+Запуск из каталога backend:
+
+    # сервер поднимается на localhost в отдельном процессе с временной SQLite
+    python benchmarks/load_test.py --rooms 10 --participants 5 --duration 10
+
+    # уже запущенный сервер (память и CPU не измеряются, если не указан --server-pid)
+    python benchmarks/load_test.py --url http://localhost:8000
+
+Результат печатается в JSON (--output - еще и в файл), чтобы сравнивать релизы.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional
+
+import websockets
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHAT_PREFIX = "bench:"
+MSGPACK_SUBPROTOCOL = "conference.msgpack"
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+
+    def record(self, kind: str, seconds: float):
+        self.samples.setdefault(kind, []).append(seconds)
+
+    def summary(self) -> dict:
+        return {kind: _percentiles(values) for kind, values in sorted(self.samples.items())}
+
+
+def _percentiles(values: List[float]) -> dict:
+    ordered = sorted(values)
+
+    def pick(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "p50_ms": round(pick(0.50) * 1000, 3),
+        "p90_ms": round(pick(0.90) * 1000, 3),
+        "p99_ms": round(pick(0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+    }
+
+
+class ServerProcess:
+    """Сервер приложения в отдельном процессе: его память и CPU меряются отдельно от клиентов"""
+
+    def __init__(self, port: int, env: Dict[str, str]):
+        self.port = port
+        self.env = env
+        self.process: Optional[subprocess.Popen] = None
+        self._workdir = tempfile.TemporaryDirectory(prefix="conference-bench-")
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{self._workdir.name}/bench.db",
+            "PASSWORD_HASH_ROUNDS": "4",
+            "LOG_LEVEL": "WARNING",
+            "HOST": "127.0.0.1",
+            "PORT": str(self.port),
+            "RELOAD": "0",
+            **self.env,
+        }
+        # Тот же запуск, что и в Dockerfile
+        self.process = subprocess.Popen([sys.executable, "run.py"], cwd=BACKEND_DIR, env=env)
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+        self._workdir.cleanup()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def process_cpu_seconds(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            # Имя процесса может содержать пробелы - поля считаем после ')'
+            fields = stat.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def http_json(method: str, url: str, body: Optional[dict] = None, token: Optional[str] = None) -> dict:
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, headers=headers, method=method)
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read() or b"null")
+
+
+async def wait_until_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await asyncio.to_thread(http_json, "GET", base_url + "/")
+            return
+        except (urllib.error.URLError, ConnectionError, OSError):
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not become ready in {timeout}s")
+
+
+class Participant:
+    """Клиент, повторяющий протокол WebRTCManager"""
+
+    def __init__(self, bench: "LoadTest", room_id: int, user_id: int, token: str):
+        self.bench = bench
+        self.room_id = room_id
+        self.user_id = str(user_id)
+        self.token = token
+        self.websocket = None
+        self.peers = set()
+        self.negotiated = set()
+        self.chat_seq = 0
+        self.binary = False
+        self._reader: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        args = self.bench.args
+        caps = "?caps=heartbeat,ice-batch" if args.ice_batch else "?caps=heartbeat"
+        self.websocket = await websockets.connect(
+            f"{self.bench.ws_url}/ws/webrtc/{self.room_id}/{self.user_id}{caps}&token={self.token}",
+            max_size=None,
+            compression=None if args.no_deflate else "deflate",
+            subprotocols=[MSGPACK_SUBPROTOCOL] if args.codec == "msgpack" else None,
+        )
+        self.binary = self.websocket.subprotocol == MSGPACK_SUBPROTOCOL
+        self._reader = asyncio.create_task(self._read())
+
+    async def close(self):
+        if self.websocket is not None:
+            await self.websocket.close()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+
+    async def send(self, message: dict):
+        self.bench.sent[message["type"]] = self.bench.sent.get(message["type"], 0) + 1
+        await self.websocket.send(msgpack.packb(message) if self.binary else json.dumps(message))
+
+    async def _read(self):
+        try:
+            async for raw in self.websocket:
+                received_at = time.perf_counter()
+                message = msgpack.unpackb(raw) if isinstance(raw, bytes) else json.loads(raw)
+                self.bench.received[message.get("type")] = self.bench.received.get(message.get("type"), 0) + 1
+                await self._handle(message, received_at)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def _handle(self, message: dict, received_at: float):
+        message_type = message.get("type")
+        sent_at = message.get("bench_ts")
+        if sent_at is not None:
+            self.bench.latency.record(message_type, received_at - sent_at)
+
+        if message_type == "ping":
+            await self.send({"type": "pong"})
+        elif message_type == "existing_users":
+            for peer in message["users"]:
+                if peer not in self.peers:
+                    self.peers.add(peer)
+                    await self._signal("offer", peer, {"offer": self.bench.fake_sdp("offer")})
+        elif message_type == "user_joined":
+            self.peers.add(message["user_id"])
+        elif message_type == "offer":
+            peer = message["from_user_id"]
+            self.peers.add(peer)
+            await self._signal("answer", peer, {"answer": self.bench.fake_sdp("answer")})
+            await self._send_candidates(peer)
+            self._mark_negotiated(peer)
+        elif message_type == "answer":
+            peer = message["from_user_id"]
+            await self._send_candidates(peer)
+            self._mark_negotiated(peer)
+        elif message_type == "ice-candidates":
+            for candidate in message["candidates"]:
+                self.bench.latency.record("ice-candidate", received_at - candidate["bench_ts"])
+            self.bench.received["ice-candidate"] = (
+                self.bench.received.get("ice-candidate", 0) + len(message["candidates"]))
+        elif message_type == "chat_message":
+            text = message.get("message", "")
+            if text.startswith(CHAT_PREFIX):
+                sent_at = float(text.split(":", 3)[2])
+                self.bench.latency.record("chat_message", received_at - sent_at)
+
+    async def _signal(self, message_type: str, peer: str, payload: dict):
+        await self.send({"type": message_type, "to_user_id": peer, "bench_ts": time.perf_counter(), **payload})
+
+    async def _send_candidates(self, peer: str):
+        for index in range(self.bench.ice_candidates):
+            await self._signal("ice-candidate", peer, {"candidate": {
+                "candidate": f"candidate:{index} 1 udp 2122260223 10.0.0.{index % 250} {50000 + index} typ host",
+                "sdpMid": "0",
+                "sdpMLineIndex": 0,
+                "bench_ts": time.perf_counter(),
+            }})
+
+    def _mark_negotiated(self, peer: str):
+        if peer not in self.negotiated:
+            self.negotiated.add(peer)
+            self.bench.negotiations += 1
+
+    async def chat(self, interval: float, until: float):
+        # Случайный сдвиг, чтобы участники не писали синхронно
+        await asyncio.sleep(random.uniform(0, interval))
+        while time.perf_counter() < until:
+            self.chat_seq += 1
+            await self.send({
+                "type": "chat_message",
+                "message": f"{CHAT_PREFIX}{self.user_id}:{time.perf_counter()!r}:{self.chat_seq}",
+            })
+            await asyncio.sleep(interval)
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace, base_url: str, server_pid: Optional[int]):
+        self.args = args
+        self.base_url = base_url.rstrip("/")
+        self.ws_url = "ws" + self.base_url[len("http"):]
+        self.server_pid = server_pid
+        self.ice_candidates = args.ice_candidates
+        self.latency = LatencyRecorder()
+        self.sent: Dict[str, int] = {}
+        self.received: Dict[str, int] = {}
+        self.negotiations = 0
+        self.participants: List[Participant] = []
+        self._sdp = "v=0\r\n" + "a=bench-padding\r\n" * (args.sdp_bytes // 17)
+
+    def fake_sdp(self, kind: str) -> dict:
+        return {"type": kind, "sdp": self._sdp}
+
+    async def setup(self):
+        """Пользователи и комнаты через REST API (в чате участвуют только существующие пользователи)"""
+        suffix = f"{int(time.time())}-{os.getpid()}"
+        users = []
+        for index in range(self.args.rooms * self.args.participants):
+            token = await asyncio.to_thread(http_json, "POST", self.base_url + "/api/auth/register", {
+                "email": f"bench-{suffix}-{index}@example.com",
+                "name": f"Bench {index}",
+                "password": "bench-password",
+            })
+            me = await asyncio.to_thread(http_json, "GET", self.base_url + "/api/auth/me", None,
+                                         token["access_token"])
+            users.append((me["id"], token["access_token"]))
+
+        for room_index in range(self.args.rooms):
+            owner_token = users[room_index * self.args.participants][1]
+            room = await asyncio.to_thread(http_json, "POST", self.base_url + "/api/rooms",
+                                           {"name": f"bench-{suffix}-{room_index}"}, owner_token)
+            for slot in range(self.args.participants):
+                user_id, user_token = users[room_index * self.args.participants + slot]
+                self.participants.append(Participant(self, room["id"], user_id, user_token))
+
+    async def run(self) -> dict:
+        await self.setup()
+        rss_before = self._rss()
+
+        # Подключение и сигнализация
+        connect_started = time.perf_counter()
+        for participant in self.participants:
+            await participant.connect()
+            if self.args.connect_delay:
+                await asyncio.sleep(self.args.connect_delay)
+        expected = self.args.rooms * self.args.participants * (self.args.participants - 1)
+        deadline = time.perf_counter() + self.args.signaling_timeout
+        while self.negotiations < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        signaling_seconds = time.perf_counter() - connect_started
+        rss_connected = self._rss()
+
+        # Чат
+        sent_before = self.sent.get("chat_message", 0)
+        received_before = self.received.get("chat_message", 0)
+        cpu_before = self._cpu()
+        chat_started = time.perf_counter()
+        until = chat_started + self.args.duration
+        await asyncio.gather(*(participant.chat(1 / self.args.chat_rate, until)
+                               for participant in self.participants))
+        await asyncio.sleep(self.args.drain)
+        chat_seconds = time.perf_counter() - chat_started
+        cpu_after = self._cpu()
+        chat_sent = self.sent.get("chat_message", 0) - sent_before
+        chat_received = self.received.get("chat_message", 0) - received_before
+
+        for participant in self.participants:
+            await participant.close()
+
+        connections = len(self.participants)
+        server_cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+        return {
+            "config": {
+                "rooms": self.args.rooms,
+                "participants": self.args.participants,
+                "connections": connections,
+                "duration_s": self.args.duration,
+                "chat_rate_per_participant": self.args.chat_rate,
+                "ice_candidates_per_peer": self.ice_candidates,
+                "sdp_bytes": self.args.sdp_bytes,
+                "ice_batch": self.args.ice_batch,
+                "codec": self.args.codec,
+                "deflate": not self.args.no_deflate,
+                "target": self.base_url,
+            },
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+            "signaling": {
+                "negotiations": self.negotiations,
+                "expected_negotiations": expected,
+                "seconds": round(signaling_seconds, 3),
+            },
+            "chat": {
+                "sent": chat_sent,
+                "delivered": chat_received,
+                "expected_deliveries": chat_sent * self.args.participants,
+                "sent_per_s": round(chat_sent / self.args.duration, 1),
+                "delivered_per_s": round(chat_received / chat_seconds, 1),
+            },
+            "messages": {"sent": dict(sorted(self.sent.items())), "received": dict(sorted(self.received.items()))},
+            "latency": self.latency.summary(),
+            "server": {
+                "rss_before_bytes": rss_before,
+                "rss_connected_bytes": rss_connected,
+                "memory_per_connection_bytes": (
+                    (rss_connected - rss_before) // connections if rss_before and rss_connected else None
+                ),
+                "chat_cpu_seconds": round(server_cpu, 3) if server_cpu is not None else None,
+                "cpu_us_per_delivered_message": (
+                    round(server_cpu / chat_received * 1e6, 2) if server_cpu is not None and chat_received else None
+                ),
+            },
+        }
+
+    def _rss(self) -> Optional[int]:
+        return process_rss_bytes(self.server_pid) if self.server_pid else None
+
+    def _cpu(self) -> Optional[float]:
+        return process_cpu_seconds(self.server_pid) if self.server_pid else None
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="адрес уже запущенного сервера, например http://localhost:8000")
+    parser.add_argument("--server-pid", type=int, help="pid сервера для замеров памяти и CPU при --url")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--participants", type=int, default=5, help="участников в комнате")
+    parser.add_argument("--duration", type=float, default=10.0, help="длительность фазы чата, секунды")
+    parser.add_argument("--chat-rate", type=float, default=1.0, help="сообщений в секунду от участника")
+    parser.add_argument("--ice-candidates", type=int, default=4, help="ICE-кандидатов на каждую пару")
+    parser.add_argument("--ice-batch", action="store_true",
+                        help="заявлять capability ice-batch (на сервере нужен WS_ICE_BATCH_WINDOW_MS)")
+    parser.add_argument("--codec", choices=["json", "msgpack"], default="json",
+                        help="msgpack - бинарные кадры через subprotocol (нужен пакет msgpack)")
+    parser.add_argument("--no-deflate", action="store_true", help="не согласовывать permessage-deflate")
+    parser.add_argument("--sdp-bytes", type=int, default=3000, help="размер SDP в offer/answer")
+    parser.add_argument("--connect-delay", type=float, default=0.0, help="пауза между подключениями")
+    parser.add_argument("--signaling-timeout", type=float, default=30.0)
+    parser.add_argument("--drain", type=float, default=1.0, help="ожидание доставки после фазы чата")
+    parser.add_argument("--server-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="переменные окружения для запускаемого сервера")
+    parser.add_argument("--output", help="файл для JSON-результата")
+    return parser.parse_args(argv)
+
+
+async def main_async(args: argparse.Namespace) -> dict:
+    server = None
+    if args.url:
+        base_url, server_pid = args.url, args.server_pid
+    else:
+        env = dict(item.split("=", 1) for item in args.server_env)
+        server = ServerProcess(_free_port(), env)
+        server.start()
+        base_url, server_pid = server.url, server.process.pid
+    try:
+        await wait_until_ready(base_url)
+        return await LoadTest(args, base_url, server_pid).run()
+    finally:
+        if server is not None:
+            server.stop()
+
+
+def main():
+    args = parse_args()
+    if args.codec == "msgpack" and msgpack is None:
+        raise SystemExit("--codec msgpack requires the msgpack package")
+    result = asyncio.run(main_async(args))
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+# relay_test.py
+"""Медиа в одной комнате: полная сетка против серверного ретранслятора (media_relay.py).
+
+Участники - клиенты aiortc с синтетическими дорожками (видео заданного размера
+и тишина), сигнализация та же, что у фронтенда. В режиме mesh каждый участник
+отправляет свои дорожки каждому; в режиме relay - публикует один раз на сервер
+и подписывается на остальных.
+
+Запуск из каталога backend (нужен пакет aiortc):
+
+    python benchmarks/relay_test.py --mode relay --participants 6
+    python benchmarks/relay_test.py --mode mesh --participants 6 --output mesh.json
+
+Результат - JSON: время, за которое каждый участник получил видео всех остальных,
+частота принятых кадров, число соединений и CPU клиентов и сервера.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+import websockets
+from aiortc import RTCPeerConnection, RTCSessionDescription
+from aiortc.mediastreams import AudioStreamTrack, MediaStreamError, VideoStreamTrack
+from av import VideoFrame
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import (  # noqa: E402
+    ServerProcess, _free_port, http_json, process_cpu_seconds, wait_until_ready,
+)
+
+
+class SyntheticVideoTrack(VideoStreamTrack):
+    """Серые кадры заданного размера с частотой VideoStreamTrack (30 к/с)"""
+
+    def __init__(self, width: int, height: int):
+        super().__init__()
+        self.width = width
+        self.height = height
+
+    async def recv(self) -> VideoFrame:
+        pts, time_base = await self.next_timestamp()
+        frame = VideoFrame(width=self.width, height=self.height)
+        for plane in frame.planes:
+            plane.update(bytes([128]) * plane.buffer_size)
+        frame.pts = pts
+        frame.time_base = time_base
+        return frame
+
+
+class Participant:
+    def __init__(self, bench: "RelayTest", room_id: int, user_id: int, token: str):
+        self.bench = bench
+        self.room_id = room_id
+        self.user_id = str(user_id)
+        self.token = token
+        self.websocket = None
+        # Ключ - собеседник (mesh), "publish" или id публикующего (relay)
+        self.connections: Dict[str, RTCPeerConnection] = {}
+        self.consumers: List[asyncio.Task] = []
+        self._reader: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        self.websocket = await websockets.connect(
+            f"{self.bench.ws_url}/ws/webrtc/{self.room_id}/{self.user_id}?token={self.token}", max_size=None)
+        self._reader = asyncio.create_task(self._read())
+
+    async def close(self):
+        for task in self.consumers:
+            task.cancel()
+        await asyncio.gather(*(pc.close() for pc in self.connections.values()), return_exceptions=True)
+        if self.websocket is not None:
+            await self.websocket.close()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+
+    async def send(self, message: dict):
+        await self.websocket.send(json.dumps(message))
+
+    async def _read(self):
+        async for raw in self.websocket:
+            try:
+                await self._handle(json.loads(raw))
+            except Exception as e:  # ошибка одного сообщения не должна останавливать участника
+                self.bench.errors.append(f"{self.user_id}: {e!r}")
+
+    async def _handle(self, message: dict):
+        message_type = message.get("type")
+        sender = message.get("from_user_id")
+
+        # Полная сетка: новый участник отправляет offer каждому (как WebRTCManager)
+        if message_type == "existing_users" and self.bench.args.mode == "mesh":
+            for peer in message["users"]:
+                pc = self._peer_connection(peer, publish=True)
+                await pc.setLocalDescription(await pc.createOffer())
+                await self.send({"type": "offer", "to_user_id": peer, "offer": _description(pc)})
+        elif message_type == "offer":
+            pc = self._peer_connection(sender, publish=True)
+            await pc.setRemoteDescription(RTCSessionDescription(**message["offer"]))
+            await pc.setLocalDescription(await pc.createAnswer())
+            await self.send({"type": "answer", "to_user_id": sender, "answer": _description(pc)})
+        elif message_type == "answer":
+            await self.connections[sender].setRemoteDescription(RTCSessionDescription(**message["answer"]))
+
+        # Ретранслятор: одна публикация и подписка на каждого публикующего
+        elif message_type == "media_mode":
+            for publisher_id in message["publishers"]:
+                await self.send({"type": "subscribe", "publisher_id": publisher_id})
+            pc = self._peer_connection("publish", publish=True)
+            await pc.setLocalDescription(await pc.createOffer())
+            await self.send({"type": "publish", "offer": _description(pc)})
+        elif message_type == "publish-answer":
+            await self.connections["publish"].setRemoteDescription(RTCSessionDescription(**message["answer"]))
+        elif message_type == "publisher_added" and message["user_id"] != self.user_id:
+            await self.send({"type": "subscribe", "publisher_id": message["user_id"]})
+        elif message_type == "subscribe-offer":
+            publisher_id = message["publisher_id"]
+            pc = self._peer_connection(publisher_id, publish=False)
+            await pc.setRemoteDescription(RTCSessionDescription(**message["offer"]))
+            await pc.setLocalDescription(await pc.createAnswer())
+            await self.send({"type": "subscribe-answer", "publisher_id": publisher_id, "answer": _description(pc)})
+        elif message_type == "relay-error":
+            self.bench.errors.append(f"{self.user_id}: {message['error']}")
+
+    def _peer_connection(self, key: str, publish: bool) -> RTCPeerConnection:
+        pc = RTCPeerConnection()
+        if publish:
+            pc.addTrack(SyntheticVideoTrack(self.bench.args.width, self.bench.args.height))
+            pc.addTrack(AudioStreamTrack())
+
+        @pc.on("track")
+        def on_track(track):
+            if track.kind == "video" and key != "publish":
+                self.consumers.append(asyncio.create_task(self.bench.consume(self.user_id, key, track)))
+
+        self.connections[key] = pc
+        return pc
+
+
+def _description(pc: RTCPeerConnection) -> dict:
+    return {"type": pc.localDescription.type, "sdp": pc.localDescription.sdp}
+
+
+class RelayTest:
+    def __init__(self, args: argparse.Namespace, base_url: str, server_pid: Optional[int]):
+        self.args = args
+        self.base_url = base_url.rstrip("/")
+        self.ws_url = "ws" + self.base_url[len("http"):]
+        self.server_pid = server_pid
+        self.participants: List[Participant] = []
+        self.errors: List[str] = []
+        # (получатель, отправитель) -> время первого кадра и число кадров
+        self.first_frame: Dict[tuple, float] = {}
+        self.frames: Dict[tuple, int] = {}
+        self.started = 0.0
+        self.all_media = asyncio.Event()
+
+    async def consume(self, receiver: str, sender: str, track):
+        key = (receiver, sender)
+        expected = len(self.participants) * (len(self.participants) - 1)
+        try:
+            while True:
+                await track.recv()
+                if key not in self.first_frame:
+                    self.first_frame[key] = time.perf_counter() - self.started
+                    if len(self.first_frame) == expected:
+                        self.all_media.set()
+                self.frames[key] = self.frames.get(key, 0) + 1
+        except MediaStreamError:
+            pass
+
+    async def setup(self):
+        suffix = f"{int(time.time())}-{os.getpid()}"
+        users = []
+        for index in range(self.args.participants):
+            token = await asyncio.to_thread(http_json, "POST", self.base_url + "/api/auth/register", {
+                "email": f"relay-{suffix}-{index}@example.com",
+                "name": f"Relay {index}",
+                "password": "bench-password",
+            })
+            users.append((token["user"]["id"], token["access_token"]))
+        room = await asyncio.to_thread(http_json, "POST", self.base_url + "/api/rooms", {
+            "name": f"relay-{suffix}",
+            "media_relay": self.args.mode == "relay",
+        }, token["access_token"])
+        self.participants = [Participant(self, room["id"], user_id, user_token) for user_id, user_token in users]
+
+    async def run(self) -> dict:
+        await self.setup()
+        server_cpu_before = self._server_cpu()
+        client_cpu_before = time.process_time()
+        self.started = time.perf_counter()
+        for participant in self.participants:
+            await participant.connect()
+
+        try:
+            await asyncio.wait_for(self.all_media.wait(), self.args.setup_timeout)
+            media_ready = round(time.perf_counter() - self.started, 3)
+        except asyncio.TimeoutError:
+            media_ready = None
+        frames_before = dict(self.frames)
+        await asyncio.sleep(self.args.duration)
+        frames_after = dict(self.frames)
+        elapsed = time.perf_counter() - self.started
+        server_cpu = self._server_cpu()
+        client_cpu = time.process_time() - client_cpu_before
+
+        await asyncio.gather(*(participant.close() for participant in self.participants))
+
+        fps = [(frames_after.get(key, 0) - frames_before.get(key, 0)) / self.args.duration
+               for key in frames_after]
+        return {
+            "config": {
+                "mode": self.args.mode,
+                "participants": self.args.participants,
+                "video": f"{self.args.width}x{self.args.height}",
+                "duration_s": self.args.duration,
+                "target": self.base_url,
+            },
+            "media": {
+                "expected_streams": len(self.participants) * (len(self.participants) - 1),
+                "received_streams": len(self.first_frame),
+                "all_media_s": media_ready,
+                "max_first_frame_s": round(max(self.first_frame.values()), 3) if self.first_frame else None,
+                "mean_fps": round(sum(fps) / len(fps), 2) if fps else 0.0,
+                "min_fps": round(min(fps), 2) if fps else 0.0,
+            },
+            "peer_connections_per_client": sum(len(p.connections) for p in self.participants) / len(self.participants),
+            "cpu": {
+                "clients_seconds": round(client_cpu, 2),
+                "server_seconds": round(server_cpu - server_cpu_before, 2)
+                if server_cpu is not None and server_cpu_before is not None else None,
+                "elapsed_seconds": round(elapsed, 2),
+            },
+            "errors": self.errors[:20],
+        }
+
+    def _server_cpu(self) -> Optional[float]:
+        return process_cpu_seconds(self.server_pid) if self.server_pid else None
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="адрес уже запущенного сервера, например http://localhost:8000")
+    parser.add_argument("--server-pid", type=int, help="pid сервера для замеров CPU при --url")
+    parser.add_argument("--mode", choices=["mesh", "relay"], default="relay")
+    parser.add_argument("--participants", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0, help="замер частоты кадров, секунды")
+    parser.add_argument("--width", type=int, default=320)
+    parser.add_argument("--height", type=int, default=240)
+    parser.add_argument("--setup-timeout", type=float, default=30.0)
+    parser.add_argument("--server-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="переменные окружения для запускаемого сервера")
+    parser.add_argument("--output", help="файл для JSON-результата")
+    return parser.parse_args(argv)
+
+
+async def main_async(args: argparse.Namespace) -> dict:
+    server = None
+    if args.url:
+        base_url, server_pid = args.url, args.server_pid
+    else:
+        env = dict(item.split("=", 1) for item in args.server_env)
+        server = ServerProcess(_free_port(), env)
+        server.start()
+        base_url, server_pid = server.url, server.process.pid
+    try:
+        await wait_until_ready(base_url)
+        return await RelayTest(args, base_url, server_pid).run()
+    finally:
+        if server is not None:
+            server.stop()
+
+
+def main():
+    args = parse_args()
+    result = asyncio.run(main_async(args))
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
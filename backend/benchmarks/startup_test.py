@@ -0,0 +1,187 @@
+# startup_test.py
+"""Холодный старт воркера: от import main до готовности принимать запросы.
+
+Каждый замер - новый процесс Python на заранее размеченной миграциями БД:
+
+    import main      импорт приложения со всеми модулями (create_app внутри)
+    create_app       повторная сборка приложения - стоимость самой фабрики
+    startup          lifespan: запуск писателя чата и менеджера соединений
+    import_to_ready  import main + startup - через столько воркер готов
+
+Отдельно меряется полный запуск python run.py до первого ответа на GET /
+(интерпретатор, uvicorn, сокет) без миграций и тестовых данных - так
+стартует каждый следующий воркер.
+
+Запуск из каталога backend:
+
+    python benchmarks/startup_test.py --samples 5 --budget-ms 2000
+
+Результат печатается в JSON (--output - еще и в файл). Если максимальное
+import_to_ready превышает --budget-ms, код выхода 1 - проверку можно ставить в CI.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import BACKEND_DIR, ServerProcess, _free_port, _percentiles, http_json  # noqa: E402
+
+# Модули, которых не должно быть в памяти готового воркера: они нужны только по требованию
+LAZY_MODULES = ("aiortc", "av", "alembic")
+
+
+def probe() -> dict:
+    """Замер в текущем (свежем) процессе; вызывается с --probe"""
+    sys.path.insert(0, BACKEND_DIR)
+    start = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+    app = main.create_app()
+    created = time.perf_counter()
+
+    async def run_lifespan() -> Dict[str, float]:
+        context = main.lifespan(app)
+        begin = time.perf_counter()
+        await context.__aenter__()
+        ready = time.perf_counter()
+        await context.__aexit__(None, None, None)
+        return {"startup": ready - begin, "shutdown": time.perf_counter() - ready}
+
+    lifespan = asyncio.run(run_lifespan())
+    return {
+        "import_main_ms": round((imported - start) * 1000, 3),
+        "create_app_ms": round((created - imported) * 1000, 3),
+        "startup_ms": round(lifespan["startup"] * 1000, 3),
+        "shutdown_ms": round(lifespan["shutdown"] * 1000, 3),
+        "import_to_ready_ms": round((imported - start + lifespan["startup"]) * 1000, 3),
+        "modules": len(sys.modules),
+        "lazy_modules_loaded": [name for name in LAZY_MODULES if name in sys.modules],
+    }
+
+
+def _server_env(database_url: str) -> Dict[str, str]:
+    return {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "PASSWORD_HASH_ROUNDS": "4",
+        "LOG_LEVEL": "WARNING",
+    }
+
+
+def prepare_database(database_url: str) -> float:
+    """Миграции и тестовые данные - один раз, как run.py перед запуском воркеров"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "seed.py"], cwd=BACKEND_DIR, env=_server_env(database_url),
+                   check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def run_probe(database_url: str) -> dict:
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--probe"],
+        cwd=BACKEND_DIR, env=_server_env(database_url), check=True, capture_output=True, text=True,
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["process_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    return result
+
+
+def run_server(database_url: str, timeout: float) -> float:
+    """Секунды от запуска python run.py до первого ответа"""
+    server = ServerProcess(_free_port(), {"DATABASE_URL": database_url, "DB_MIGRATE": "0", "SEED_DATA": "0"})
+    start = time.perf_counter()
+    server.start()
+    try:
+        deadline = start + timeout
+        while time.perf_counter() < deadline:
+            if server.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.process.returncode}")
+            try:
+                http_json("GET", server.url + "/")
+                return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError, OSError):
+                # Частый опрос: шаг опроса не должен быть заметен на фоне замеряемого времени
+                time.sleep(0.01)
+        raise RuntimeError(f"Server at {server.url} did not become ready in {timeout}s")
+    finally:
+        server.stop()
+
+
+def _phase_summary(samples: List[dict], field: str) -> dict:
+    return _percentiles([sample[field] / 1000 for sample in samples])
+
+
+def run(args: argparse.Namespace) -> dict:
+    with tempfile.TemporaryDirectory(prefix="conference-startup-") as workdir:
+        database_url = f"sqlite:///{workdir}/startup.db"
+        migrate_seconds = prepare_database(database_url)
+        probes = [run_probe(database_url) for _ in range(args.samples)]
+        servers = [run_server(database_url, args.timeout) for _ in range(args.server_samples)]
+
+    worst = max(sample["import_to_ready_ms"] for sample in probes)
+    return {
+        "config": {
+            "samples": args.samples,
+            "server_samples": args.server_samples,
+            "budget_ms": args.budget_ms,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "migrate_and_seed_ms": round(migrate_seconds * 1000, 3),
+        "worker": {
+            field: _phase_summary(probes, field)
+            for field in ("import_main_ms", "create_app_ms", "startup_ms", "import_to_ready_ms",
+                          "shutdown_ms", "process_ms")
+        },
+        "modules": probes[-1]["modules"],
+        "lazy_modules_loaded": sorted({name for sample in probes for name in sample["lazy_modules_loaded"]}),
+        "run_py_to_first_response": _percentiles(servers) if servers else None,
+        "budget": {
+            "import_to_ready_max_ms": worst,
+            "within_budget": worst <= args.budget_ms,
+        },
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=5, help="замеров import main -> готовность")
+    parser.add_argument("--server-samples", type=int, default=3, help="замеров python run.py -> первый ответ")
+    parser.add_argument("--budget-ms", type=float, default=2000.0,
+                        help="допустимое import_to_ready воркера (по худшему замеру)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="ожидание первого ответа сервера")
+    parser.add_argument("--output", help="файл для JSON-результата")
+    parser.add_argument("--probe", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.probe:
+        print(json.dumps(probe()))
+        return
+    result = run(args)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    print(text)
+    if not result["budget"]["within_budget"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
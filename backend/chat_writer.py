@@ -0,0 +1,242 @@
+# chat_writer.py
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, InterfaceError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from database import AsyncSessionLocal
+from logging_setup import log_event
+from message_cache import message_cache
+import metrics
+from models import IdBlock, Message
+
+logger = logging.getLogger(__name__)
+
+# Максимум сообщений в одной транзакции
+CHAT_BATCH_SIZE = int(os.getenv("CHAT_BATCH_SIZE", "200"))
+# Сколько id сообщений воркер резервирует у БД за раз (строка "messages" в id_blocks)
+CHAT_ID_BLOCK = int(os.getenv("CHAT_ID_BLOCK", "1000"))
+ID_BLOCK_NAME = "messages"
+# Повтор записи при временных ошибках: задержка удваивается от CHAT_RETRY_DELAY до CHAT_RETRY_MAX_DELAY.
+# Пока писатель работает, повторы не ограничены; при остановке - не больше CHAT_WRITE_RETRIES
+CHAT_RETRY_DELAY = float(os.getenv("CHAT_RETRY_DELAY", "0.1"))
+CHAT_RETRY_MAX_DELAY = float(os.getenv("CHAT_RETRY_MAX_DELAY", "5"))
+CHAT_WRITE_RETRIES = int(os.getenv("CHAT_WRITE_RETRIES", "5"))
+
+# Ошибки данных конкретной строки: ее повтор не поможет
+ROW_ERRORS = (IntegrityError, DataError)
+
+
+def is_transient(error: Exception) -> bool:
+    """Ошибка, после которой та же запись может пройти: блокировка БД, обрыв соединения, таймаут пула"""
+    if isinstance(error, (OperationalError, InterfaceError, PoolTimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+class ChatWriter:
+    """Фоновая пакетная запись сообщений чата в БД.
+
+    Сообщение получает id и created_at сразу при постановке в очередь, поэтому
+    его можно разослать участникам не дожидаясь записи на диск. Все, что успело
+    попасть в очередь, записывается при остановке.
+
+    id выдаются из блока, зарезервированного в таблице id_blocks (hi/lo):
+    блоки воркеров не пересекаются, поэтому у сообщений с разных воркеров
+    разные id. К БД обращается одно сообщение из CHAT_ID_BLOCK; id не
+    убывают внутри воркера, но между воркерами не упорядочены по времени.
+    """
+
+    def __init__(self, batch_size: int = CHAT_BATCH_SIZE, id_block: int = CHAT_ID_BLOCK):
+        self.batch_size = batch_size
+        self.id_block = id_block
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Свободные id текущего блока: [_next_id, _block_end)
+        self._next_id = 0
+        self._block_end = 0
+        self._reserve_lock: Optional[asyncio.Lock] = None
+        # room_id -> сообщения в очереди или в пишущейся пачке
+        self._unwritten: Dict[int, int] = {}
+        self._stopping = False
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._reserve_lock = asyncio.Lock()
+        self._stopping = False
+        await self._reserve_block()
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        logger.info("Chat writer started, message ids %d..%d", self._next_id, self._block_end - 1)
+
+    async def stop(self):
+        """Дописывает очередь и останавливает писателя"""
+        if self._task is None:
+            return
+        self._stopping = True
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        logger.info("Chat writer stopped")
+
+    async def submit(self, room_id: int, user_id: int, content: str) -> dict:
+        """Ставит сообщение в очередь на запись и возвращает его с назначенными id и временем"""
+        if self._task is None:
+            raise RuntimeError("Chat writer is not started")
+        row = {
+            "id": await self._allocate_id(),
+            "room_id": room_id,
+            "user_id": user_id,
+            "content": content,
+            "created_at": datetime.now(timezone.utc),
+        }
+        self._unwritten[room_id] = self._unwritten.get(room_id, 0) + 1
+        self._queue.put_nowait(row)
+        return row
+
+    def unwritten(self, room_id: int) -> int:
+        """Сколько сообщений комнаты еще не записано в БД (чтение из БД их не увидит)"""
+        return self._unwritten.get(room_id, 0)
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            row = await self._queue.get()
+            batch = []
+            if row is None:
+                stopping = True
+            else:
+                batch.append(row)
+            # Все, что накопилось пока шла предыдущая запись, уходит одной транзакцией
+            while len(batch) < self.batch_size and not self._queue.empty():
+                row = self._queue.get_nowait()
+                if row is None:
+                    stopping = True
+                    continue
+                batch.append(row)
+            if batch:
+                start = time.perf_counter()
+                await self._write_batch(batch)
+                metrics.chat_persist_seconds.observe(time.perf_counter() - start)
+                metrics.chat_persist_batch.observe(len(batch))
+                for row in batch:
+                    left = self._unwritten[row["room_id"]] - 1
+                    if left:
+                        self._unwritten[row["room_id"]] = left
+                    else:
+                        del self._unwritten[row["room_id"]]
+
+    async def _allocate_id(self) -> int:
+        # Пока в блоке есть id, ожидания нет; новый блок резервирует одна корутина
+        while self._next_id >= self._block_end:
+            async with self._reserve_lock:
+                if self._next_id >= self._block_end:
+                    await self._reserve_block()
+        message_id = self._next_id
+        self._next_id += 1
+        return message_id
+
+    async def _reserve_block(self):
+        """Атомарно сдвигает счетчик в id_blocks на размер блока и забирает диапазон себе"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(IdBlock)
+                .where(IdBlock.name == ID_BLOCK_NAME)
+                .values(next_id=IdBlock.next_id + self.id_block)
+                .returning(IdBlock.next_id)
+            )
+            block_end = result.scalar()
+            if block_end is None:
+                raise RuntimeError("id_blocks has no 'messages' row; run database migrations (alembic upgrade head)")
+            await db.commit()
+        self._next_id, self._block_end = block_end - self.id_block, block_end
+
+    async def _write_batch(self, rows: List[dict]):
+        """Записывает пачку; не записанные строки убираются из кэша и учитываются в метрике.
+
+        Временные ошибки (блокировка БД, обрыв соединения, таймаут пула)
+        повторяются для всей пачки с нарастающей задержкой. Ошибка строки
+        (IntegrityError, DataError) переводит пачку в запись по одной строке,
+        и отбрасываются только строки, которые записать нельзя.
+        """
+        try:
+            await self._with_retries(self._insert, rows)
+            return
+        except ROW_ERRORS as e:
+            log_event(logger, logging.WARNING, "chat.batch_failed", "Chat batch of %d failed (%s), retrying row by row",
+                      len(rows), getattr(e, "orig", e))
+        except Exception as e:
+            self._drop(rows, "shutdown" if self._stopping else "error", e)
+            return
+
+        for row in rows:
+            try:
+                await self._write_row(row)
+            except Exception as e:
+                self._drop([row], "rejected" if isinstance(e, ROW_ERRORS) else "error", e)
+
+    async def _write_row(self, row: dict):
+        try:
+            await self._with_retries(self._insert, [row])
+        except IntegrityError:
+            if not await self._id_taken(row["id"]):
+                raise
+            # id занят записью, сделанной в обход писателя: берем следующий id из своего блока
+            old_id = row["id"]
+            row["id"] = await self._allocate_id()
+            await self._with_retries(self._insert, [row])
+            # В кэше последних сообщений оно лежит под прежним id
+            message_cache.invalidate(row["room_id"])
+            logger.warning("Message id %s was taken, stored as %s", old_id, row["id"])
+
+    async def _with_retries(self, operation, rows: List[dict]):
+        """Повторяет операцию при временных ошибках; при остановке - не больше CHAT_WRITE_RETRIES раз"""
+        attempt = 0
+        while True:
+            try:
+                return await operation(rows)
+            except Exception as e:
+                if not is_transient(e):
+                    raise
+                attempt += 1
+                if self._stopping and attempt > CHAT_WRITE_RETRIES:
+                    raise
+                delay = min(CHAT_RETRY_MAX_DELAY, CHAT_RETRY_DELAY * 2 ** (attempt - 1))
+                metrics.chat_write_retries.inc()
+                log_event(logger, logging.WARNING, "chat.retry", "Chat write of %d messages failed (%s), retry %d in %.2fs",
+                          len(rows), getattr(e, "orig", e), attempt, delay)
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    async def _insert(rows: List[dict]):
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(insert(Message), rows)
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+
+    @staticmethod
+    async def _id_taken(message_id: int) -> bool:
+        async with AsyncSessionLocal() as db:
+            return await db.scalar(select(Message.id).where(Message.id == message_id)) is not None
+
+    @staticmethod
+    def _drop(rows: List[dict], reason: str, error: Exception):
+        """Сообщения уже разосланы, но в БД их не будет: убираем их из кэша истории"""
+        metrics.chat_dropped.labels(reason).inc(len(rows))
+        for row in rows:
+            message_cache.discard(row["room_id"], row["id"])
+            logger.error("❌ CHAT WRITE ERROR: message %s dropped (%s): %s", row["id"], reason, error,
+                         extra={"room_id": f"webrtc_{row['room_id']}", "user_id": str(row["user_id"])})
+
+
+chat_writer = ChatWriter()
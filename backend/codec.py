@@ -0,0 +1,65 @@
+# codec.py
+import json
+import os
+from typing import Any, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # orjson - необязательная зависимость, без нее работает stdlib json
+    orjson = None
+
+# auto - orjson, если установлен; json - всегда stdlib; orjson - обязательно orjson
+WS_JSON_CODEC = os.getenv("WS_JSON_CODEC", "auto")
+
+
+class JsonCodec:
+    """JSON через stdlib (тот же формат, что у WebSocket.send_json, но без пробелов)"""
+    name = "json"
+
+    @staticmethod
+    def loads(data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(message: Any) -> str:
+        return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+class OrjsonCodec:
+    name = "orjson"
+
+    @staticmethod
+    def loads(data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+
+    @staticmethod
+    def dumps(message: Any) -> str:
+        return orjson.dumps(message).decode()
+
+
+def create_codec(name: str = WS_JSON_CODEC):
+    if name == "auto":
+        return OrjsonCodec() if orjson is not None else JsonCodec()
+    if name == "orjson":
+        if orjson is None:
+            raise ValueError("WS_JSON_CODEC=orjson requires the orjson package")
+        return OrjsonCodec()
+    if name == "json":
+        return JsonCodec()
+    raise ValueError(f"Unknown WS_JSON_CODEC {name!r}, expected 'auto', 'orjson' or 'json'")
+
+
+def append_field(raw: str, encoded_field: str) -> Optional[str]:
+    """Дописывает готовую пару "ключ":значение в конец JSON-объекта без его разбора.
+
+    raw - текст уже успешно разобранного объекта. Если такой ключ в объекте уже
+    есть, при разборе побеждает последний, то есть дописанный. None - если raw
+    не похож на объект и сообщение нужно сериализовать заново.
+    """
+    body = raw.rstrip()
+    if not body.endswith("}"):
+        return None
+    head = body[:-1].rstrip()
+    if head.endswith("{"):
+        return head + encoded_field + "}"
+    return head + "," + encoded_field + "}"
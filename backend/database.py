@@ -1,20 +1,215 @@
 # database.py
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
-# Для Docker используй 'postgres' вместо 'localhost'
-# Для локальной разработки можно оставить localhost
 import os
+import threading
+import time
 
-DATABASE_URL = "sqlite:///./conference.db"
-engine = create_engine(DATABASE_URL)
+import metrics
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./conference.db")
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Асинхронные драйверы для той же БД: aiosqlite локально и в тестах, asyncpg для Postgres
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def async_database_url(url: str) -> str:
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver configured for {url!r}")
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(DATABASE_URL)
+
+# Пул соединений (для SQLite тоже: каждый поток получает свое соединение)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Сколько SQLite ждет снятия блокировки, прежде чем вернуть "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+class PoolMetrics:
+    """Ожидание соединения из пула и таймауты"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.checkouts += 1
+            if timed_out:
+                self.timeouts += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+
+class InstrumentedPoolMixin:
+    """Замер времени ожидания свободного соединения в QueuePool"""
+    metrics: PoolMetrics
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        self.metrics.record_wait(time.perf_counter() - start)
+        return connection
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    metrics = PoolMetrics()
+
+
+class InstrumentedAsyncQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    metrics = PoolMetrics()
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL: чтение истории не ждет записи чата; NORMAL: без fsync на каждый commit"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+def _engine_options(url: str, poolclass) -> dict:
+    if url.startswith("sqlite"):
+        if ":memory:" in url or make_url(url).database in (None, ""):
+            return {"connect_args": {"check_same_thread": False}}
+        return {
+            "poolclass": poolclass,
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        }
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+def build_engine(url: str = DATABASE_URL):
+    engine = create_engine(url, **_engine_options(url, InstrumentedQueuePool))
+    if url.startswith("sqlite"):
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+    return engine
+
+
+def build_async_engine(url: str = ASYNC_DATABASE_URL):
+    engine = create_async_engine(url, **_engine_options(url, InstrumentedAsyncQueuePool))
+    if url.startswith("sqlite"):
+        event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas)
+    return engine
+
+
+def _pool_stats(pool) -> dict:
+    stats = {}
+    if isinstance(pool, InstrumentedPoolMixin):
+        stats.update({
+            "checkouts": pool.metrics.checkouts,
+            "timeouts": pool.metrics.timeouts,
+            "wait_seconds_total": round(pool.metrics.wait_seconds_total, 6),
+            "wait_seconds_max": round(pool.metrics.wait_seconds_max, 6),
+        })
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        stats.update({
+            "pool_size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            # QueuePool.overflow() отрицателен, пока пул не заполнен (-pool_size у пустого пула)
+            "overflow": max(0, pool.overflow()),
+            "saturation": round(pool.checkedout() / capacity, 4) if capacity else 0.0,
+        })
+    return stats
+
+
+def pool_stats() -> dict:
+    """Состояние пулов: занятость, насыщение и ожидание соединений"""
+    return {
+        "sync": _pool_stats(engine.pool),
+        "async": _pool_stats(async_engine.sync_engine.pool),
+    }
+
+
+engine = build_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Сессии для кода в event loop (websocket и async-обработчики)
+async_engine = build_async_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+
+# Состояние пулов в /metrics
+def _pool_metric(field: str):
+    def collect():
+        return {name: stats.get(field, 0) for name, stats in pool_stats().items()}
+    return collect
+
+
+for _field, _documentation in (
+    ("checked_out", "Database connections in use"),
+    ("pool_size", "Database connections kept in the pool"),
+    ("overflow", "Database connections opened above pool_size"),
+):
+    metrics.registry.gauge(f"conference_db_pool_{_field}", _documentation, ["pool"], _pool_metric(_field))
+
+# Накопительные значения пула - счетчики: rate() по ним дает частоту ожиданий и таймаутов
+for _field, _name, _documentation in (
+    ("checkouts", "checkouts_total", "Database connection checkouts"),
+    ("timeouts", "timeouts_total", "Database connection checkouts that timed out"),
+    ("wait_seconds_total", "wait_seconds_total", "Time spent waiting for a database connection"),
+):
+    metrics.registry.counter_func(f"conference_db_pool_{_name}", _documentation, ["pool"], _pool_metric(_field))
+
+
+def upgrade_schema(revision: str = "head"):
+    """Доводит схему БД до ревизии alembic (по умолчанию до последней).
+
+    Вызывается один раз до запуска воркеров (run.py) или вручную:
+    alembic upgrade head. alembic импортируется только здесь - воркеры его не грузят.
+    """
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(os.path.join(BACKEND_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(BACKEND_DIR, "alembic"))
+    # Логирование уже настроено приложением; fileConfig из alembic.ini его бы сбросил
+    config.attributes["configure_logger"] = False
+    command.upgrade(config, revision)
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,98 @@
+# event_log.py
+"""Журнал событий комнаты для быстрого переподключения.
+
+Каждое событие, доставляемое клиентам комнаты на этом воркере (рассылка или
+адресное сообщение), получает номер seq и попадает в кольцевой буфер на
+WS_EVENT_LOG_SIZE последних событий; номер уходит клиенту полем "seq".
+
+Клиент с capability resume получает при подключении
+{"type": "session", "session": <эпоха журнала>, "seq": <последний номер>}.
+Если его сокет оборвался без чистого закрытия, присутствие пользователя
+держится WS_RESUME_GRACE секунд: остальные участники не получают user_left
+и не перестраивают соединения. Переподключившись с ?resume=<session>:<seq>,
+клиент получает только пропущенные события - без user_joined, existing_users
+и повторных offer. Если журнал уже не содержит нужных событий (буфер
+переполнился, пользователь вышел по таймауту, другой воркер), подключение
+проходит как обычное, а в session приходит resumed: false - клиенту нужна
+полная синхронизация.
+"""
+import os
+import uuid
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+# Сколько последних событий комнаты хранится для повторной отправки (0 - журнал выключен)
+EVENT_LOG_SIZE = int(os.getenv("WS_EVENT_LOG_SIZE", "256"))
+# Сколько секунд держать присутствие пользователя, чей сокет оборвался
+RESUME_GRACE = float(os.getenv("WS_RESUME_GRACE", "15"))
+CAP_RESUME = "resume"
+
+
+def parse_resume(value: Optional[str]) -> Optional[Tuple[str, int]]:
+    """Точка возобновления из параметра подключения: ?resume=<session>:<seq>"""
+    if not value:
+        return None
+    session, _, seq = value.rpartition(":")
+    if not session or not seq.isdigit():
+        return None
+    return session, int(seq)
+
+
+class _Event:
+    __slots__ = ("seq", "recipient", "exclude_user", "type", "text")
+
+    def __init__(self, seq: int, recipient: Optional[str], exclude_user: Optional[str],
+                 message_type: Optional[str], text: str):
+        self.seq = seq
+        # None - рассылка всем, кроме exclude_user; иначе адресное сообщение
+        self.recipient = recipient
+        self.exclude_user = exclude_user
+        self.type = message_type
+        self.text = text
+
+
+class RoomEventLog:
+    """Кольцевой буфер событий одной комнаты и пользователи, ожидающие переподключения"""
+    __slots__ = ("epoch", "seq", "events", "parked")
+
+    def __init__(self, size: int = EVENT_LOG_SIZE):
+        # Эпоха отличает этот журнал от прежних журналов комнаты и журналов других воркеров
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.events: Deque[_Event] = deque(maxlen=size)
+        # user_id -> таймер окончания ожидания переподключения
+        self.parked: Dict[str, object] = {}
+
+    def next_seq(self) -> int:
+        self.seq += 1
+        return self.seq
+
+    def record(self, seq: int, recipient: Optional[str], exclude_user: Optional[str],
+               message_type: Optional[str], text: str):
+        if self.events.maxlen:
+            self.events.append(_Event(seq, recipient, exclude_user, message_type, text))
+
+    def replay(self, session: str, since: int, user_id: str) -> Optional[List[Tuple[Optional[str], str]]]:
+        """События после since, адресованные user_id: [(тип, текст)].
+
+        None - продолжить с этого места нельзя: чужой журнал, номер из будущего
+        или часть пропущенных событий уже вытеснена из буфера.
+        """
+        if session != self.epoch or since > self.seq:
+            return None
+        first = self.events[0].seq if self.events else self.seq + 1
+        if since < first - 1:
+            return None
+        return [
+            (event.type, event.text) for event in self.events
+            if event.seq > since and (event.recipient == user_id
+                                      or (event.recipient is None and event.exclude_user != user_id))
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "session": self.epoch,
+            "seq": self.seq,
+            "buffered": len(self.events),
+            "parked": list(self.parked),
+        }
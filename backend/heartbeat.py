@@ -0,0 +1,128 @@
+# heartbeat.py
+"""Heartbeat соединений на одном таймере: хешированное колесо вместо задачи на сокет.
+
+Клиент, заявивший capability heartbeat, получает {"type": "ping"} после
+WS_HEARTBEAT_INTERVAL секунд тишины и должен ответить {"type": "pong"}; живым
+соединение делает любой входящий кадр. Если за WS_HEARTBEAT_TIMEOUT после
+ping ничего не пришло, соединение снимается вместе с присутствием и
+остальные участники получают user_left.
+
+Колесо делится на слоты по WS_HEARTBEAT_TICK секунд. Соединение лежит в слоте
+своего ближайшего срока; входящий кадр меняет только last_seen, а срок
+пересчитывается, когда до слота доходит очередь. Каждый тик обрабатывает
+только соединения своего слота.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 0 - heartbeat выключен (остаются только ping-кадры протокола в uvicorn, см. run.py)
+HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "10"))
+HEARTBEAT_TIMEOUT = float(os.getenv("WS_HEARTBEAT_TIMEOUT", "10"))
+HEARTBEAT_TICK = float(os.getenv("WS_HEARTBEAT_TICK", "1"))
+CAP_HEARTBEAT = "heartbeat"
+
+
+class HeartbeatWheel:
+    def __init__(self, manager, interval: float = HEARTBEAT_INTERVAL, timeout: float = HEARTBEAT_TIMEOUT,
+                 tick: float = HEARTBEAT_TICK):
+        self.manager = manager
+        self.interval = interval
+        self.timeout = timeout
+        self.tick = tick
+        # Самый дальний срок - max(interval, timeout) вперед: колесо не делает больше одного оборота
+        size = math.ceil(max(interval, timeout) / tick) + 2 if interval > 0 else 1
+        self.slots: List[Set] = [set() for _ in range(size)]
+        self.position = 0
+        self.pings = 0
+        self.reaped = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def add(self, connection):
+        connection.last_seen = time.monotonic()
+        self._schedule(connection, self.interval)
+
+    def discard(self, connection):
+        if connection.wheel_slot is not None:
+            self.slots[connection.wheel_slot].discard(connection)
+            connection.wheel_slot = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "interval": self.interval,
+            "timeout": self.timeout,
+            "tracked": sum(len(slot) for slot in self.slots),
+            "pings": self.pings,
+            "reaped": self.reaped,
+        }
+
+    def _schedule(self, connection, delay: float):
+        ticks = min(len(self.slots) - 1, max(1, math.ceil(delay / self.tick)))
+        slot = (self.position + ticks) % len(self.slots)
+        self.slots[slot].add(connection)
+        connection.wheel_slot = slot
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            # Тики по расписанию, а не sleep(tick) после обработки: колесо не отстает под нагрузкой
+            deadline += self.tick
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+            try:
+                await self._advance()
+            except Exception:
+                logger.exception("Heartbeat tick failed")
+
+    async def _advance(self):
+        self.position = (self.position + 1) % len(self.slots)
+        due = self.slots[self.position]
+        if not due:
+            return
+        self.slots[self.position] = set()
+
+        now = time.monotonic()
+        dead = []
+        for connection in due:
+            connection.wheel_slot = None
+            if connection.closed:
+                continue
+            idle = now - connection.last_seen
+            if idle >= self.interval + self.timeout:
+                dead.append(connection)
+            elif idle >= self.interval:
+                # ping уходит один раз за период тишины; следующий срок - конец ожидания ответа
+                if not connection.pinged:
+                    connection.pinged = True
+                    self.pings += 1
+                    await self.manager.ping(connection)
+                    if connection.closed:
+                        continue
+                self._schedule(connection, self.interval + self.timeout - idle)
+            else:
+                connection.pinged = False
+                self._schedule(connection, self.interval - idle)
+
+        if dead:
+            self.reaped += len(dead)
+            await self.manager.reap(dead)
@@ -0,0 +1,206 @@
+# logging_setup.py
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+# text - человекочитаемые строки; json - одна JSON-запись на строку
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Запись в поток в отдельном потоке через QueueHandler/QueueListener
+LOG_QUEUE = os.getenv("LOG_QUEUE", "1") == "1"
+# Доля записей горячих событий, которая попадает в лог: "ws.ice=0.01,ws.broadcast=0.05"
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "ws.ice=0.01,ws.broadcast=0.01,ws.message=0.1")
+# Не больше N записей события в секунду, "*" - для всех остальных: "*=50,ws.chat=200"
+LOG_RATE_LIMIT = os.getenv("LOG_RATE_LIMIT", "*=50")
+
+# Поля из extra, которые выводятся в структурированной записи
+CONTEXT_FIELDS = ("event", "room_id", "user_id", "suppressed")
+# Логгеры, в записи которых попадает путь с query-строкой рукопожатия websocket
+REDACTED_LOGGERS = ("uvicorn.error",)
+_TOKEN_PARAM = re.compile(r"([?&]token=)[^&\s\"]*")
+
+
+def _parse_rules(spec: str) -> Dict[str, float]:
+    rules = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, value = item.partition("=")
+        rules[name.strip()] = float(value)
+    return rules
+
+
+class _EventState:
+    __slots__ = ("every", "seen", "window", "emitted", "suppressed")
+
+    def __init__(self, every: int):
+        self.every = every
+        self.seen = 0
+        self.window = 0
+        self.emitted = 0
+        self.suppressed = 0
+
+
+class EventSampler:
+    """Сэмплирование и ограничение частоты записей по типу события.
+
+    Решение принимается до создания LogRecord, поэтому отброшенная запись
+    не стоит ни форматирования, ни выделения памяти.
+    """
+
+    def __init__(self, sample: Dict[str, float], rate_limit: Dict[str, float]):
+        self.sample = sample
+        self.rate_limit = rate_limit
+        self.default_limit = rate_limit.get("*", 0)
+        self._events: Dict[str, _EventState] = {}
+
+    def allow(self, event: str) -> Optional[int]:
+        """None - запись отбрасывается, иначе число записей, пропущенных перед ней"""
+        state = self._events.get(event)
+        if state is None:
+            rate = self.sample.get(event, 1.0)
+            every = max(1, round(1 / rate)) if rate > 0 else 0
+            state = self._events[event] = _EventState(every)
+
+        state.seen += 1
+        if state.every == 0 or state.seen % state.every:
+            state.suppressed += 1
+            return None
+
+        limit = self.rate_limit.get(event, self.default_limit)
+        if limit:
+            window = int(time.monotonic())
+            if window != state.window:
+                state.window = window
+                state.emitted = 0
+            if state.emitted >= limit:
+                state.suppressed += 1
+                return None
+            state.emitted += 1
+
+        suppressed, state.suppressed = state.suppressed, 0
+        return suppressed
+
+    def stats(self) -> dict:
+        return {event: {"seen": state.seen, "pending_suppressed": state.suppressed}
+                for event, state in self._events.items()}
+
+
+sampler = EventSampler(_parse_rules(LOG_SAMPLE), _parse_rules(LOG_RATE_LIMIT))
+
+
+def log_event(logger: logging.Logger, level: int, event: str, msg: str, *args,
+              room_id: Optional[str] = None, user_id: Optional[str] = None):
+    """Запись горячего события: уровень и сэмплирование проверяются до форматирования"""
+    if not logger.isEnabledFor(level):
+        return
+    suppressed = sampler.allow(event)
+    if suppressed is None:
+        return
+    logger.log(level, msg, *args, stacklevel=2, extra={
+        "event": event, "room_id": room_id, "user_id": user_id, "suppressed": suppressed,
+    })
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON с контекстом комнаты и пользователя"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            line += f" (+{suppressed} suppressed)"
+        return line
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без форматирования в потоке event loop: запись форматирует слушатель"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class TokenRedactingFilter(logging.Filter):
+    """Скрывает ?token=... в аргументах записи.
+
+    uvicorn пишет в uvicorn.error путь с query-строкой на каждое принятое и
+    отклоненное (403) рукопожатие websocket, а клиент передает JWT в ?token=.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.args, tuple) and any(isinstance(arg, str) and "token=" in arg for arg in record.args):
+            record.args = tuple(
+                _TOKEN_PARAM.sub(r"\1***", arg) if isinstance(arg, str) else arg for arg in record.args
+            )
+        return True
+
+
+def _install_token_redaction():
+    for name in REDACTED_LOGGERS:
+        logger = logging.getLogger(name)
+        if not any(isinstance(existing, TokenRedactingFilter) for existing in logger.filters):
+            logger.addFilter(TokenRedactingFilter())
+
+
+def setup_logging():
+    """Настройка корневого логгера приложения (повторный вызов ничего не делает)"""
+    global _listener
+    # Фильтр ставится при каждом вызове: uvicorn настраивает свои логгеры между run.py и create_app
+    _install_token_redaction()
+    root = logging.getLogger()
+    if getattr(root, "_conference_configured", False):
+        return
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    root.setLevel(LOG_LEVEL)
+
+    if LOG_QUEUE:
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        root.addHandler(_DeferredQueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+    else:
+        root.addHandler(handler)
+    root._conference_configured = True
+
+
+def stop_logging():
+    """Дописывает очередь логов и останавливает поток записи"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,78 +1,82 @@
-import os
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
-from typing import List 
-from sqlalchemy.orm import Session
-from websocket import manager
-from database import SessionLocal, engine, get_db
-from models import Base, Room, User
-import schemas
-import auth
+# main.py
+"""HTTP и WebSocket API конференций.
+
+Приложение собирает create_app(): маршруты, middleware и запуск фоновых
+служб (писатель чата, менеджер соединений) в lifespan. При импорте модуля
+ничего не происходит с БД: схема ведется миграциями alembic
+(database.upgrade_schema, вызывается из run.py один раз до запуска
+воркеров), тестовые данные - seed.py.
+"""
+import json
+import logging
+import math
 import secrets
 import string
-from datetime import timedelta
-import logging
-from typing import List, Optional
-from fastapi import WebSocket, WebSocketDisconnect
-import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
 from typing import List, Optional
+
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Query, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy import and_, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from websocket import manager
-from database import SessionLocal, engine, get_db
-from models import Base, Room, User, Message
-import schemas
+from starlette.concurrency import run_in_threadpool
+
 import auth
-import secrets
-import string
-from datetime import timedelta
-import os
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from websocket import manager
-from database import SessionLocal, engine, get_db
-# Import models module directly instead of individual classes
+import metrics
 import models
 import schemas
-import auth
-import secrets
-import string
-from datetime import timedelta
-import logging
-from typing import List, Optional
-# Настройка логгера
+from chat_writer import chat_writer
+from database import AsyncSessionLocal, SessionLocal, get_async_db, get_db, pool_stats
+from event_log import parse_resume
+from logging_setup import log_event, setup_logging
+from media_relay import RELAY_MESSAGE_TYPES, media_relay
+from message_cache import message_cache
+from models import Room, User
+from passwords import password_hasher
+from rate_limit import RATE_LIMIT_ADMIN_TOKEN, limiter
+from room_cache import CachedRoom, invite_cache
+from token_cache import token_cache
+from user_cache import CachedUser, user_cache
+from websocket import CLEAN_CLOSE_CODES, manager, parse_capabilities
+
 logger = logging.getLogger(__name__)
 
-# Создаем таблицы в БД
-Base.metadata.create_all(bind=engine)
+# Типы входящих сообщений websocket -> событие лога (для сэмплирования)
+MESSAGE_LOG_EVENTS = {
+    "offer": "ws.signal",
+    "answer": "ws.signal",
+    "ice-candidate": "ws.ice",
+    "ice-candidates": "ws.ice",
+    "chat_message": "ws.chat",
+}
 
-app = FastAPI()
+router = APIRouter()
 
-# CORS настройки
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def save_and_refresh(db: Session, instance):
+    db.add(instance)
+    db.commit()
+    db.refresh(instance)
+    return instance
 
 # Регистрация пользователя
-@app.post("/api/auth/register", response_model=schemas.Token)
-def register(user_data: schemas.UserCreate, db: Session = Depends(get_db)):
+@router.post("/api/auth/register", response_model=schemas.Token)
+async def register(user_data: schemas.UserCreate, db: Session = Depends(get_db)):
     """Регистрация нового пользователя"""
-    db_user = db.query(User).filter(User.email == user_data.email).first()
+    db_user = await run_in_threadpool(
+        lambda: db.query(User).filter(User.email == user_data.email).first()
+    )
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    db_user = User(email=user_data.email, name=user_data.name)
-    db_user.set_password(user_data.password)
-    
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    # bcrypt считается в отдельном пуле, при перегрузке - 503 с Retry-After
+    password_hash = await password_hasher.hash(user_data.password)
+    db_user = User(email=user_data.email, name=user_data.name, password_hash=password_hash)
+    await run_in_threadpool(save_and_refresh, db, db_user)
     
     access_token = auth.create_access_token(
         data={"sub": str(db_user.id)}
@@ -85,17 +89,27 @@ def register(user_data: schemas.UserCreate, db: Session = Depends(get_db)):
     }
 
 # Авторизация пользователя
-@app.post("/api/auth/login", response_model=schemas.Token)
-def login(user_data: schemas.UserLogin, db: Session = Depends(get_db)):
+@router.post("/api/auth/login", response_model=schemas.Token)
+async def login(user_data: schemas.UserLogin, db: Session = Depends(get_db)):
     """Авторизация пользователя"""
-    user = db.query(User).filter(User.email == user_data.email).first()
-    if not user or not user.check_password(user_data.password):
+    user = await run_in_threadpool(
+        lambda: db.query(User).filter(User.email == user_data.email).first()
+    )
+    is_valid, new_hash = await password_hasher.verify(
+        user_data.password, user.password_hash if user else None
+    )
+    if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Хеш с устаревшей стоимостью пересчитываем прозрачно для пользователя
+    if new_hash:
+        user.password_hash = new_hash
+        await run_in_threadpool(save_and_refresh, db, user)
+    
     access_token = auth.create_access_token(
         data={"sub": str(user.id)}
     )
@@ -107,176 +121,383 @@ def login(user_data: schemas.UserLogin, db: Session = Depends(get_db)):
     }
 
 # Получение текущего пользователя
-@app.get("/api/auth/me", response_model=schemas.UserResponse)
+@router.get("/api/auth/me", response_model=schemas.UserResponse)
 def get_current_user(current_user: User = Depends(auth.get_current_user)):
     """Получение информации о текущем пользователе"""
     return current_user
 
-@app.get("/")
+@router.get("/")
 def read_root():
     return {"message": "Hello from FastAPI!"}
 
-@app.get("/api/items")
+@router.get("/api/items")
 def get_items():
     return {"items": ["item1", "item2", "item3"]}
 
-@app.post("/api/items")
+@router.post("/api/items")
 def create_item(item: dict):
     return {"status": "created", "item": item}
 
-# WebSocket endpoints
-@app.websocket("/ws/{room_id}")
-async def websocket_endpoint(websocket: WebSocket, room_id: str):
-    await manager.connect(websocket, room_id)
+class RequestLatencyMiddleware:
+    """Латентность HTTP-запросов по шаблону маршрута.
+
+    Чистый ASGI вместо BaseHTTPMiddleware: без лишней задачи и потока на запрос.
+    Время снимается на последнем http.response.body, поэтому потоковая выгрузка
+    учитывается целиком; запрос, упавший с исключением, учитывается в finally
+    со статусом 500.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status_code = 500
+        recorded = False
+
+        def record():
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            # Шаблон пути, а не сам путь: /api/rooms/{room_id}/messages - одна серия на все комнаты
+            route = scope.get("route")
+            metrics.http_request_seconds.labels(
+                scope["method"], route.path if route is not None else "unmatched", str(status_code)
+            ).observe(time.perf_counter() - start)
+
+        async def send_and_record(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                record()
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            record()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/api/stats/cache")
+def get_cache_stats():
+    """Попадания и промахи кэшей пользователей, токенов, последних сообщений и ссылок-приглашений"""
+    return {
+        "users": user_cache.stats(),
+        "tokens": token_cache.stats(),
+        "messages": message_cache.stats(),
+        "invites": invite_cache.stats(),
+    }
+
+@router.get("/api/stats/db")
+def get_db_stats():
+    """Использование пула соединений с БД"""
+    return pool_stats()
+
+@router.get("/api/limits")
+def get_rate_limits():
+    """Лимиты частоты сообщений и число отказов по каждому"""
+    return limiter.stats()
+
+@router.put("/api/limits/{name}")
+def update_rate_limit(name: str, update: schemas.RateLimitUpdate, x_admin_token: str = Header("")):
+    """Изменение лимита на лету; нужен заголовок X-Admin-Token = RATE_LIMIT_ADMIN_TOKEN"""
+    if not RATE_LIMIT_ADMIN_TOKEN or not secrets.compare_digest(x_admin_token.encode(), RATE_LIMIT_ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed")
     try:
-        while True:
-            data = await websocket.receive_json()
-            await manager.broadcast(data, room_id)
-    except WebSocketDisconnect:
-        manager.disconnect(websocket, room_id)
+        limiter.configure(name, update.rate, update.burst)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown limit")
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return limiter.stats()["limits"][name]
+
+@router.get("/api/stats/heartbeat")
+def get_heartbeat_stats():
+    """Соединения под heartbeat, отправленные ping и снятые по таймауту"""
+    return manager.heartbeat.stats()
+
+@router.get("/api/stats/relay")
+def get_relay_stats():
+    return media_relay.stats()
+
+@router.get("/api/stats/rooms/{room_id}")
+def get_room_stats(room_id: str):
+    """Исходящие очереди и потери сообщений в WebRTC-комнате"""
+    return manager.room_stats(f"webrtc_{room_id}")
 
 def generate_invite_link(length=10):
     """Генерация уникальной ссылки для комнаты"""
     alphabet = string.ascii_letters + string.digits
     return ''.join(secrets.choice(alphabet) for _ in range(length))
 
+# Попыток вставки комнаты со случайной ссылкой; совпадение 10 символов из 62 почти невозможно
+INVITE_LINK_ATTEMPTS = 5
+
+def insert_room(db: Session, **fields) -> schemas.RoomResponse:
+    """Создает комнату со свободной ссылкой.
+
+    Уникальность ссылки проверяет уникальный индекс rooms.invite_link: при
+    совпадении вставка повторяется с новой ссылкой, поэтому проверки SELECT
+    перед вставкой не нужны и одновременные создатели не получат одну ссылку.
+    Ответ собирается до commit - после него объект пришлось бы перечитывать.
+    """
+    for attempt in range(INVITE_LINK_ATTEMPTS):
+        db_room = Room(invite_link=generate_invite_link(), **fields)
+        db.add(db_room)
+        try:
+            db.flush()
+        except IntegrityError:
+            db.rollback()
+            if attempt == INVITE_LINK_ATTEMPTS - 1:
+                raise
+            continue
+        room = schemas.RoomResponse.model_validate(db_room)
+        db.commit()
+        invite_cache.put(room.invite_link, CachedRoom(
+            id=room.id, name=room.name, is_active=room.is_active, media_relay=room.media_relay
+        ))
+        return room
+
 # Создание комнаты
-@app.post("/api/rooms", response_model=schemas.RoomResponse)
+@router.post("/api/rooms", response_model=schemas.RoomResponse)
 def create_room(
     room_data: schemas.RoomCreate,
     current_user: User = Depends(auth.get_current_user),
     db: Session = Depends(get_db)
 ):
     """Создание комнаты с уникальной ссылкой"""
-    invite_link = generate_invite_link()
-    
-    while db.query(Room).filter(Room.invite_link == invite_link).first():
-        invite_link = generate_invite_link()
-    
-    db_room = Room(
+    return insert_room(
+        db,
         name=room_data.name,
-        invite_link=invite_link,
-        created_by=current_user.id
+        created_by=current_user.id,
+        media_relay=room_data.media_relay
     )
-    
-    db.add(db_room)
-    db.commit()
-    db.refresh(db_room)
-    
-    return db_room
-
-# WebRTC WebSocket endpoint
-# WebRTC WebSocket endpoint
-# WebRTC WebSocket endpoint
-# WebRTC WebSocket endpoint
-# В main.py добавьте этот endpoint для чата и синхронизации
-from fastapi import WebSocket, WebSocketDisconnect
-
-# WebRTC WebSocket endpoint
-# main.py - ОБНОВИТЬ WebSocket endpoint
-# main.py - ОБНОВИТЬ WebSocket endpoint
-@app.websocket("/ws/webrtc/{room_id}/{user_id}")
+
+async def room_media_relay(room_id: str) -> Optional[bool]:
+    """Флаг Room.media_relay; None - такой комнаты нет"""
+    if not room_id.isdigit():
+        return None
+    async with AsyncSessionLocal() as db:
+        media_relay_flag = await db.scalar(select(Room.media_relay).where(Room.id == int(room_id)))
+    return None if media_relay_flag is None else bool(media_relay_flag)
+
+async def reject_websocket(websocket: WebSocket, reason: str, room_key: str, user_id: Optional[str] = None):
+    """Отказ в рукопожатии до accept: клиент получает HTTP 403"""
+    metrics.ws_auth_rejected.labels(reason).inc()
+    log_event(logger, logging.WARNING, "ws.auth", "🚫 WEBSOCKET REJECTED: %s (user %s, room %s)",
+              reason, user_id, room_key, room_id=room_key, user_id=user_id)
+    await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+
+@router.websocket("/ws/webrtc/{room_id}/{user_id}")
 async def webrtc_websocket(websocket: WebSocket, room_id: str, user_id: str):
     room_key = f"webrtc_{room_id}"
     
-    logger.info(f"🎯 NEW WEBSOCKET: User {user_id} connecting to room {room_id}")
+    log_event(logger, logging.INFO, "ws.connect", "🎯 NEW WEBSOCKET: User %s connecting to room %s",
+              user_id, room_id, room_id=room_key, user_id=user_id)
+    
+    # Личность проверяется один раз при рукопожатии тем же JWT, что и в REST;
+    # дальше сообщения обрабатываются от имени user без проверок на каждое сообщение
+    user = await auth.authenticate_websocket(websocket)
+    if user is None:
+        await reject_websocket(websocket, "invalid_token", room_key, user_id)
+        return
+    if str(user.id) != user_id:
+        await reject_websocket(websocket, "user_mismatch", room_key, user_id)
+        return
+    # Комната проверяется один раз здесь: дальше сообщения чата пишутся в нее без проверок
+    relay_mode = await room_media_relay(room_id)
+    if relay_mode is None:
+        await reject_websocket(websocket, "room_not_found", room_key, user_id)
+        return
     
+    resumable = False
     try:
-        await manager.connect(websocket, room_key, user_id)
-        logger.info(f"✅ CONNECTED: User {user_id} in room {room_id}")
+        resumed = await manager.connect(websocket, room_key, user_id,
+                                        capabilities=parse_capabilities(websocket.query_params.get("caps")),
+                                        resume=parse_resume(websocket.query_params.get("resume")))
+        # При возобновлении публикация и подписки клиента в ретрансляторе сохранились
+        if relay_mode and not resumed:
+            # Клиент публикует медиа на сервер и подписывается на других вместо offer каждому
+            await manager.send_to_user({
+                "type": "media_mode",
+                "mode": "relay",
+                "available": media_relay.available,
+                "publishers": media_relay.publishers(room_key),
+            }, room_key, user_id)
         
         while True:
             try:
-                data = await websocket.receive_json()
+                data, raw = await manager.receive(websocket)
+                if data is None:
+                    continue
                 message_type = data.get('type', 'unknown')
+                metrics.ws_messages_received.labels(metrics.message_type_label(message_type)).inc()
+                if not await manager.admit(websocket, message_type, room_key, user_id):
+                    continue
                 
-                logger.info(f"📨 MESSAGE: {message_type} from {user_id}")
+                log_event(logger, logging.INFO, MESSAGE_LOG_EVENTS.get(message_type, "ws.message"),
+                          "📨 MESSAGE: %s from %s", message_type, user_id, room_id=room_key, user_id=user_id)
                 
                 if message_type == 'chat_message':
                     # Обрабатываем сообщение чата
                     message_text = data.get('message', '')
                     if message_text.strip():
-                        await handle_chat_message(room_id, user_id, message_text, room_key)
+                        await handle_chat_message(room_id, user, message_text, room_key)
+                elif message_type in RELAY_MESSAGE_TYPES:
+                    if relay_mode:
+                        await media_relay.handle(room_key, user_id, data)
+                    else:
+                        await manager.send_to_user({
+                            "type": "relay-error",
+                            "request": message_type,
+                            "error": "Room does not use the media relay",
+                        }, room_key, user_id)
                 else:
-                    # WebRTC сообщения (существующая логика)
-                    await manager.broadcast({
-                        **data,
-                        "from_user_id": user_id
-                    }, room_key, exclude_websocket=websocket)
+                    # WebRTC сообщения: адресные (offer/answer/ice-candidate) уходят только получателю.
+                    # Текст клиента пересылается как есть, с дописанным from_user_id
+                    to_user_id = data.get('to_user_id')
+                    text = manager.with_sender(data, raw, user_id)
+                    if to_user_id is not None:
+                        await manager.send_to_user(data, room_key, str(to_user_id), text=text)
+                    else:
+                        await manager.broadcast(data, room_key, exclude_websocket=websocket, text=text)
                 
-            except WebSocketDisconnect:
-                logger.info(f"🔌 NORMAL DISCONNECT: User {user_id} from room {room_id}")
+            except WebSocketDisconnect as e:
+                # Оборванный (не закрытый клиентом) сокет может быть возобновлен в течение WS_RESUME_GRACE
+                resumable = e.code not in CLEAN_CLOSE_CODES
+                log_event(logger, logging.INFO, "ws.disconnect", "🔌 NORMAL DISCONNECT: User %s from room %s",
+                          user_id, room_id, room_id=room_key, user_id=user_id)
                 break
             except Exception as e:
-                logger.error(f"❌ MESSAGE ERROR: User {user_id}: {e}")
+                log_event(logger, logging.ERROR, "ws.message_error", "❌ MESSAGE ERROR: User %s: %s",
+                          user_id, e, room_id=room_key, user_id=user_id)
                 continue
                 
     except WebSocketDisconnect:
-        logger.info(f"🔌 DISCONNECT DURING CONNECT: User {user_id}")
+        log_event(logger, logging.INFO, "ws.disconnect", "🔌 DISCONNECT DURING CONNECT: User %s",
+                  user_id, room_id=room_key, user_id=user_id)
     except Exception as e:
-        logger.error(f"❌ WEBSOCKET ERROR: User {user_id}: {e}")
+        logger.error("❌ WEBSOCKET ERROR: User %s: %s", user_id, e,
+                     extra={"room_id": room_key, "user_id": user_id})
     finally:
-        logger.info(f"🧹 CLEANUP: User {user_id} from room {room_id}")
-        await manager.disconnect(websocket, room_key, user_id)
+        # Публикация в ретрансляторе снимается, когда пользователь окончательно покидает комнату
+        await manager.disconnect(websocket, room_key, user_id, resumable=resumable)
 
-async def handle_chat_message(room_id: str, user_id: str, message: str, room_key: str):
-    """Обработка сообщения чата"""
+async def handle_chat_message(room_id: str, user: CachedUser, message: str, room_key: str):
+    """Обработка сообщения чата от пользователя, прошедшего проверку при подключении"""
+    user_id = str(user.id)
     try:
-        # Создаем сессию БД
-        db = SessionLocal()
-        
-        # Получаем пользователя
-        user = db.query(models.User).filter(models.User.id == int(user_id)).first()
-        if not user:
-            logger.error(f"User {user_id} not found")
-            return
-        
-        # Сохраняем сообщение в БД
-        db_message = models.Message(
+        # Запись в БД выполняет фоновый писатель; id и время назначаются сразу
+        db_message = await chat_writer.submit(
             room_id=int(room_id),
-            user_id=int(user_id),
+            user_id=user.id,
             content=message
         )
         
-        db.add(db_message)
-        db.commit()
-        db.refresh(db_message)
-        
         # Формируем ответ
         chat_message = {
             "type": "chat_message",
-            "id": db_message.id,
+            "id": db_message["id"],
             "user_id": user_id,
             "user_name": user.name,
             "message": message,
             "content": message,  # для совместимости
-            "timestamp": db_message.created_at.isoformat(),
-            "created_at": db_message.created_at.isoformat()
+            "timestamp": db_message["created_at"].isoformat(),
+            "created_at": db_message["created_at"].isoformat()
         }
         
+        message_cache.append(int(room_id), {
+            "id": db_message["id"],
+            "user_id": db_message["user_id"],
+            "user_name": user.name,
+            "content": message,
+            "created_at": db_message["created_at"]
+        })
+        
         # Рассылаем всем в комнате
         await manager.broadcast(chat_message, room_key)
         
-        logger.info(f"💬 CHAT: User {user_id} sent message in room {room_id}")
+        log_event(logger, logging.INFO, "ws.chat", "💬 CHAT: User %s sent message in room %s",
+                  user_id, room_id, room_id=room_key, user_id=user_id)
         
     except Exception as e:
-        logger.error(f"❌ CHAT ERROR: {e}")
-    finally:
-        db.close()
- # Дополнительный WebSocket для синхронизации участников (для версии с чатом)
-@app.websocket("/ws/{room_id}")
+        logger.error("❌ CHAT ERROR: %s", e, extra={"room_id": room_key, "user_id": user_id})
+
+def cache_remote_chat_message(room_key: str, message_type: Optional[str], text: str):
+    """Сообщение чата, записанное другим воркером, попадает и в кэш этого воркера"""
+    if message_type != "chat_message" or not room_key.startswith("webrtc_"):
+        return
+    try:
+        room_id = int(room_key[len("webrtc_"):])
+    except ValueError:
+        return
+    try:
+        data = json.loads(text)
+        message_cache.append(room_id, {
+            "id": data["id"],
+            "user_id": int(data["user_id"]),
+            "user_name": data["user_name"],
+            "content": data["content"],
+            "created_at": datetime.fromisoformat(data["created_at"])
+        }, remote=True)
+    except (ValueError, KeyError, TypeError):
+        # Комнату с непонятным сообщением проще перечитать из БД
+        message_cache.invalidate(room_id)
+
+manager.remote_broadcast_listeners.append(cache_remote_chat_message)
+
+# Измененные на этом воркере комнаты сбрасываются и в кэшах ссылок остальных воркеров
+invite_cache.publish = lambda invite_link: manager.publish_invalidation("invite", invite_link)
+manager.invalidation_listeners["invite"] = invite_cache.invalidate
+user_cache.publish = lambda user_id: manager.publish_invalidation("user", str(user_id))
+manager.invalidation_listeners["user"] = lambda user_id: user_cache.invalidate(int(user_id))
+token_cache.publish = lambda user_id: manager.publish_invalidation("token", str(user_id))
+manager.invalidation_listeners["token"] = lambda user_id: token_cache.invalidate_user(int(user_id))
+
+# Дополнительный WebSocket для синхронизации участников (для версии с чатом)
+@router.websocket("/ws/{room_id}")
 async def websocket_endpoint(websocket: WebSocket, room_id: str):
-    await manager.connect(websocket, room_id, "sync_user")
+    # Комнаты webrtc_* принадлежат /ws/webrtc: здесь в них нельзя подмешать offer и другие кадры сигнализации
+    if room_id.startswith("webrtc_"):
+        await reject_websocket(websocket, "reserved_room", room_id)
+        return
+    user = await auth.authenticate_websocket(websocket)
+    if user is None:
+        await reject_websocket(websocket, "invalid_token", room_id)
+        return
+    user_id = str(user.id)
+    await manager.connect(websocket, room_id, user_id)
     try:
         while True:
-            data = await websocket.receive_json()
-            await manager.broadcast(data, room_id)
+            # Те же проверки и лимиты, что и в /ws/webrtc; отправитель - проверенный пользователь
+            data, raw = await manager.receive(websocket)
+            if data is None:
+                continue
+            message_type = data.get("type")
+            metrics.ws_messages_received.labels(metrics.message_type_label(message_type)).inc()
+            if not await manager.admit(websocket, message_type, room_id, user_id):
+                continue
+            text = manager.with_sender(data, raw, user_id)
+            await manager.broadcast(data, room_id, text=text)
     except WebSocketDisconnect:
-        await manager.disconnect(websocket, room_id, "sync_user")
-@app.get("/api/rooms/{invite_link}")
-def join_room(invite_link: str, db: Session = Depends(get_db)):
+        pass
+    finally:
+        await manager.disconnect(websocket, room_id, user_id)
+
+@router.get("/api/rooms/{invite_link}")
+async def join_room(invite_link: str, db: AsyncSession = Depends(get_async_db)):
     """Вход в комнату по ссылке"""
-    room = db.query(Room).filter(Room.invite_link == invite_link).first()
+    # Ссылки (в том числе несуществующие) кэшируются, см. room_cache.py
+    room = await invite_cache.resolve(db, invite_link)
     
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
@@ -287,11 +508,12 @@ def join_room(invite_link: str, db: Session = Depends(get_db)):
     return {
         "room_id": room.id,
         "room_name": room.name,
+        "media_relay": room.media_relay,
         "status": "success"
     }
 
 # Создание пользователя
-@app.post("/api/users", response_model=schemas.User)
+@router.post("/api/users", response_model=schemas.User)
 def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     db_user = db.query(User).filter(User.email == user.email).first()
     if db_user:
@@ -304,30 +526,15 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     return db_user
 
 # Получение пользователя по ID
-@app.get("/api/users/{user_id}", response_model=schemas.User)
+@router.get("/api/users/{user_id}", response_model=schemas.User)
 def get_user(user_id: int, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
-# Создаем тестового пользователя при старте
-@app.on_event("startup")
-def startup_event():
-    db = SessionLocal()
-    try:
-        test_user = db.query(User).filter(User.email == "test@example.com").first()
-        if not test_user:
-            test_user = User(email="test@example.com", name="Test User")
-            test_user.set_password("test123")
-            db.add(test_user)
-            db.commit()
-            print("Создан тестовый пользователь с ID:", test_user.id)
-    finally:
-        db.close()
-
 # Тестовый эндпоинт для создания комнаты
-@app.post("/api/rooms/test")
+@router.post("/api/rooms/test")
 def create_room_test(room_data: dict, db: Session = Depends(get_db)):
     try:
         test_user = db.query(User).first()
@@ -338,164 +545,216 @@ def create_room_test(room_data: dict, db: Session = Depends(get_db)):
             db.commit()
             db.refresh(test_user)
         
-        invite_link = generate_invite_link()
-        while db.query(Room).filter(Room.invite_link == invite_link).first():
-            invite_link = generate_invite_link()
-        
-        db_room = Room(
+        room = insert_room(
+            db,
             name=room_data.get('name', 'Test Room'),
-            invite_link=invite_link,
-            created_by=test_user.id
+            created_by=test_user.id,
+            media_relay=bool(room_data.get('media_relay', False))
         )
         
-        db.add(db_room)
-        db.commit()
-        db.refresh(db_room)
-        
-        return {"room_id": db_room.id, "invite_link": invite_link}
+        return {"room_id": room.id, "invite_link": room.invite_link}
     
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/rooms/{room_id}/messages", response_model=List[schemas.MessageResponse])
-def get_room_messages(room_id: int, db: Session = Depends(get_db)):
-    """Получить историю сообщений комнаты"""
-    messages = db.query(models.Message).filter(
-        models.Message.room_id == room_id
-    ).order_by(models.Message.created_at.asc()).all()
+# Размер страницы истории сообщений
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_PAGE_MAX = 200
+
+def message_history_query(db: Session, room_id: int):
+    """Сообщения комнаты вместе с именем автора одним запросом"""
+    return db.query(
+        models.Message.id,
+        models.Message.user_id,
+        models.Message.content,
+        models.Message.created_at,
+        models.User.name.label("user_name")
+    ).outerjoin(
+        models.User, models.User.id == models.Message.user_id
+    ).filter(models.Message.room_id == room_id)
+
+def message_to_dict(row, user_name: Optional[str]) -> dict:
+    return {
+        "id": row.id,
+        "user_id": row.user_id,
+        "user_name": user_name or "Unknown",
+        "content": row.content,
+        "created_at": row.created_at
+    }
+
+def keyset_condition(cursor_id: int, older: bool):
+    """Условие keyset-пагинации по (created_at, id) относительно сообщения cursor_id"""
+    cursor_created_at = select(models.Message.created_at).where(
+        models.Message.id == cursor_id
+    ).scalar_subquery()
+    if older:
+        return or_(
+            models.Message.created_at < cursor_created_at,
+            and_(models.Message.created_at == cursor_created_at, models.Message.id < cursor_id)
+        )
+    return or_(
+        models.Message.created_at > cursor_created_at,
+        and_(models.Message.created_at == cursor_created_at, models.Message.id > cursor_id)
+    )
+
+@router.get("/api/rooms/{room_id}/messages", response_model=List[schemas.MessageResponse])
+async def get_room_messages(
+    room_id: int,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: int = Query(MESSAGES_PAGE_SIZE, ge=1, le=MESSAGES_PAGE_MAX),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Получить страницу истории сообщений комнаты.
+
+    Без параметров возвращает последние limit сообщений (из кэша последних сообщений
+    комнаты). before/after - id сообщения, от которого брать более старые/новые.
+    Сообщения всегда идут по возрастанию времени.
+    """
+    if before is not None and after is not None:
+        raise HTTPException(status_code=400, detail="Use either before or after")
     
-    # Добавляем имена пользователей к сообщениям
-    result = []
-    for message in messages:
-        user = db.query(models.User).filter(models.User.id == message.user_id).first()
-        result.append({
-            "id": message.id,
-            "user_id": message.user_id,
-            "user_name": user.name if user else "Unknown",
-            "content": message.content,
-            "created_at": message.created_at
-        })
+    if before is None and after is None:
+        # Пока часть сообщений комнаты в очереди писателя, чтение из БД не кэшируется
+        return await message_cache.head(room_id, limit, lambda count: load_latest_messages(db, room_id, count),
+                                        cacheable=not chat_writer.unwritten(room_id))
+    
+    query = select(
+        models.Message.id,
+        models.Message.user_id,
+        models.Message.content,
+        models.Message.created_at
+    ).where(models.Message.room_id == room_id)
+    if after is not None:
+        result = await db.execute(query.where(keyset_condition(after, older=False)).order_by(
+            models.Message.created_at.asc(), models.Message.id.asc()
+        ).limit(limit))
+        rows = result.all()
+    else:
+        result = await db.execute(query.where(keyset_condition(before, older=True)).order_by(
+            models.Message.created_at.desc(), models.Message.id.desc()
+        ).limit(limit))
+        rows = result.all()
+        rows.reverse()
+    
+    return await messages_with_names(db, rows)
+
+async def load_latest_messages(db: AsyncSession, room_id: int, limit: int) -> List[dict]:
+    """Последние limit сообщений комнаты из БД по возрастанию времени"""
+    result = await db.execute(select(
+        models.Message.id,
+        models.Message.user_id,
+        models.Message.content,
+        models.Message.created_at
+    ).where(models.Message.room_id == room_id).order_by(
+        models.Message.created_at.desc(), models.Message.id.desc()
+    ).limit(limit))
+    rows = result.all()
+    rows.reverse()
+    return await messages_with_names(db, rows)
+
+async def messages_with_names(db: AsyncSession, rows) -> List[dict]:
+    # Имена авторов - из кэша пользователей, промахи одним запросом
+    users = await user_cache.load_many_async(db, (row.user_id for row in rows))
+    return [
+        message_to_dict(row, users[row.user_id].name if row.user_id in users else None)
+        for row in rows
+    ]
+
+@router.get("/api/rooms/{room_id}/messages/export")
+def export_room_messages(room_id: int):
+    """Выгрузка всей истории комнаты потоком (JSON-массив)"""
+    def generate():
+        db = SessionLocal()
+        try:
+            rows = message_history_query(db, room_id).order_by(
+                models.Message.created_at.asc(), models.Message.id.asc()
+            ).yield_per(1000)
+            yield "["
+            for index, row in enumerate(rows):
+                message = message_to_dict(row, row.user_name)
+                message["created_at"] = message["created_at"].isoformat() if message["created_at"] else None
+                yield ("," if index else "") + json.dumps(message, ensure_ascii=False)
+            yield "]"
+        finally:
+            db.close()
     
-    return result
+    return StreamingResponse(generate(), media_type="application/json")
 
-@app.post("/api/rooms/{room_id}/messages", response_model=schemas.MessageResponse)
-def create_message(
+@router.post("/api/rooms/{room_id}/messages", response_model=schemas.MessageResponse)
+async def create_message(
     room_id: int,
     message_data: schemas.MessageCreate,
     current_user: User = Depends(auth.get_current_user), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Создать новое сообщение в чате"""
-    # Проверяем что комната существует
-    room = db.query(models.Room).filter(models.Room.id == room_id).first()
+    # Проверяем что комната существует (до лимита: сообщение в несуществующую комнату не тратит бюджет)
+    room = await db.get(models.Room, room_id)
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
     
-    db_message = models.Message(
+    # Тот же бюджет чата пользователя и комнаты, что и у сообщений через WebSocket
+    scope = limiter.allow("chat", str(current_user.id), f"webrtc_{room_id}")
+    if scope is not None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Too many messages ({scope} limit)",
+            headers={"Retry-After": str(math.ceil(limiter.retry_after("chat", scope)))},
+        )
+    
+    # Сообщения пишутся через общий фоновый писатель, чтобы id не пересекались
+    db_message = await chat_writer.submit(
         room_id=room_id,
         user_id=current_user.id,
         content=message_data.content
     )
     
-    db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
-    
-    # Возвращаем сообщение с именем пользователя
-    return {
-        "id": db_message.id,
-        "user_id": db_message.user_id,
+    # Возвращаем сообщение с именем пользователя; оно же сразу попадает в кэш истории
+    message = {
+        "id": db_message["id"],
+        "user_id": db_message["user_id"],
         "user_name": current_user.name,
-        "content": db_message.content,
-        "created_at": db_message.created_at
+        "content": db_message["content"],
+        "created_at": db_message["created_at"]
     }
-# WebSocket endpoint для WebRTC и чата
-@app.websocket("/ws/webrtc/{room_id}/{user_id}")
-async def webrtc_websocket(websocket: WebSocket, room_id: str, user_id: str):
-    room_key = f"webrtc_{room_id}"
-    
-    logger.info(f"🎯 NEW WEBSOCKET: User {user_id} connecting to room {room_id}")
-    
-    try:
-        await manager.connect(websocket, room_key, user_id)
-        logger.info(f"✅ CONNECTED: User {user_id} in room {room_id}")
-        
-        while True:
-            try:
-                data = await websocket.receive_json()
-                message_type = data.get('type', 'unknown')
-                
-                logger.info(f"📨 MESSAGE: {message_type} from {user_id}")
-                
-                if message_type == 'chat_message':
-                    # Обрабатываем сообщение чата
-                    message_text = data.get('message', '')
-                    if message_text.strip():
-                        await handle_chat_message(room_id, user_id, message_text, room_key)
-                else:
-                    # WebRTC сообщения (существующая логика)
-                    await manager.broadcast({
-                        **data,
-                        "from_user_id": user_id
-                    }, room_key, exclude_websocket=websocket)
-                
-            except WebSocketDisconnect:
-                logger.info(f"🔌 NORMAL DISCONNECT: User {user_id} from room {room_id}")
-                break
-            except Exception as e:
-                logger.error(f"❌ MESSAGE ERROR: User {user_id}: {e}")
-                continue
-                
-    except WebSocketDisconnect:
-        logger.info(f"🔌 DISCONNECT DURING CONNECT: User {user_id}")
-    except Exception as e:
-        logger.error(f"❌ WEBSOCKET ERROR: User {user_id}: {e}")
-    finally:
-        logger.info(f"🧹 CLEANUP: User {user_id} from room {room_id}")
-        await manager.disconnect(websocket, room_key, user_id)
+    message_cache.append(room_id, message)
+    return message
+
 
-async def handle_chat_message(room_id: str, user_id: str, message: str, room_key: str):
-    """Обработка сообщения чата"""
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Запуск и остановка фоновых служб воркера; таблицы должны быть созданы миграциями"""
+    await chat_writer.start()
+    await manager.start()
     try:
-        # Создаем сессию БД
-        db = SessionLocal()
-        
-        # Получаем пользователя
-        user = db.query(models.User).filter(models.User.id == int(user_id)).first()
-        if not user:
-            logger.error(f"User {user_id} not found")
-            return
-        
-        # Сохраняем сообщение в БД
-        db_message = models.Message(
-            room_id=int(room_id),
-            user_id=int(user_id),
-            content=message
-        )
-        
-        db.add(db_message)
-        db.commit()
-        db.refresh(db_message)
-        
-        # Формируем ответ
-        chat_message = {
-            "type": "chat_message",
-            "id": db_message.id,
-            "user_id": user_id,
-            "user_name": user.name,
-            "message": message,
-            "content": message,  # для совместимости
-            "timestamp": db_message.created_at.isoformat(),
-            "created_at": db_message.created_at.isoformat()
-        }
-        
-        # Рассылаем всем в комнате
-        await manager.broadcast(chat_message, room_key)
-        
-        logger.info(f"💬 CHAT: User {user_id} sent message in room {room_id}")
-        
-    except Exception as e:
-        logger.error(f"❌ CHAT ERROR: {e}")
+        yield
     finally:
-        db.close()
\ No newline at end of file
+        await media_relay.stop()
+        await manager.stop()
+        # Дописываем очередь сообщений чата перед остановкой процесса
+        await chat_writer.stop()
+        password_hasher.shutdown()
+
+
+def create_app() -> FastAPI:
+    """Приложение со всеми маршрутами; БД и фоновые службы трогаются только в lifespan"""
+    setup_logging()
+    app = FastAPI(lifespan=lifespan)
+    
+    # CORS настройки
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(RequestLatencyMiddleware)
+    app.include_router(router)
+    return app
+
+
+# uvicorn main:app
+app = create_app()
@@ -0,0 +1,266 @@
+# media_relay.py
+"""SFU-lite: медиа-ретранслятор для комнат с флагом Room.media_relay.
+
+В обычной комнате участники соединены полной сеткой: каждый отправляет свои
+дорожки каждому (N-1 исходящих потоков). В комнате с ретранслятором клиент
+публикует дорожки один раз на сервер, а сервер раздает их подписчикам.
+
+Сигнализация идет по тому же /ws/webrtc/{room_id}/{user_id}:
+
+    клиент -> сервер                          сервер -> клиент
+    publish {offer}                           publish-answer {answer}
+                                              publisher_added {user_id} - всем в комнате
+    subscribe {publisher_id}                  subscribe-offer {publisher_id, offer}
+    subscribe-answer {publisher_id, answer}
+    unsubscribe {publisher_id}
+    unpublish                                 publisher_removed {user_id}
+
+Trickle ICE не используется: кандидаты передаются в SDP, клиент отправляет
+offer/answer после завершения сбора кандидатов. Состояние ретранслятора живет
+в памяти процесса, поэтому комнату с ретранслятором должен обслуживать один
+воркер (BACKPLANE=memory или привязка комнаты к воркеру на балансировщике).
+Нужен пакет aiortc; без него комнаты с флагом получают relay-error. aiortc
+импортируется при первом запросе к ретранслятору, а не при старте воркера.
+
+aiortc декодирует публикацию один раз, но кодирует кадры заново для каждого
+подписчика: ретранслятор снимает нагрузку с исходящего канала и CPU клиентов
+ценой CPU сервера (см. benchmarks/relay_test.py).
+"""
+import asyncio
+import importlib.util
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from logging_setup import log_event
+
+# aiortc - необязательная зависимость, нужна только комнатам с ретранслятором
+AIORTC_INSTALLED = importlib.util.find_spec("aiortc") is not None
+RTCConfiguration = RTCIceServer = RTCPeerConnection = RTCSessionDescription = MediaRelay = None
+
+logger = logging.getLogger(__name__)
+
+# STUN/TURN для соединений сервера: "stun:stun.l.google.com:19302,turn:..."; по умолчанию только host-кандидаты
+MEDIA_RELAY_ICE_SERVERS = os.getenv("MEDIA_RELAY_ICE_SERVERS", "")
+# Не больше N публикующих участников на комнату (0 - без ограничения)
+MEDIA_RELAY_MAX_PUBLISHERS = int(os.getenv("MEDIA_RELAY_MAX_PUBLISHERS", "0"))
+
+RELAY_MESSAGE_TYPES = frozenset({"publish", "unpublish", "subscribe", "subscribe-answer", "unsubscribe"})
+
+
+class RelayError(Exception):
+    """Ошибка запроса к ретранслятору; текст уходит клиенту в relay-error"""
+
+
+class _Publisher:
+    __slots__ = ("pc", "tracks")
+
+    def __init__(self, pc):
+        self.pc = pc
+        self.tracks = []
+
+
+class _RelayRoom:
+    __slots__ = ("publishers", "subscriptions")
+
+    def __init__(self):
+        self.publishers: Dict[str, _Publisher] = {}
+        # (подписчик, публикующий) -> соединение сервера с подписчиком
+        self.subscriptions: Dict[Tuple[str, str], object] = {}
+
+
+class MediaRelayService:
+    """Публикации и подписки комнат с ретранслятором; ответы уходят через ConnectionManager"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.rooms: Dict[str, _RelayRoom] = {}
+        self._relay = None
+
+    @property
+    def available(self) -> bool:
+        return AIORTC_INSTALLED
+
+    def publishers(self, room_id: str) -> List[str]:
+        room = self.rooms.get(room_id)
+        return list(room.publishers) if room is not None else []
+
+    async def handle(self, room_id: str, user_id: str, message: dict):
+        """Обработка сообщения publish/subscribe-протокола от участника"""
+        message_type = message.get("type")
+        try:
+            self._ensure_relay()
+            if message_type == "publish":
+                await self.publish(room_id, user_id, message.get("offer"))
+            elif message_type == "unpublish":
+                await self.unpublish(room_id, user_id)
+            elif message_type == "subscribe":
+                await self.subscribe(room_id, user_id, str(message.get("publisher_id")))
+            elif message_type == "subscribe-answer":
+                await self.subscribe_answer(room_id, user_id, str(message.get("publisher_id")), message.get("answer"))
+            elif message_type == "unsubscribe":
+                await self.unsubscribe(room_id, user_id, str(message.get("publisher_id")))
+        except RelayError as e:
+            await self.manager.send_to_user({
+                "type": "relay-error",
+                "request": message_type,
+                "error": str(e),
+            }, room_id, user_id)
+
+    async def publish(self, room_id: str, user_id: str, offer: Optional[dict]):
+        room = self.rooms.setdefault(room_id, _RelayRoom())
+        if (user_id not in room.publishers and MEDIA_RELAY_MAX_PUBLISHERS
+                and len(room.publishers) >= MEDIA_RELAY_MAX_PUBLISHERS):
+            raise RelayError("Too many publishers in this room")
+        description = _session_description(offer, "offer")
+
+        # Повторная публикация (например, после смены камеры) заменяет прежнюю
+        await self.unpublish(room_id, user_id)
+
+        pc = RTCPeerConnection(_configuration())
+        publisher = _Publisher(pc)
+        pc.on("track", publisher.tracks.append)
+        try:
+            await pc.setRemoteDescription(description)
+            await pc.setLocalDescription(await pc.createAnswer())
+        except Exception as e:
+            await pc.close()
+            raise RelayError(f"Cannot accept publish offer: {e}") from e
+
+        room.publishers[user_id] = publisher
+        log_event(logger, logging.INFO, "relay.publish", "📡 User %s published %d tracks in room %s",
+                  user_id, len(publisher.tracks), room_id, room_id=room_id, user_id=user_id)
+        await self.manager.send_to_user({
+            "type": "publish-answer",
+            "answer": _description_dict(pc.localDescription),
+        }, room_id, user_id)
+        await self.manager.broadcast({"type": "publisher_added", "user_id": user_id}, room_id)
+
+    async def unpublish(self, room_id: str, user_id: str):
+        room = self.rooms.get(room_id)
+        if room is None:
+            return
+        publisher = room.publishers.pop(user_id, None)
+        if publisher is None:
+            return
+        for key in [key for key in room.subscriptions if key[1] == user_id]:
+            await room.subscriptions.pop(key).close()
+        await publisher.pc.close()
+        await self.manager.broadcast({"type": "publisher_removed", "user_id": user_id}, room_id)
+        self._cleanup_room(room_id)
+
+    async def subscribe(self, room_id: str, user_id: str, publisher_id: str):
+        room = self.rooms.get(room_id)
+        publisher = room.publishers.get(publisher_id) if room is not None else None
+        if publisher is None:
+            raise RelayError(f"User {publisher_id} is not publishing")
+        if publisher_id == user_id:
+            raise RelayError("Cannot subscribe to own publication")
+
+        previous = room.subscriptions.pop((user_id, publisher_id), None)
+        if previous is not None:
+            await previous.close()
+
+        pc = RTCPeerConnection(_configuration())
+        for track in publisher.tracks:
+            # Каждому подписчику - своя копия дорожки: медленный подписчик не тормозит остальных
+            pc.addTrack(self._relay.subscribe(track))
+        await pc.setLocalDescription(await pc.createOffer())
+        room.subscriptions[(user_id, publisher_id)] = pc
+        await self.manager.send_to_user({
+            "type": "subscribe-offer",
+            "publisher_id": publisher_id,
+            "offer": _description_dict(pc.localDescription),
+        }, room_id, user_id)
+
+    async def subscribe_answer(self, room_id: str, user_id: str, publisher_id: str, answer: Optional[dict]):
+        room = self.rooms.get(room_id)
+        pc = room.subscriptions.get((user_id, publisher_id)) if room is not None else None
+        if pc is None:
+            raise RelayError(f"No pending subscription to {publisher_id}")
+        try:
+            await pc.setRemoteDescription(_session_description(answer, "answer"))
+        except RelayError:
+            raise
+        except Exception as e:
+            await self.unsubscribe(room_id, user_id, publisher_id)
+            raise RelayError(f"Cannot accept subscribe answer: {e}") from e
+
+    async def unsubscribe(self, room_id: str, user_id: str, publisher_id: str):
+        room = self.rooms.get(room_id)
+        if room is None:
+            return
+        pc = room.subscriptions.pop((user_id, publisher_id), None)
+        if pc is not None:
+            await pc.close()
+        self._cleanup_room(room_id)
+
+    async def leave(self, room_id: str, user_id: str):
+        """Участник вышел из комнаты: закрываем его публикацию и подписки"""
+        room = self.rooms.get(room_id)
+        if room is None:
+            return
+        for key in [key for key in room.subscriptions if key[0] == user_id]:
+            await room.subscriptions.pop(key).close()
+        await self.unpublish(room_id, user_id)
+        self._cleanup_room(room_id)
+
+    async def stop(self):
+        for room_id, room in list(self.rooms.items()):
+            connections = list(room.subscriptions.values()) + [publisher.pc for publisher in room.publishers.values()]
+            await asyncio.gather(*(pc.close() for pc in connections), return_exceptions=True)
+        self.rooms.clear()
+
+    def stats(self) -> dict:
+        return {
+            "available": self.available,
+            "rooms": {
+                room_id: {"publishers": len(room.publishers), "subscriptions": len(room.subscriptions)}
+                for room_id, room in self.rooms.items()
+            },
+        }
+
+    def _ensure_relay(self):
+        if self._relay is not None:
+            return
+        if not self.available:
+            raise RelayError("Media relay is not available on this server")
+        try:
+            _load_aiortc()
+        except ImportError as e:
+            raise RelayError("Media relay is not available on this server") from e
+        self._relay = MediaRelay()
+
+    def _cleanup_room(self, room_id: str):
+        room = self.rooms.get(room_id)
+        if room is not None and not room.publishers and not room.subscriptions:
+            del self.rooms[room_id]
+
+
+def _load_aiortc():
+    # Импорт aiortc (и av) - около 0.4 с, поэтому только когда ретранслятор действительно нужен
+    global RTCConfiguration, RTCIceServer, RTCPeerConnection, RTCSessionDescription, MediaRelay
+    from aiortc import RTCConfiguration, RTCIceServer, RTCPeerConnection, RTCSessionDescription
+    from aiortc.contrib.media import MediaRelay
+
+
+def _configuration():
+    urls = [url.strip() for url in MEDIA_RELAY_ICE_SERVERS.split(",") if url.strip()]
+    return RTCConfiguration(iceServers=[RTCIceServer(urls=url) for url in urls])
+
+
+def _session_description(description: Optional[dict], expected_type: str):
+    if not isinstance(description, dict) or description.get("type") != expected_type or not description.get("sdp"):
+        raise RelayError(f"Expected an {expected_type} session description")
+    return RTCSessionDescription(sdp=description["sdp"], type=expected_type)
+
+
+def _description_dict(description) -> dict:
+    return {"type": description.type, "sdp": description.sdp}
+
+
+from websocket import manager  # noqa: E402
+
+media_relay = MediaRelayService(manager)
+# Публикация и подписки живут, пока пользователь в комнате (в том числе пока ждет переподключения)
+manager.leave_listeners.append(media_relay.leave)
@@ -0,0 +1,234 @@
+# message_cache.py
+"""Последние сообщения комнат в памяти перед таблицей messages.
+
+Для каждой комнаты хранится до MESSAGE_CACHE_PER_ROOM последних сообщений
+с уже подставленными именами авторов - ровно то, что отдает первая страница
+GET /api/rooms/{room_id}/messages. Оба пути записи (чат через WebSocket и
+POST /messages) дописывают сообщение в кэш сразу после постановки в очередь
+chat_writer. Комната попадает в кэш при первом чтении истории; одновременные
+чтения холодной комнаты ждут одного запроса к БД.
+
+Комнаты вытесняются по LRU, когда общий объем записей превышает
+MESSAGE_CACHE_MAX_BYTES (объем оценивается по длине текста и имени).
+
+Несколько воркеров: сообщения, пришедшие в чат через шину (backplane.py),
+тоже дописываются в кэш (append с remote=True). Но шина доставляет рассылку
+только воркерам, где в комнате есть участники, поэтому кэш воркера без
+участников комнаты не видит чужих сообщений. Такая комната живет в кэше не
+дольше MESSAGE_CACHE_TTL секунд с момента чтения из БД - это и есть предел
+отставания. С BACKPLANE=memory (один процесс) все записи локальные и TTL
+по умолчанию выключен.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+MESSAGE_CACHE_PER_ROOM = int(os.getenv("MESSAGE_CACHE_PER_ROOM", "100"))
+MESSAGE_CACHE_MAX_BYTES = int(os.getenv("MESSAGE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Сколько секунд комната живет в кэше после чтения из БД (0 - без ограничения)
+MESSAGE_CACHE_TTL = float(os.getenv(
+    "MESSAGE_CACHE_TTL", "0" if os.getenv("BACKPLANE", "memory") == "memory" else "5"))
+# Оценка памяти на сообщение сверх текста и имени: словарь, datetime, числа
+ENTRY_OVERHEAD = 400
+
+# Загрузка последних n сообщений комнаты из БД по возрастанию времени
+Loader = Callable[[int], Awaitable[List[dict]]]
+
+
+def _entry_size(message: dict) -> int:
+    return ENTRY_OVERHEAD + len(message["content"]) + len(message["user_name"])
+
+
+class _RoomMessages:
+    __slots__ = ("messages", "size", "complete", "expires")
+
+    def __init__(self, messages: List[dict], per_room: int, complete: bool, expires: Optional[float]):
+        self.messages: Deque[dict] = deque(messages[-per_room:], maxlen=per_room)
+        # Момент (time.monotonic), после которого запись считается устаревшей; None - без срока
+        self.expires = expires
+        self.size = sum(_entry_size(message) for message in self.messages)
+        # В кэше вся история комнаты: страница любого размера отдается без БД
+        self.complete = complete and len(messages) <= per_room
+
+    def append(self, message: dict) -> int:
+        """Добавляет сообщение; возвращает изменение объема"""
+        delta = _entry_size(message)
+        if len(self.messages) == self.messages.maxlen:
+            delta -= _entry_size(self.messages[0])
+            self.complete = False
+        self.messages.append(message)
+        self.size += delta
+        return delta
+
+    def head(self, limit: int) -> Optional[List[dict]]:
+        if limit <= len(self.messages) or self.complete:
+            return list(self.messages)[-limit:]
+        return None
+
+
+class _Load:
+    """Идущее чтение холодной комнаты из БД"""
+    __slots__ = ("future", "fetch", "writes", "cacheable")
+
+    def __init__(self, fetch: int):
+        self.future = asyncio.get_running_loop().create_future()
+        self.fetch = fetch
+        # Сообщения, записанные пока шло чтение: БД могла их еще не увидеть
+        self.writes: List[dict] = []
+        self.cacheable = True
+
+
+class RecentMessageCache:
+    """LRU по комнатам с общим ограничением памяти. Используется только из event loop"""
+
+    def __init__(self, per_room: int = MESSAGE_CACHE_PER_ROOM, max_bytes: int = MESSAGE_CACHE_MAX_BYTES,
+                 ttl: float = MESSAGE_CACHE_TTL):
+        self.per_room = per_room
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._rooms: "OrderedDict[int, _RoomMessages]" = OrderedDict()
+        self._loads: Dict[int, _Load] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.per_room > 0 and self.max_bytes > 0
+
+    async def head(self, room_id: int, limit: int, loader: Loader, cacheable: bool = True) -> List[dict]:
+        """Последние limit сообщений комнаты по возрастанию времени.
+
+        cacheable=False - результат чтения не кладется в кэш (например, часть
+        сообщений комнаты еще не записана в БД и чтение их не увидит).
+        """
+        room = self._rooms.get(room_id)
+        if room is not None and room.expires is not None and room.expires <= time.monotonic():
+            # Могли пропустить сообщения, записанные другими воркерами: перечитываем из БД
+            self.invalidate(room_id)
+            self.expirations += 1
+            room = None
+        if room is not None:
+            page = room.head(limit)
+            if page is not None:
+                self._rooms.move_to_end(room_id)
+                self.hits += 1
+                return page
+        self.misses += 1
+        if not self.enabled:
+            return await loader(limit)
+
+        load = self._loads.get(room_id)
+        if load is not None and load.fetch >= limit:
+            # Та же комната уже читается - ждем этот запрос вместо повторного
+            self.coalesced += 1
+            messages = await asyncio.shield(load.future)
+            if messages is not None:
+                return messages[-limit:]
+            return await loader(limit)
+
+        if load is not None or not cacheable:
+            return await loader(limit)
+        load = self._loads[room_id] = _Load(max(limit, self.per_room))
+        try:
+            messages = await loader(load.fetch)
+        except BaseException:
+            load.future.set_result(None)
+            raise
+        finally:
+            del self._loads[room_id]
+
+        loaded = {message["id"] for message in messages}
+        complete = len(messages) < load.fetch
+        messages += [message for message in load.writes if message["id"] not in loaded]
+        if load.cacheable:
+            expires = time.monotonic() + self.ttl if self.ttl > 0 else None
+            self._store(room_id, _RoomMessages(messages, self.per_room, complete, expires))
+        load.future.set_result(messages)
+        return messages[-limit:]
+
+    def append(self, room_id: int, message: dict, remote: bool = False):
+        """Запись нового сообщения (write-through); холодные комнаты не заводятся.
+
+        remote=True - сообщение записал другой воркер: БД могла уже отдать его
+        при чтении комнаты, поэтому повтор по id пропускается.
+        """
+        load = self._loads.get(room_id)
+        if load is not None:
+            load.writes.append(message)
+        room = self._rooms.get(room_id)
+        if room is None:
+            return
+        if remote and any(cached["id"] == message["id"] for cached in room.messages):
+            return
+        self.size += room.append(message)
+        self._rooms.move_to_end(room_id)
+        self._evict()
+
+    def discard(self, room_id: int, message_id: int):
+        """Убирает сообщение, которое так и не попало в БД"""
+        load = self._loads.get(room_id)
+        if load is not None:
+            load.writes = [message for message in load.writes if message["id"] != message_id]
+        room = self._rooms.get(room_id)
+        if room is None:
+            return
+        for message in room.messages:
+            if message["id"] == message_id:
+                room.messages.remove(message)
+                room.size -= _entry_size(message)
+                self.size -= _entry_size(message)
+                return
+
+    def invalidate(self, room_id: int):
+        room = self._rooms.pop(room_id, None)
+        if room is not None:
+            self.size -= room.size
+        load = self._loads.get(room_id)
+        if load is not None:
+            load.cacheable = False
+
+    def clear(self):
+        self._rooms.clear()
+        self.size = 0
+        for load in self._loads.values():
+            load.cacheable = False
+
+    def _store(self, room_id: int, room: _RoomMessages):
+        previous = self._rooms.pop(room_id, None)
+        if previous is not None:
+            self.size -= previous.size
+        self._rooms[room_id] = room
+        self.size += room.size
+        self._evict()
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._rooms:
+            _, room = self._rooms.popitem(last=False)
+            self.size -= room.size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "rooms": len(self._rooms),
+            "messages": sum(len(room.messages) for room in self._rooms.values()),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "per_room": self.per_room,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "ttl": self.ttl,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+message_cache = RecentMessageCache()
@@ -0,0 +1,255 @@
+# metrics.py
+"""Метрики в текстовом формате Prometheus без внешних зависимостей.
+
+Значения меняются только из event loop (или под GIL одной операцией), поэтому
+счетчики обходятся без блокировок. Гистограммы хранят заранее заданные
+корзины: наблюдение - это бинарный поиск и два сложения.
+"""
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Латентности, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Размер рассылки, получатели
+FANOUT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[object, object] = {}
+
+    def labels(self, *values: str):
+        """Дочерняя серия; для одной метки ключом служит само значение, без кортежа"""
+        key = values[0] if len(values) == 1 else values
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _series(self) -> Iterable[Tuple[Tuple[str, ...], object]]:
+        for key, child in self._children.items():
+            yield (key if isinstance(key, tuple) else (key,)), child
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._value = _CounterValue()
+
+    def inc(self, amount: float = 1):
+        self._value.value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value.value
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def _render_samples(self) -> List[str]:
+        if not self.labelnames:
+            return [f"{self.name} {_format_value(self._value.value)}"]
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+                for values, child in self._series()]
+
+
+class Gauge(_Metric):
+    """Значение снимается в момент выдачи /metrics"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 collect: Optional[Callable[[], object]] = None):
+        super().__init__(name, documentation, labelnames)
+        # Без меток collect возвращает число, с метками - {значения меток: число}
+        self.collect = collect
+
+    def _render_samples(self) -> List[str]:
+        if self.collect is None:
+            return []
+        value = self.collect()
+        if not self.labelnames:
+            return [f"{self.name} {_format_value(value)}"]
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key if isinstance(key, tuple) else (key,))} "
+            f"{_format_value(sample)}"
+            for key, sample in value.items()
+        ]
+
+
+class CounterFunc(Gauge):
+    """Счетчик, который ведется вне реестра (например, в пуле БД); значение снимается при выдаче /metrics"""
+    kind = "counter"
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # Последняя корзина - +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._value = _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._value.observe(value)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def _render_samples(self) -> List[str]:
+        series = self._series() if self.labelnames else [((), self._value)]
+        lines = []
+        for values, child in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames + ("le",), tuple(values) + (_format_value(float(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              collect: Optional[Callable[[], object]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, collect))
+
+    def counter_func(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                     collect: Optional[Callable[[], object]] = None) -> CounterFunc:
+        return self.register(CounterFunc(name, documentation, labelnames, collect))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Типы сообщений протокола; остальные учитываются как "other", чтобы клиент не раздувал число серий
+KNOWN_MESSAGE_TYPES = {
+    "offer", "answer", "ice-candidate", "ice-candidates", "chat_message",
+    "existing_users", "user_joined", "user_left",
+}
+
+
+def message_type_label(message_type: Optional[str]) -> str:
+    return message_type if message_type in KNOWN_MESSAGE_TYPES else "other"
+
+
+ws_messages_received = registry.counter(
+    "conference_ws_messages_received_total", "Messages received from websocket clients", ["type"])
+ws_messages_forwarded = registry.counter(
+    "conference_ws_messages_forwarded_total", "Messages queued for delivery to local websocket clients", ["type"])
+ws_fanout_size = registry.histogram(
+    "conference_ws_fanout_size", "Local recipients per broadcast", buckets=FANOUT_BUCKETS)
+ws_fanout_seconds = registry.histogram(
+    "conference_ws_fanout_seconds", "Time to queue one broadcast for all local recipients")
+ws_ice_batches = registry.counter(
+    "conference_ws_ice_batches_total", "ice-candidates frames sent instead of separate candidates")
+ws_ice_batched_candidates = registry.counter(
+    "conference_ws_ice_batched_candidates_total", "ICE candidates delivered inside ice-candidates frames")
+ws_send_failures = registry.counter(
+    "conference_ws_send_failures_total", "Websocket sends that failed or timed out")
+ws_evictions = registry.counter(
+    "conference_ws_evictions_total", "Websocket clients disconnected by the server", ["reason"])
+ws_resumes = registry.counter(
+    "conference_ws_resumes_total", "Reconnects that asked to resume a room session", ["result"])
+ws_replayed_events = registry.counter(
+    "conference_ws_replayed_events_total", "Logged room events re-sent to resumed clients")
+ws_auth_rejected = registry.counter(
+    "conference_ws_auth_rejected_total", "Websocket handshakes rejected by token check", ["reason"])
+ws_dropped = registry.counter(
+    "conference_ws_dropped_messages_total", "Non-critical messages dropped from full outbound queues")
+chat_persist_seconds = registry.histogram(
+    "conference_chat_persist_seconds", "Time to write one batch of chat messages")
+chat_persist_batch = registry.histogram(
+    "conference_chat_persist_batch_size", "Chat messages per database write", buckets=FANOUT_BUCKETS)
+chat_write_retries = registry.counter(
+    "conference_chat_write_retries_total", "Chat writes retried after a transient database error")
+chat_dropped = registry.counter(
+    "conference_chat_dropped_messages_total", "Broadcast chat messages that could not be stored", ["reason"])
+http_request_seconds = registry.histogram(
+    "conference_http_request_seconds", "HTTP request latency per route", ["method", "route", "status"])
+rate_limited = registry.counter(
+    "conference_rate_limited_total", "Messages rejected by rate limits", ["budget", "scope"])
@@ -1,9 +1,9 @@
 # models.py - УБЕДИТЕСЬ ЧТО ВСЕ ИМПОРТЫ ПРАВИЛЬНЫЕ
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Text
-from sqlalchemy.sql import func
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, String, DateTime, Text
+from sqlalchemy.sql import expression, func
 from sqlalchemy.orm import relationship
 from database import Base
-import bcrypt
+from passwords import pwd_context
 from datetime import datetime
 
 class User(Base):
@@ -18,12 +18,12 @@ class User(Base):
     # Связи
     messages = relationship("Message", back_populates="user")
     
+    # Синхронные варианты; в обработчиках запросов используется passwords.password_hasher
     def set_password(self, password: str):
-        salt = bcrypt.gensalt()
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+        self.password_hash = pwd_context.hash(password)
     
     def check_password(self, password: str) -> bool:
-        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+        return bool(self.password_hash) and pwd_context.verify(password, self.password_hash)
 
 class Room(Base):
     __tablename__ = "rooms"
@@ -34,12 +34,18 @@ class Room(Base):
     created_by = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     is_active = Column(Boolean, default=True)
+    # Медиа через серверный ретранслятор (media_relay.py) вместо полной сетки между участниками
+    media_relay = Column(Boolean, default=False, server_default=expression.false(), nullable=False)
     
     # Связи
     messages = relationship("Message", back_populates="room")
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # Keyset-пагинация истории: WHERE room_id = ? ORDER BY created_at, id
+        Index("ix_messages_room_created_id", "room_id", "created_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     room_id = Column(Integer, ForeignKey("rooms.id"))
@@ -58,4 +64,12 @@ class RoomParticipant(Base):
     room_id = Column(Integer, ForeignKey("rooms.id"))
     user_id = Column(Integer, ForeignKey("users.id"))
     joined_at = Column(DateTime(timezone=True), server_default=func.now())
-    is_online = Column(Boolean, default=False)
\ No newline at end of file
+    is_online = Column(Boolean, default=False)
+
+class IdBlock(Base):
+    """Счетчик диапазонов id (hi/lo): воркер резервирует блок и раздает id из него без БД"""
+    __tablename__ = "id_blocks"
+    
+    name = Column(String, primary_key=True)
+    # Первый id, еще не выданный ни одному воркеру
+    next_id = Column(Integer, nullable=False)
@@ -0,0 +1,212 @@
+# rate_limit.py
+"""Ограничение частоты входящих сообщений: token bucket на соединение, пользователя и комнату.
+
+Бюджеты:
+    frames    - все входящие кадры соединения, проверяется до разбора кадра
+    signaling - offer/answer/ICE и сообщения ретранслятора
+    chat      - сообщения чата (WebSocket и POST /api/rooms/{room_id}/messages)
+
+Лимит задается как "скорость/емкость": 5/20 - в среднем 5 сообщений в секунду,
+всплеск до 20. Корзины ссылаются на общий объект Limit, поэтому изменение
+лимита (RateLimiter.configure) действует сразу на все существующие корзины.
+Проверка - несколько арифметических операций без выделения объектов; корзины
+пользователей и комнат создаются при первом сообщении и удаляются, когда
+полностью восстановились (такая корзина ничем не отличается от новой).
+"""
+import os
+import time
+from typing import Dict, Optional
+
+import metrics
+
+# "бюджет.область=скорость/емкость,...", 0 - без ограничения; не указанные берутся из DEFAULT_LIMITS
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+# Токен для изменения лимитов через PUT /api/limits/{name}; без него лимиты меняются только при запуске
+RATE_LIMIT_ADMIN_TOKEN = os.getenv("RATE_LIMIT_ADMIN_TOKEN", "")
+# Как часто удалять восстановившиеся корзины пользователей и комнат, секунды
+SWEEP_INTERVAL = 60.0
+
+DEFAULT_LIMITS = {
+    "frames.connection": (200.0, 400.0),
+    "signaling.connection": (100.0, 300.0),
+    "signaling.user": (150.0, 400.0),
+    "signaling.room": (2000.0, 5000.0),
+    "chat.connection": (5.0, 20.0),
+    "chat.user": (5.0, 20.0),
+    "chat.room": (50.0, 100.0),
+}
+
+BUDGETS = ("signaling", "chat")
+
+
+def parse_limits(spec: str) -> Dict[str, tuple]:
+    limits = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, value = item.partition("=")
+        rate, _, burst = value.partition("/")
+        limits[name.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+def message_budget(message_type: Optional[str]) -> str:
+    return "chat" if message_type == "chat_message" else "signaling"
+
+
+class Limit:
+    """Параметры корзин одной области и счетчик отказов"""
+    __slots__ = ("name", "rate", "burst", "rejected")
+
+    def __init__(self, name: str, rate: float, burst: float):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        budget, _, scope = name.partition(".")
+        # Дочерняя серия счетчика - заранее, чтобы отказ не создавал ключ метки
+        self.rejected = metrics.rate_limited.labels(budget, scope)
+
+
+class TokenBucket:
+    __slots__ = ("limit", "tokens", "updated")
+
+    def __init__(self, limit: Limit, now: float):
+        self.limit = limit
+        self.tokens = limit.burst
+        self.updated = now
+
+    def refill(self, now: float) -> float:
+        limit = self.limit
+        tokens = self.tokens + (now - self.updated) * limit.rate
+        self.tokens = tokens if tokens < limit.burst else limit.burst
+        self.updated = now
+        return self.tokens
+
+    def available(self, now: float) -> bool:
+        """Есть ли токен; отказ учитывается в счетчике лимита"""
+        if not self.limit.rate or self.refill(now) >= 1:
+            return True
+        self.limit.rejected.inc()
+        return False
+
+    def consume(self):
+        if self.limit.rate:
+            self.tokens -= 1
+
+    def take(self, now: float) -> bool:
+        if not self.available(now):
+            return False
+        self.consume()
+        return True
+
+    def full(self, now: float) -> bool:
+        return not self.limit.rate or self.refill(now) >= self.limit.burst
+
+
+class ConnectionLimits:
+    """Корзины одного WebSocket-соединения"""
+    __slots__ = ("frames", "signaling", "chat")
+
+    def __init__(self, limiter: "RateLimiter", now: float):
+        self.frames = TokenBucket(limiter.limits["frames.connection"], now)
+        self.signaling = TokenBucket(limiter.limits["signaling.connection"], now)
+        self.chat = TokenBucket(limiter.limits["chat.connection"], now)
+
+    def bucket(self, budget: str) -> TokenBucket:
+        return self.chat if budget == "chat" else self.signaling
+
+
+class _SharedBuckets:
+    """Корзины одной области (пользователи или комнаты) одного бюджета"""
+    __slots__ = ("limit", "buckets")
+
+    def __init__(self, limit: Limit):
+        self.limit = limit
+        self.buckets: Dict[str, TokenBucket] = {}
+
+
+class RateLimiter:
+    def __init__(self, limits: Dict[str, tuple]):
+        unknown = set(limits) - set(DEFAULT_LIMITS)
+        if unknown:
+            raise ValueError(f"Unknown rate limits: {', '.join(sorted(unknown))}")
+        self.limits: Dict[str, Limit] = {
+            name: Limit(name, *limits.get(name, default)) for name, default in DEFAULT_LIMITS.items()
+        }
+        self._users = {budget: _SharedBuckets(self.limits[f"{budget}.user"]) for budget in BUDGETS}
+        self._rooms = {budget: _SharedBuckets(self.limits[f"{budget}.room"]) for budget in BUDGETS}
+        self._last_sweep = time.monotonic()
+
+    def configure(self, name: str, rate: float, burst: float):
+        """Новый лимит области; действует на существующие корзины со следующей проверки"""
+        limit = self.limits.get(name)
+        if limit is None:
+            raise KeyError(name)
+        if rate < 0 or (rate and burst < 1):
+            raise ValueError("rate must be >= 0 and burst >= 1")
+        limit.rate = rate
+        limit.burst = burst
+
+    def connection_limits(self) -> ConnectionLimits:
+        return ConnectionLimits(self, time.monotonic())
+
+    def allow_frame(self, limits: ConnectionLimits) -> bool:
+        return limits.frames.take(time.monotonic())
+
+    def allow(self, budget: str, user_id: Optional[str], room_id: Optional[str],
+              connection: Optional[TokenBucket] = None) -> Optional[str]:
+        """None - сообщение пропускается, иначе область, в которой кончился бюджет.
+
+        Токен списывается только если хватает всех корзин: отклоненное сообщение
+        не расходует бюджет пользователя и комнаты.
+        """
+        now = time.monotonic()
+        if connection is not None and not connection.available(now):
+            return "connection"
+        user = self._bucket(self._users[budget], user_id, now) if user_id is not None else None
+        if user is not None and not user.available(now):
+            return "user"
+        room = self._bucket(self._rooms[budget], room_id, now) if room_id is not None else None
+        if room is not None and not room.available(now):
+            return "room"
+        if connection is not None:
+            connection.consume()
+        if user is not None:
+            user.consume()
+        if room is not None:
+            room.consume()
+        return None
+
+    def retry_after(self, budget: str, scope: str) -> float:
+        """Через сколько секунд в пустой корзине области появится токен"""
+        rate = self.limits[f"{budget}.{scope}"].rate
+        return 1 / rate if rate else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "limits": {
+                name: {"rate": limit.rate, "burst": limit.burst, "rejected": limit.rejected.value}
+                for name, limit in self.limits.items()
+            },
+            "tracked_users": {budget: len(shared.buckets) for budget, shared in self._users.items()},
+            "tracked_rooms": {budget: len(shared.buckets) for budget, shared in self._rooms.items()},
+        }
+
+    def _bucket(self, shared: _SharedBuckets, key: str, now: float) -> TokenBucket:
+        bucket = shared.buckets.get(key)
+        if bucket is None:
+            if now - self._last_sweep > SWEEP_INTERVAL:
+                self._sweep(now)
+            bucket = shared.buckets[key] = TokenBucket(shared.limit, now)
+        return bucket
+
+    def _sweep(self, now: float):
+        self._last_sweep = now
+        for group in (self._users, self._rooms):
+            for shared in group.values():
+                for key in [key for key, bucket in shared.buckets.items() if bucket.full(now)]:
+                    del shared.buckets[key]
+
+
+limiter = RateLimiter(parse_limits(RATE_LIMITS))
@@ -0,0 +1,187 @@
+# room_cache.py
+"""Кэш разрешения ссылок-приглашений: invite_link -> комната.
+
+Каждый вход в комнату (GET /api/rooms/{invite_link}) раньше читал таблицу
+rooms. Найденные комнаты живут в LRU на INVITE_CACHE_SIZE ссылок с TTL
+INVITE_CACHE_TTL. Неизвестные ссылки тоже кэшируются (отрицательные записи),
+но в отдельном LRU с коротким TTL: перебор и опечатки не вытесняют
+настоящие комнаты и не доходят до БД.
+
+Любое изменение комнаты через ORM (в том числе деактивация is_active=False)
+и создание комнаты с этой ссылкой сбрасывают запись. Массовые UPDATE в обход
+ORM нужно сопровождать invite_cache.invalidate() или clear().
+
+Остальные воркеры узнают о сбросе через шину (backplane.py): после commit
+ссылка рассылается через invite_cache.publish (подключается в main.py).
+Рассылка не гарантирована: пока шина не подключена, сброс остается на своем
+воркере, и чужие записи устаревают не дольше INVITE_CACHE_TTL (отрицательные -
+INVITE_NEGATIVE_CACHE_TTL).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
+
+from models import Room
+
+INVITE_CACHE_SIZE = int(os.getenv("INVITE_CACHE_SIZE", "10000"))
+INVITE_CACHE_TTL = float(os.getenv("INVITE_CACHE_TTL", "300"))
+INVITE_NEGATIVE_CACHE_SIZE = int(os.getenv("INVITE_NEGATIVE_CACHE_SIZE", "10000"))
+INVITE_NEGATIVE_CACHE_TTL = float(os.getenv("INVITE_NEGATIVE_CACHE_TTL", "30"))
+
+# Признак отрицательной записи: get() возвращает его для заведомо неизвестной ссылки
+MISSING = object()
+# Ключ session.info со ссылками, которые нужно разослать другим воркерам после commit
+_PENDING_LINKS = "invite_cache_pending"
+
+
+@dataclass(frozen=True)
+class CachedRoom:
+    """Неизменяемый снимок комнаты для входа по ссылке"""
+    id: int
+    name: str
+    is_active: bool
+    media_relay: bool
+
+    @classmethod
+    def from_model(cls, room: Room) -> "CachedRoom":
+        return cls(id=room.id, name=room.name, is_active=bool(room.is_active), media_relay=bool(room.media_relay))
+
+
+class _Lru:
+    __slots__ = ("max_size", "ttl", "entries")
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, Tuple[float, object]]" = OrderedDict()
+
+    def get(self, key: str, now: float):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < now:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: str, value, now: float):
+        if self.max_size <= 0:
+            return
+        self.entries[key] = (now + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+class InviteLinkCache:
+    """Положительные и отрицательные записи ссылок. Используется из event loop и из пула потоков"""
+
+    def __init__(self, max_size: int = INVITE_CACHE_SIZE, ttl: float = INVITE_CACHE_TTL,
+                 negative_size: int = INVITE_NEGATIVE_CACHE_SIZE, negative_ttl: float = INVITE_NEGATIVE_CACHE_TTL):
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._rooms = _Lru(max_size, ttl)
+        self._missing = _Lru(negative_size, negative_ttl)
+        self._lock = threading.Lock()
+        # Рассылка сброса ссылки другим воркерам; None - воркер один
+        self.publish: Optional[Callable[[str], None]] = None
+
+    def get(self, invite_link: str):
+        """CachedRoom, MISSING для известной неизвестной ссылки или None при промахе"""
+        now = time.monotonic()
+        with self._lock:
+            room = self._rooms.get(invite_link, now)
+            if room is not None:
+                self.hits += 1
+                return room
+            if self._missing.get(invite_link, now) is not None:
+                self.negative_hits += 1
+                return MISSING
+            self.misses += 1
+            return None
+
+    def put(self, invite_link: str, room: Optional[CachedRoom]):
+        """Запись результата чтения; None - ссылки нет"""
+        now = time.monotonic()
+        with self._lock:
+            if room is None:
+                self._missing.put(invite_link, True, now)
+            else:
+                self._missing.entries.pop(invite_link, None)
+                self._rooms.put(invite_link, room, now)
+
+    def invalidate(self, invite_link: str):
+        with self._lock:
+            self._rooms.entries.pop(invite_link, None)
+            self._missing.entries.pop(invite_link, None)
+
+    def clear(self):
+        with self._lock:
+            self._rooms.entries.clear()
+            self._missing.entries.clear()
+
+    async def resolve(self, db: AsyncSession, invite_link: str) -> Optional[CachedRoom]:
+        """Комната по ссылке из кэша, а при промахе - из БД; None - ссылки нет"""
+        room = self.get(invite_link)
+        if room is MISSING:
+            return None
+        if room is not None:
+            return room
+        db_room = await db.scalar(select(Room).where(Room.invite_link == invite_link))
+        room = CachedRoom.from_model(db_room) if db_room is not None else None
+        self.put(invite_link, room)
+        return room
+
+    def stats(self) -> dict:
+        total = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._rooms.entries),
+            "max_size": self._rooms.max_size,
+            "negative_size": len(self._missing.entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.negative_hits) / total, 4) if total else 0.0,
+        }
+
+
+invite_cache = InviteLinkCache()
+
+
+# Создание, изменение (деактивация) и удаление комнаты через ORM сбрасывают запись ее ссылки
+@event.listens_for(Room, "after_insert")
+@event.listens_for(Room, "after_update")
+@event.listens_for(Room, "after_delete")
+def _invalidate_room(mapper, connection, target):
+    if target.invite_link is None:
+        return
+    invite_cache.invalidate(target.invite_link)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_PENDING_LINKS, set()).add(target.invite_link)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_invalidations(session):
+    links = session.info.pop(_PENDING_LINKS, None)
+    if not links:
+        return
+    for link in links:
+        # Повторно: чтение между flush и commit могло положить в кэш старую строку
+        invite_cache.invalidate(link)
+        if invite_cache.publish is not None:
+            invite_cache.publish(link)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_invalidations(session):
+    session.info.pop(_PENDING_LINKS, None)
@@ -1,11 +1,32 @@
 # run.py
-import uvicorn
-from main import app
+import os
+
+# Схема и тестовые данные готовятся здесь один раз, а не при импорте main в каждом воркере
+DB_MIGRATE = os.getenv("DB_MIGRATE", "1") == "1"
+SEED_DATA = os.getenv("SEED_DATA", "1") == "1"
 
 if __name__ == "__main__":
+    import uvicorn
+
+    from logging_setup import setup_logging
+    from ws_protocol import CompressedWebSocketProtocol
+
+    setup_logging()
+    if DB_MIGRATE:
+        from database import upgrade_schema
+        upgrade_schema()
+    if SEED_DATA:
+        from seed import seed
+        seed()
+
     uvicorn.run(
         "main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True
-    )
\ No newline at end of file
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        reload=os.getenv("RELOAD", "1") == "1",
+        # permessage-deflate с настройками из WS_DEFLATE_* (см. ws_protocol.py)
+        ws=CompressedWebSocketProtocol,
+        # ping-кадры протокола для клиентов без capability heartbeat (см. heartbeat.py)
+        ws_ping_interval=float(os.getenv("WS_PING_INTERVAL", "20")),
+        ws_ping_timeout=float(os.getenv("WS_PING_TIMEOUT", "20")),
+    )
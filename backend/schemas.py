@@ -41,13 +41,14 @@ class RoomBase(BaseModel):
     name: str
 
 class RoomCreate(RoomBase):
-    pass
+    media_relay: bool = False
 
 class Room(RoomBase):
     id: int
     invite_link: str
     created_at: datetime
     is_active: bool
+    media_relay: bool = False
     
     class Config:
         orm_mode = True
@@ -57,11 +58,16 @@ class RoomResponse(RoomBase):
     invite_link: str
     created_at: datetime
     is_active: bool
+    media_relay: bool = False
     created_by: int
     
     class Config:
         from_attributes = True
 
+class RateLimitUpdate(BaseModel):
+    rate: float
+    burst: float
+
 class MessageBase(BaseModel):
     content: str
 class MessageCreate(MessageBase):
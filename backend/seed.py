@@ -0,0 +1,40 @@
+# seed.py
+"""Тестовые данные для разработки: пользователь test@example.com / test123.
+
+Раньше пользователя создавал обработчик startup в каждом воркере. Теперь
+run.py вызывает seed() один раз до запуска воркеров, если SEED_DATA=1;
+вручную: python seed.py. Пароль хешируется только при создании пользователя.
+"""
+import logging
+
+from database import SessionLocal
+from models import User
+
+logger = logging.getLogger(__name__)
+
+TEST_USER_EMAIL = "test@example.com"
+TEST_USER_NAME = "Test User"
+TEST_USER_PASSWORD = "test123"
+
+
+def seed():
+    db = SessionLocal()
+    try:
+        if db.query(User.id).filter(User.email == TEST_USER_EMAIL).first() is not None:
+            return
+        test_user = User(email=TEST_USER_EMAIL, name=TEST_USER_NAME)
+        test_user.set_password(TEST_USER_PASSWORD)
+        db.add(test_user)
+        db.commit()
+        logger.info("Создан тестовый пользователь с ID: %s", test_user.id)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    from database import upgrade_schema
+    from logging_setup import setup_logging
+
+    setup_logging()
+    upgrade_schema()
+    seed()
@@ -0,0 +1,85 @@
+# conftest.py
+"""Общие фикстуры: временная SQLite-база с миграциями и приложение.
+
+Переменные окружения выставляются до импорта модулей бэкенда: database.py
+читает DATABASE_URL при импорте.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+from datetime import timedelta
+from typing import Optional, Tuple
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_WORKDIR = tempfile.mkdtemp(prefix="conference-tests-")
+
+os.environ["DATABASE_URL"] = f"sqlite:///{_WORKDIR}/test.db"
+os.environ.setdefault("PASSWORD_HASH_ROUNDS", "4")
+os.environ.setdefault("LOG_QUEUE", "0")
+sys.path.insert(0, BACKEND_DIR)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_WORKDIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def app():
+    from database import upgrade_schema
+
+    upgrade_schema()
+    import main
+    return main.app
+
+
+@pytest.fixture
+def client(app):
+    from fastapi.testclient import TestClient
+
+    # Каждый тест проходит полный lifespan приложения
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def make_user(app):
+    """Пользователь в БД и его токен: make_user(name, expires_delta) -> (user_id, token)"""
+    import auth
+    from database import SessionLocal
+    from models import User
+
+    def make(name: str = "Test User", expires_delta: Optional[timedelta] = None) -> Tuple[int, str]:
+        db = SessionLocal()
+        try:
+            user = User(email=f"{uuid.uuid4().hex}@example.com", name=name)
+            db.add(user)
+            db.commit()
+            user_id = user.id
+        finally:
+            db.close()
+        return user_id, auth.create_access_token({"sub": str(user_id)}, expires_delta)
+
+    return make
+
+
+@pytest.fixture
+def make_room(app):
+    """Комната в БД: make_room(**поля) -> id"""
+    from database import SessionLocal
+    from models import Room
+
+    def make(**fields) -> int:
+        db = SessionLocal()
+        try:
+            room = Room(name=fields.pop("name", "Test Room"), invite_link=uuid.uuid4().hex[:10], **fields)
+            db.add(room)
+            db.commit()
+            return room.id
+        finally:
+            db.close()
+
+    return make
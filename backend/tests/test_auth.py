@@ -0,0 +1,111 @@
+# test_auth.py
+"""JWT в REST и при рукопожатии websocket, кэш проверенных токенов"""
+import time
+from datetime import timedelta
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from database import SessionLocal
+from models import User
+
+
+def bearer(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+def assert_rejected(client, url: str, **kwargs):
+    # Отказ до accept: рукопожатие закрывается с кодом 1008 (HTTP 403)
+    with pytest.raises(WebSocketDisconnect) as rejected:
+        with client.websocket_connect(url, **kwargs):
+            pass
+    assert rejected.value.code == 1008
+
+
+def test_websocket_rejects_missing_token(client, make_user, make_room):
+    room_id = make_room()
+    user_id, _ = make_user()
+    assert_rejected(client, f"/ws/webrtc/{room_id}/{user_id}")
+
+
+def test_websocket_rejects_garbage_token(client, make_user, make_room):
+    room_id = make_room()
+    user_id, _ = make_user()
+    assert_rejected(client, f"/ws/webrtc/{room_id}/{user_id}?token=not-a-jwt")
+
+
+def test_websocket_rejects_token_of_another_user(client, make_user, make_room):
+    room_id = make_room()
+    user_id, _ = make_user()
+    _, other_token = make_user()
+    assert_rejected(client, f"/ws/webrtc/{room_id}/{user_id}?token={other_token}")
+
+
+def test_websocket_accepts_query_token(client, make_user, make_room):
+    room_id = make_room()
+    user_id, token = make_user()
+    with client.websocket_connect(f"/ws/webrtc/{room_id}/{user_id}?token={token}") as websocket:
+        websocket.send_json({"type": "ping-test"})
+
+
+def test_websocket_accepts_authorization_header(client, make_user, make_room):
+    room_id = make_room()
+    user_id, token = make_user()
+    with client.websocket_connect(f"/ws/webrtc/{room_id}/{user_id}", headers=bearer(token)) as websocket:
+        websocket.send_json({"type": "ping-test"})
+
+
+def test_sync_websocket_rejects_webrtc_rooms(client, make_user):
+    _, token = make_user()
+    assert_rejected(client, f"/ws/webrtc_1?token={token}")
+
+
+def test_sync_websocket_stamps_authenticated_sender(client, make_user):
+    sender_id, sender_token = make_user()
+    _, receiver_token = make_user()
+    with client.websocket_connect(f"/ws/lobby?token={receiver_token}") as receiver:
+        with client.websocket_connect(f"/ws/lobby?token={sender_token}") as sender:
+            sender.send_json({"type": "note", "from_user_id": "spoofed"})
+            message = receiver.receive_json()
+            while message.get("type") != "note":
+                message = receiver.receive_json()
+    assert message["from_user_id"] == str(sender_id)
+
+
+def test_expired_token_is_rejected(client, make_user):
+    _, token = make_user(expires_delta=timedelta(seconds=-1))
+    assert client.get("/api/auth/me", headers=bearer(token)).status_code == 401
+
+
+def test_cached_token_expires_with_its_exp(client, make_user):
+    _, token = make_user(expires_delta=timedelta(seconds=2))
+    assert client.get("/api/auth/me", headers=bearer(token)).status_code == 200
+    # Повторный запрос обслуживается кэшем, но не дольше exp токена (jose сравнивает целые секунды)
+    time.sleep(3.5)
+    assert client.get("/api/auth/me", headers=bearer(token)).status_code == 401
+
+
+def test_rename_is_visible_through_cached_token(client, make_user):
+    user_id, token = make_user(name="Before")
+    assert client.get("/api/auth/me", headers=bearer(token)).json()["name"] == "Before"
+
+    db = SessionLocal()
+    try:
+        db.get(User, user_id).name = "After"
+        db.commit()
+    finally:
+        db.close()
+
+    assert client.get("/api/auth/me", headers=bearer(token)).json()["name"] == "After"
+
+
+def test_websocket_rejects_unknown_room(client, make_user):
+    user_id, token = make_user()
+    assert_rejected(client, f"/ws/webrtc/999999/{user_id}?token={token}")
+
+
+def test_chat_message_to_unknown_room_is_not_found(client, make_user):
+    _, token = make_user()
+    response = client.post("/api/rooms/999999/messages", json={"content": "hello", "room_id": 999999},
+                           headers=bearer(token))
+    assert response.status_code == 404
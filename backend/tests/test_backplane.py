@@ -0,0 +1,142 @@
+# test_backplane.py
+"""Два воркера на общей шине: рассылки, адресные сообщения и присутствие"""
+import asyncio
+import json
+
+from backplane import InMemoryBackplane, InMemoryHub
+from websocket import ConnectionManager
+
+
+class RecordingWebSocket:
+    """Клиент, который сразу принимает все кадры"""
+    scope = {}
+
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text: str):
+        message = json.loads(text)
+        # Номера событий у каждого воркера свои (см. event_log.py), здесь они не проверяются
+        message.pop("seq", None)
+        self.sent.append(message)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+    def types(self) -> list:
+        return [message["type"] for message in self.sent]
+
+
+async def flush(*managers: ConnectionManager):
+    """Ждет, пока писатели соединений разберут очереди"""
+    await asyncio.sleep(0)
+    while any(connection.queue for manager in managers for connection in manager.connections.values()):
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+
+async def start_workers():
+    hub = InMemoryHub()
+    first = ConnectionManager(backplane=InMemoryBackplane(hub))
+    second = ConnectionManager(backplane=InMemoryBackplane(hub))
+    await first.start()
+    await second.start()
+    return first, second
+
+
+async def stop_workers(*managers: ConnectionManager):
+    for manager in managers:
+        for connection in list(manager.connections.values()):
+            connection.stop()
+        await manager.stop()
+
+
+def test_broadcast_reaches_users_on_other_worker():
+    async def scenario():
+        first, second = await start_workers()
+        try:
+            alice, bob = RecordingWebSocket(), RecordingWebSocket()
+            await first.connect(alice, "room", "alice")
+            await second.connect(bob, "room", "bob")
+            await flush(first, second)
+            assert bob.sent[0] == {"type": "existing_users", "users": ["alice"]}
+            assert {"type": "user_joined", "user_id": "bob"} in alice.sent
+
+            await first.broadcast({"type": "chat_message", "text": "hi"}, "room", exclude_websocket=alice)
+            await flush(first, second)
+            assert bob.sent[-1] == {"type": "chat_message", "text": "hi"}
+            assert "chat_message" not in alice.types()
+        finally:
+            await stop_workers(first, second)
+
+    asyncio.run(scenario())
+
+
+def test_direct_message_is_routed_to_recipient_worker():
+    async def scenario():
+        first, second = await start_workers()
+        try:
+            alice, bob = RecordingWebSocket(), RecordingWebSocket()
+            await first.connect(alice, "room", "alice")
+            await second.connect(bob, "room", "bob")
+            await flush(first, second)
+
+            offer = {"type": "offer", "from_user_id": "alice", "sdp": "v=0"}
+            assert await first.send_to_user(offer, "room", "bob")
+            await flush(first, second)
+            assert bob.sent[-1] == offer
+            assert "offer" not in alice.types()
+
+            assert not await first.send_to_user(offer, "room", "carol")
+        finally:
+            await stop_workers(first, second)
+
+    asyncio.run(scenario())
+
+
+def test_presence_is_shared_between_workers():
+    async def scenario():
+        first, second = await start_workers()
+        try:
+            alice, bob = RecordingWebSocket(), RecordingWebSocket()
+            await first.connect(alice, "room", "alice")
+            await second.connect(bob, "room", "bob")
+            await flush(first, second)
+            for manager in (first, second):
+                assert sorted(manager.backplane.room_members("room")) == ["alice", "bob"]
+            assert first.backplane.has_remote_members("room")
+
+            await second.disconnect(bob, "room", "bob")
+            await flush(first, second)
+            assert alice.sent[-1] == {"type": "user_left", "user_id": "bob"}
+            for manager in (first, second):
+                assert manager.backplane.room_members("room") == ["alice"]
+            assert not first.backplane.has_remote_members("room")
+        finally:
+            await stop_workers(first, second)
+
+    asyncio.run(scenario())
+
+
+def test_reconnect_through_other_worker_replaces_old_connection():
+    async def scenario():
+        first, second = await start_workers()
+        try:
+            old, new = RecordingWebSocket(), RecordingWebSocket()
+            await first.connect(old, "room", "alice")
+            await second.connect(new, "room", "alice")
+            await flush(first, second)
+
+            assert old not in first.connections
+            assert "alice" not in first.rooms.get("room", {})
+            assert first.backplane.user_node("room", "alice") == second.backplane.node_id
+            # Уход старого соединения не объявляется: пользователь остался в комнате
+            assert "user_left" not in new.types()
+        finally:
+            await stop_workers(first, second)
+
+    asyncio.run(scenario())
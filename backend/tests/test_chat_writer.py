@@ -0,0 +1,156 @@
+# test_chat_writer.py
+"""Фоновая запись чата: дозапись при остановке, повторы и отбрасывание строк"""
+import asyncio
+import uuid
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import chat_writer as chat_writer_module
+import metrics
+from chat_writer import ChatWriter
+from database import SessionLocal
+from message_cache import message_cache
+from models import Message
+
+ROOM_ID = 9001
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(app, monkeypatch):
+    monkeypatch.setattr(chat_writer_module, "CHAT_RETRY_DELAY", 0.001)
+    monkeypatch.setattr(chat_writer_module, "CHAT_RETRY_MAX_DELAY", 0.01)
+
+
+def stored(ids) -> dict:
+    db = SessionLocal()
+    try:
+        rows = db.execute(select(Message.id, Message.content).where(Message.id.in_(list(ids)))).all()
+        return {row.id: row.content for row in rows}
+    finally:
+        db.close()
+
+
+def stored_contents(contents) -> set:
+    db = SessionLocal()
+    try:
+        return set(db.scalars(select(Message.content).where(Message.content.in_(list(contents)))))
+    finally:
+        db.close()
+
+
+async def submit_all(writer: ChatWriter, contents) -> list:
+    return [await writer.submit(room_id=ROOM_ID, user_id=1, content=content) for content in contents]
+
+
+def test_stop_flushes_queued_messages():
+    contents = [f"flush-{uuid.uuid4().hex}" for _ in range(50)]
+
+    async def run():
+        writer = ChatWriter(batch_size=7)
+        await writer.start()
+        rows = await submit_all(writer, contents)
+        await writer.stop()
+        assert writer.unwritten(ROOM_ID) == 0
+        return rows
+
+    rows = asyncio.run(run())
+    assert len({row["id"] for row in rows}) == len(rows)
+    assert stored(row["id"] for row in rows) == {row["id"]: row["content"] for row in rows}
+    # Время назначается в UTC с явным смещением
+    assert all(row["created_at"].utcoffset() is not None for row in rows)
+
+
+def test_transient_errors_retry_the_whole_batch(monkeypatch):
+    contents = [f"locked-{uuid.uuid4().hex}" for _ in range(5)]
+    insert = ChatWriter._insert
+    failures = []
+
+    async def flaky_insert(rows):
+        if len(failures) < 2:
+            failures.append(len(rows))
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        await insert(rows)
+
+    monkeypatch.setattr(ChatWriter, "_insert", staticmethod(flaky_insert))
+    retries = metrics.chat_write_retries.value
+    dropped = metrics.chat_dropped.labels("rejected").value
+
+    async def run():
+        writer = ChatWriter()
+        await writer.start()
+        # Пачка целиком: писатель не успевает забрать сообщения по одному
+        await submit_all(writer, contents)
+        await writer.stop()
+
+    asyncio.run(run())
+    assert stored_contents(contents) == set(contents)
+    assert metrics.chat_write_retries.value == retries + 2
+    assert metrics.chat_dropped.labels("rejected").value == dropped
+
+
+def test_rejected_row_is_dropped_and_uncached(monkeypatch):
+    good = [f"good-{uuid.uuid4().hex}" for _ in range(3)]
+    bad = f"bad-{uuid.uuid4().hex}"
+    insert = ChatWriter._insert
+
+    async def strict_insert(rows):
+        if any(row["content"] == bad for row in rows):
+            raise IntegrityError("INSERT", {}, Exception("FOREIGN KEY constraint failed"))
+        await insert(rows)
+
+    monkeypatch.setattr(ChatWriter, "_insert", staticmethod(strict_insert))
+    dropped = metrics.chat_dropped.labels("rejected").value
+
+    async def run():
+        message_cache.invalidate(ROOM_ID)
+
+        async def loader(limit):
+            return []
+
+        # Комната в кэше, сообщения дописываются в нее как в handle_chat_message
+        await message_cache.head(ROOM_ID, 10, loader)
+        writer = ChatWriter()
+        await writer.start()
+        rows = await submit_all(writer, good[:2] + [bad] + good[2:])
+        for row in rows:
+            message_cache.append(ROOM_ID, dict(row, user_name="u"))
+        await writer.stop()
+        return [message["content"] for message in await message_cache.head(ROOM_ID, 10, loader)]
+
+    cached = asyncio.run(run())
+    assert stored_contents(good + [bad]) == set(good)
+    assert metrics.chat_dropped.labels("rejected").value == dropped + 1
+    assert bad not in cached
+    assert set(good) <= set(cached)
+
+
+def test_taken_id_is_replaced_from_the_writers_block():
+    content = f"taken-{uuid.uuid4().hex}"
+
+    async def run():
+        writer = ChatWriter()
+        await writer.start()
+        # id, который писатель выдаст следующим, уже занят строкой, записанной в обход писателя
+        db = SessionLocal()
+        try:
+            db.add(Message(id=writer._next_id, room_id=ROOM_ID, user_id=1, content="foreign",
+                           created_at=datetime.utcnow()))
+            db.commit()
+        finally:
+            db.close()
+        row = await writer.submit(room_id=ROOM_ID, user_id=1, content=content)
+        taken_id = row["id"]
+        await writer.stop()
+        return taken_id, writer._next_id
+
+    taken_id, next_id = asyncio.run(run())
+    db = SessionLocal()
+    try:
+        new_id = db.scalar(select(Message.id).where(Message.content == content))
+    finally:
+        db.close()
+    assert new_id is not None and new_id != taken_id
+    assert taken_id < new_id < next_id
@@ -0,0 +1,156 @@
+# test_heartbeat.py
+"""Heartbeat: ping после тишины, снятие молчащего соединения и user_left остальным"""
+import asyncio
+import json
+
+import pytest
+
+import heartbeat
+import websocket
+from backplane import InMemoryBackplane
+from heartbeat import CAP_HEARTBEAT, HeartbeatWheel
+from websocket import HEARTBEAT_CLOSE_CODE, ConnectionManager
+
+INTERVAL = 2.0
+TIMEOUT = 2.0
+
+
+class Clock:
+    """Ручные часы вместо модуля time"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return self.now
+
+
+class ScriptedWebSocket:
+    """Клиент, который записывает полученные кадры и отвечает заранее заданными"""
+    scope = {}
+
+    def __init__(self):
+        self.sent = []
+        self.incoming = asyncio.Queue()
+        self.close_code = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text: str):
+        self.sent.append(json.loads(text))
+
+    async def receive(self) -> dict:
+        return {"type": "websocket.receive", "text": await self.incoming.get()}
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+    def types(self) -> list:
+        return [message["type"] for message in self.sent]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(heartbeat, "time", clock)
+    monkeypatch.setattr(websocket, "time", clock)
+    return clock
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def tick(manager: ConnectionManager, clock: Clock, seconds: float):
+    """Прокручивает колесо посекундно, как это делает его задача"""
+    for _ in range(int(seconds / manager.heartbeat.tick)):
+        clock.now += manager.heartbeat.tick
+        await manager.heartbeat._advance()
+        await settle()
+
+
+async def start_manager() -> ConnectionManager:
+    manager = ConnectionManager(backplane=InMemoryBackplane())
+    # Колесо двигается вручную из теста, его задача не запускается
+    manager.heartbeat = HeartbeatWheel(manager, interval=INTERVAL, timeout=TIMEOUT, tick=1.0)
+    await manager.backplane.start(manager._on_backplane_event)
+    return manager
+
+
+async def stop_manager(manager: ConnectionManager):
+    for connection in list(manager.connections.values()):
+        connection.stop()
+    await manager.stop()
+
+
+def test_silent_connection_is_reaped_and_peers_see_user_left(clock):
+    async def scenario():
+        manager = await start_manager()
+        try:
+            silent, peer = ScriptedWebSocket(), ScriptedWebSocket()
+            await manager.connect(silent, "room", "silent", [CAP_HEARTBEAT])
+            await manager.connect(peer, "room", "peer")
+            await settle()
+            assert manager.heartbeat.stats()["tracked"] == 1
+
+            await tick(manager, clock, INTERVAL)
+            assert silent.types()[-1] == "ping"
+            assert manager.heartbeat.pings == 1
+
+            await tick(manager, clock, TIMEOUT)
+            assert manager.heartbeat.reaped == 1
+            assert silent.close_code == HEARTBEAT_CLOSE_CODE
+            assert "silent" not in manager.rooms.get("room", {})
+            assert manager.backplane.room_members("room") == ["peer"]
+            assert peer.sent[-1]["type"] == "user_left"
+            assert peer.sent[-1]["user_id"] == "silent"
+            assert manager.heartbeat.stats()["tracked"] == 0
+        finally:
+            await stop_manager(manager)
+
+    asyncio.run(scenario())
+
+
+def test_pong_keeps_connection_alive(clock):
+    async def scenario():
+        manager = await start_manager()
+        try:
+            client = ScriptedWebSocket()
+            await manager.connect(client, "room", "client", [CAP_HEARTBEAT])
+            await settle()
+
+            for _ in range(3):
+                await tick(manager, clock, INTERVAL)
+                assert client.types()[-1] == "ping"
+                client.incoming.put_nowait(json.dumps({"type": "pong"}))
+                assert await manager.receive(client) == (None, None)
+
+            await tick(manager, clock, TIMEOUT)
+            assert manager.heartbeat.reaped == 0
+            assert client.close_code is None
+            assert "client" in manager.rooms["room"]
+        finally:
+            await stop_manager(manager)
+
+    asyncio.run(scenario())
+
+
+def test_connection_without_capability_is_not_tracked(clock):
+    async def scenario():
+        manager = await start_manager()
+        try:
+            client = ScriptedWebSocket()
+            await manager.connect(client, "room", "client")
+            await tick(manager, clock, INTERVAL + TIMEOUT + 1)
+            assert "ping" not in client.types()
+            assert manager.heartbeat.reaped == 0
+            assert "client" in manager.rooms["room"]
+        finally:
+            await stop_manager(manager)
+
+    asyncio.run(scenario())
@@ -0,0 +1,118 @@
+# test_ice_batch.py
+"""Склейка ICE-кандидатов в кадры ice-candidates (capability ice-batch)"""
+import asyncio
+import json
+
+import pytest
+
+import websocket
+from backplane import InMemoryBackplane
+from websocket import CAP_ICE_BATCH, ConnectionManager
+
+WINDOW = 0.05
+
+
+class RecordingWebSocket:
+    scope = {}
+
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text: str):
+        message = json.loads(text)
+        message.pop("seq", None)
+        self.sent.append(message)
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def candidate(index: int) -> dict:
+    return {"type": "ice-candidate", "from_user_id": "alice", "candidate": {"candidate": f"c{index}"}}
+
+
+async def settle(seconds: float = 0.0):
+    """Дает отработать таймерам и писателям соединений"""
+    await asyncio.sleep(seconds)
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def run_pair(capabilities, send):
+    """Подключает bob с заданными capability и возвращает кадры, которые он получил после send"""
+    manager = ConnectionManager(backplane=InMemoryBackplane())
+    await manager.start()
+    try:
+        bob = RecordingWebSocket()
+        await manager.connect(bob, "room", "bob", capabilities)
+        await settle()
+        bob.sent.clear()
+        await send(manager)
+        await settle(WINDOW * 2)
+        return bob.sent
+    finally:
+        for connection in list(manager.connections.values()):
+            connection.stop()
+        await manager.stop()
+
+
+@pytest.fixture
+def batch_window(monkeypatch):
+    monkeypatch.setattr(websocket, "ICE_BATCH_WINDOW", WINDOW)
+
+
+async def send_candidates(manager: ConnectionManager, count: int = 3):
+    for index in range(count):
+        await manager.send_to_user(candidate(index), "room", "bob")
+
+
+def test_candidates_are_batched_with_capability(batch_window):
+    sent = asyncio.run(run_pair([CAP_ICE_BATCH], send_candidates))
+    assert sent == [{
+        "type": "ice-candidates",
+        "from_user_id": "alice",
+        "candidates": [{"candidate": "c0"}, {"candidate": "c1"}, {"candidate": "c2"}],
+    }]
+
+
+def test_single_candidate_is_sent_as_is(batch_window):
+    sent = asyncio.run(run_pair([CAP_ICE_BATCH], lambda manager: send_candidates(manager, 1)))
+    assert sent == [candidate(0)]
+
+
+def test_candidates_are_not_batched_without_capability(batch_window):
+    sent = asyncio.run(run_pair([], send_candidates))
+    assert sent == [candidate(0), candidate(1), candidate(2)]
+
+
+def test_batching_is_off_by_default(monkeypatch):
+    monkeypatch.setattr(websocket, "ICE_BATCH_WINDOW", 0)
+    sent = asyncio.run(run_pair([CAP_ICE_BATCH], send_candidates))
+    assert sent == [candidate(0), candidate(1), candidate(2)]
+
+
+def test_batch_is_flushed_before_next_message_from_sender(batch_window):
+    async def send(manager: ConnectionManager):
+        await send_candidates(manager, 2)
+        await manager.send_to_user({"type": "answer", "from_user_id": "alice", "sdp": "v=0"}, "room", "bob")
+
+    sent = asyncio.run(run_pair([CAP_ICE_BATCH], send))
+    assert [message["type"] for message in sent] == ["ice-candidates", "answer"]
+
+
+def test_full_batch_is_sent_without_waiting(batch_window, monkeypatch):
+    monkeypatch.setattr(websocket, "ICE_BATCH_MAX", 2)
+
+    async def send(manager: ConnectionManager):
+        await send_candidates(manager, 2)
+        # Окно еще не истекло, но пачка уже полная и стоит в очереди
+        connection = manager.rooms["room"]["bob"]
+        assert not manager.ice_batches
+        assert [message_type for message_type, _, _ in connection.queue] == ["ice-candidates"]
+
+    sent = asyncio.run(run_pair([CAP_ICE_BATCH], send))
+    assert len(sent) == 1
+    assert len(sent[0]["candidates"]) == 2
@@ -0,0 +1,91 @@
+# test_invalidation.py
+"""Сброс кэшей на других воркерах через шину после commit"""
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from backplane import InMemoryBackplane, InMemoryHub
+from database import SessionLocal
+from models import User
+from user_cache import CachedUser, UserCache
+from websocket import ConnectionManager
+
+
+@pytest.fixture
+def other_worker(app, monkeypatch):
+    """Второй воркер на общей с приложением шине: (его менеджер, портал event loop приложения)"""
+    hub = InMemoryHub()
+    monkeypatch.setattr(main.manager, "backplane", InMemoryBackplane(hub))
+    other = ConnectionManager(InMemoryBackplane(hub))
+    with TestClient(app) as client:
+        client.portal.call(other.start)
+        try:
+            yield other
+        finally:
+            client.portal.call(other.stop)
+
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError("Condition was not met in time")
+
+
+def drain(other: ConnectionManager):
+    """Ждет, пока другой воркер получит все уже отправленные сбросы (шина сохраняет порядок)"""
+    seen = []
+    other.invalidation_listeners["marker"] = seen.append
+    main.manager.publish_invalidation("marker", "drain")
+    wait_until(lambda: seen)
+
+
+def update_user(user_id: int, commit: bool = True, **fields):
+    db = SessionLocal()
+    try:
+        user = db.get(User, user_id)
+        for name, value in fields.items():
+            setattr(user, name, value)
+        db.flush()
+        db.commit() if commit else db.rollback()
+    finally:
+        db.close()
+
+
+def test_user_change_reaches_other_workers(other_worker, make_user):
+    user_id, _ = make_user(name="Before")
+    cache = UserCache()
+    other_worker.invalidation_listeners["user"] = lambda key: cache.invalidate(int(key))
+    # Сброс от создания пользователя уже не должен прийти после заполнения кэша
+    drain(other_worker)
+    cache.put(CachedUser(id=user_id, name="Before", email="-", created_at=None))
+
+    # Откат не рассылается
+    update_user(user_id, commit=False, name="Rolled back")
+    drain(other_worker)
+    assert cache.get(user_id) is not None
+
+    update_user(user_id, name="After")
+    wait_until(lambda: cache.get(user_id) is None)
+
+
+def test_deleted_user_tokens_are_dropped_on_other_workers(other_worker, make_user):
+    from token_cache import VerifiedTokenCache
+
+    user_id, token = make_user()
+    cache = VerifiedTokenCache()
+    other_worker.invalidation_listeners["token"] = lambda key: cache.invalidate_user(int(key))
+    drain(other_worker)
+    cache.put(token, CachedUser(id=user_id, name="Test User", email="-", created_at=None))
+
+    db = SessionLocal()
+    try:
+        db.delete(db.get(User, user_id))
+        db.commit()
+    finally:
+        db.close()
+    wait_until(lambda: cache.get(token) is None)
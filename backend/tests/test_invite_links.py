@@ -0,0 +1,120 @@
+# test_invite_links.py
+"""Ссылки-приглашения: повтор вставки при совпадении, отрицательный кэш и сброс при деактивации"""
+import uuid
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+import main
+from database import SessionLocal
+from models import Room
+from room_cache import invite_cache
+
+
+def new_link() -> str:
+    return uuid.uuid4().hex[:10]
+
+
+def links(monkeypatch, *values: str):
+    """generate_invite_link выдает заданные ссылки по порядку"""
+    queue = list(values)
+    monkeypatch.setattr(main, "generate_invite_link", lambda length=10: queue.pop(0))
+    return queue
+
+
+@pytest.fixture
+def create_room(make_user):
+    owner, _ = make_user()
+
+    def create(name: str = "Room"):
+        db = SessionLocal()
+        try:
+            return main.insert_room(db, name=name, created_by=owner)
+        finally:
+            db.close()
+
+    return create
+
+
+def set_active(room_id: int, is_active: bool, commit: bool = True):
+    db = SessionLocal()
+    try:
+        db.get(Room, room_id).is_active = is_active
+        if commit:
+            db.commit()
+        else:
+            db.flush()
+            db.rollback()
+    finally:
+        db.close()
+
+
+def test_insert_room_retries_taken_link(create_room, monkeypatch):
+    taken, fresh = new_link(), new_link()
+    links(monkeypatch, taken)
+    first = create_room("First")
+
+    remaining = links(monkeypatch, taken, taken, fresh)
+    second = create_room("Second")
+    assert first.invite_link == taken
+    assert second.invite_link == fresh
+    assert second.id != first.id
+    assert remaining == []
+
+    db = SessionLocal()
+    try:
+        assert db.query(Room).filter(Room.invite_link == taken).count() == 1
+    finally:
+        db.close()
+
+
+def test_insert_room_gives_up_after_attempts(create_room, monkeypatch):
+    taken = new_link()
+    links(monkeypatch, taken)
+    create_room()
+
+    links(monkeypatch, *[taken] * main.INVITE_LINK_ATTEMPTS)
+    with pytest.raises(IntegrityError):
+        create_room("Unlucky")
+
+    db = SessionLocal()
+    try:
+        assert db.query(Room).filter(Room.name == "Unlucky").count() == 0
+    finally:
+        db.close()
+
+
+def test_unknown_link_is_cached_until_room_is_created(client, create_room, monkeypatch):
+    link = new_link()
+    before = invite_cache.stats()
+    assert client.get(f"/api/rooms/{link}").status_code == 404
+    assert client.get(f"/api/rooms/{link}").status_code == 404
+    after = invite_cache.stats()
+    assert after["misses"] - before["misses"] == 1
+    assert after["negative_hits"] - before["negative_hits"] == 1
+
+    links(monkeypatch, link)
+    room = create_room()
+    response = client.get(f"/api/rooms/{link}")
+    assert response.status_code == 200
+    assert response.json()["room_id"] == room.id
+
+
+def test_deactivation_invalidates_cached_link(client, create_room, monkeypatch):
+    published = []
+    monkeypatch.setattr(invite_cache, "publish", published.append)
+    link = new_link()
+    links(monkeypatch, link)
+    room = create_room()
+    assert client.get(f"/api/rooms/{link}").status_code == 200
+
+    # Отмененное изменение другим воркерам не рассылается
+    published.clear()
+    set_active(room.id, False, commit=False)
+    assert published == []
+
+    set_active(room.id, False)
+    assert published == [link]
+    response = client.get(f"/api/rooms/{link}")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Room is not active"
@@ -0,0 +1,179 @@
+# test_message_cache.py
+"""Кэш последних сообщений: первая страница без БД, склейка чтений и ограничение памяти"""
+import asyncio
+
+import pytest
+
+import message_cache
+from message_cache import ENTRY_OVERHEAD, RecentMessageCache
+
+
+def make_message(message_id: int, content: str = "hi") -> dict:
+    return {"id": message_id, "user_id": 1, "user_name": "u", "content": content, "created_at": None}
+
+
+class Loader:
+    """Последние n сообщений комнаты из "БД"; можно придержать ответ через gate"""
+
+    def __init__(self, messages, gate: asyncio.Event = None):
+        self.messages = list(messages)
+        self.gate = gate
+        self.calls = []
+
+    async def __call__(self, limit: int):
+        self.calls.append(limit)
+        if self.gate is not None:
+            await self.gate.wait()
+        return self.messages[-limit:]
+
+
+def ids(messages) -> list:
+    return [message["id"] for message in messages]
+
+
+def test_first_page_is_served_from_cache():
+    async def scenario():
+        cache = RecentMessageCache(per_room=5, max_bytes=10 ** 6, ttl=0)
+        loader = Loader(make_message(index) for index in range(1, 9))
+
+        assert ids(await cache.head(1, 3, loader)) == [6, 7, 8]
+        assert loader.calls == [5]
+        assert ids(await cache.head(1, 5, loader)) == [4, 5, 6, 7, 8]
+        assert loader.calls == [5]
+
+        # Больше, чем хранится, а история комнаты длиннее - идем в БД
+        assert ids(await cache.head(1, 8, loader)) == list(range(1, 9))
+        assert len(loader.calls) == 2
+        assert cache.stats()["hits"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_short_room_is_complete():
+    async def scenario():
+        cache = RecentMessageCache(per_room=5, max_bytes=10 ** 6, ttl=0)
+        loader = Loader([make_message(1), make_message(2)])
+        await cache.head(1, 2, loader)
+        assert ids(await cache.head(1, 50, loader)) == [1, 2]
+        assert len(loader.calls) == 1
+
+    asyncio.run(scenario())
+
+
+def test_appended_messages_are_served_without_reload():
+    async def scenario():
+        cache = RecentMessageCache(per_room=3, max_bytes=10 ** 6, ttl=0)
+        loader = Loader([make_message(1)])
+        await cache.head(1, 3, loader)
+
+        cache.append(1, make_message(2))
+        cache.append(1, make_message(2), remote=True)
+        cache.append(1, make_message(3))
+        cache.append(1, make_message(4))
+        assert ids(await cache.head(1, 3, loader)) == [2, 3, 4]
+        assert len(loader.calls) == 1
+
+        cache.discard(1, 3)
+        assert ids(await cache.head(1, 2, loader)) == [2, 4]
+        # Холодная комната не заводится записью
+        cache.append(2, make_message(10))
+        assert cache.stats()["rooms"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_cold_reads_share_one_load():
+    async def scenario():
+        cache = RecentMessageCache(per_room=5, max_bytes=10 ** 6, ttl=0)
+        gate = asyncio.Event()
+        loader = Loader([make_message(1), make_message(2)], gate)
+
+        first = asyncio.create_task(cache.head(1, 5, loader))
+        second = asyncio.create_task(cache.head(1, 2, loader))
+        await asyncio.sleep(0)
+        # Сообщение, записанное во время чтения, не теряется
+        cache.append(1, make_message(3))
+        gate.set()
+
+        assert ids(await first) == [1, 2, 3]
+        assert ids(await second) == [2, 3]
+        assert loader.calls == [5]
+        assert cache.stats()["coalesced"] == 1
+        assert ids(await cache.head(1, 5, loader)) == [1, 2, 3]
+
+    asyncio.run(scenario())
+
+
+def test_waiters_reload_when_shared_load_fails():
+    async def scenario():
+        cache = RecentMessageCache(per_room=5, max_bytes=10 ** 6, ttl=0)
+        gate = asyncio.Event()
+        attempts = []
+
+        async def loader(limit: int):
+            attempts.append(limit)
+            await gate.wait()
+            if len(attempts) == 1:
+                raise RuntimeError("db is down")
+            return [make_message(1)]
+
+        first = asyncio.create_task(cache.head(1, 5, loader))
+        second = asyncio.create_task(cache.head(1, 5, loader))
+        await asyncio.sleep(0)
+        gate.set()
+
+        with pytest.raises(RuntimeError):
+            await first
+        assert ids(await second) == [1]
+        assert len(attempts) == 2
+
+    asyncio.run(scenario())
+
+
+def test_byte_cap_evicts_least_recently_used_room():
+    async def scenario():
+        room_size = 2 * (ENTRY_OVERHEAD + len("hi") + len("u"))
+        cache = RecentMessageCache(per_room=5, max_bytes=2 * room_size, ttl=0)
+        for room_id in (1, 2):
+            await cache.head(room_id, 5, Loader([make_message(room_id * 10), make_message(room_id * 10 + 1)]))
+        assert cache.stats()["bytes"] == 2 * room_size
+
+        # Комната 1 читалась последней, поэтому вытесняется комната 2
+        await cache.head(1, 5, Loader([]))
+        await cache.head(3, 5, Loader([make_message(30), make_message(31)]))
+        stats = cache.stats()
+        assert stats["rooms"] == 2
+        assert stats["evictions"] == 1
+        assert stats["bytes"] <= stats["max_bytes"]
+
+        reload = Loader([make_message(20), make_message(21)])
+        await cache.head(2, 5, reload)
+        assert reload.calls == [5]
+
+    asyncio.run(scenario())
+
+
+def test_room_expires_after_ttl(monkeypatch):
+    class Clock:
+        now = 1000.0
+
+        def monotonic(self):
+            return self.now
+
+    clock = Clock()
+    monkeypatch.setattr(message_cache, "time", clock)
+
+    async def scenario():
+        cache = RecentMessageCache(per_room=5, max_bytes=10 ** 6, ttl=5)
+        loader = Loader([make_message(1)])
+        await cache.head(1, 5, loader)
+        clock.now += 4
+        await cache.head(1, 5, loader)
+        assert len(loader.calls) == 1
+
+        clock.now += 2
+        await cache.head(1, 5, loader)
+        assert len(loader.calls) == 2
+        assert cache.stats()["expirations"] == 1
+
+    asyncio.run(scenario())
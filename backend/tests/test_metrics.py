@@ -0,0 +1,59 @@
+# test_metrics.py
+"""Латентность HTTP-запросов в /metrics"""
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+import metrics
+from main import RequestLatencyMiddleware
+
+
+def latency(method: str, route: str, status: str):
+    child = metrics.http_request_seconds.labels(method, route, status)
+    return child.count, child.sum
+
+
+@pytest.fixture
+def probe_client():
+    probe = FastAPI()
+    probe.add_middleware(RequestLatencyMiddleware)
+
+    @probe.get("/probe/stream/{item}")
+    def stream(item: str):
+        def body():
+            yield "["
+            # Тело отдается дольше, чем обработчик возвращает ответ
+            time.sleep(0.2)
+            yield "]"
+        return StreamingResponse(body(), media_type="application/json")
+
+    @probe.get("/probe/fail")
+    def fail():
+        raise RuntimeError("boom")
+
+    with TestClient(probe, raise_server_exceptions=False) as client:
+        yield client
+
+
+def test_streamed_body_is_timed_to_the_last_chunk(probe_client):
+    count, total = latency("GET", "/probe/stream/{item}", "200")
+    assert probe_client.get("/probe/stream/a").text == "[]"
+    new_count, new_total = latency("GET", "/probe/stream/{item}", "200")
+    assert new_count == count + 1
+    assert new_total - total >= 0.2
+
+
+def test_failed_request_is_recorded_as_500(probe_client):
+    count, _ = latency("GET", "/probe/fail", "500")
+    assert probe_client.get("/probe/fail").status_code == 500
+    assert latency("GET", "/probe/fail", "500")[0] == count + 1
+
+
+def test_app_routes_are_labelled_by_template(client):
+    count, _ = latency("GET", "/api/rooms/{room_id}/messages", "200")
+    client.get("/api/rooms/12345/messages")
+    assert latency("GET", "/api/rooms/{room_id}/messages", "200")[0] == count + 1
+    assert "conference_http_request_seconds_bucket" in client.get("/metrics").text
@@ -0,0 +1,150 @@
+# test_outbound_queue.py
+"""Политики переполнения исходящей очереди соединения (WS_OVERFLOW_POLICY)"""
+import asyncio
+
+import pytest
+
+import websocket
+from backplane import InMemoryBackplane
+from websocket import SLOW_CONSUMER_CLOSE_CODE, ClientConnection, ConnectionManager
+
+
+class StalledWebSocket:
+    """Клиент, который принимает соединение, но не читает: отправка висит до закрытия"""
+    scope = {}
+
+    def __init__(self):
+        self.sent = []
+        self.close_code = None
+        self._unblock = asyncio.Event()
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text: str):
+        self.sent.append(text)
+        await self._unblock.wait()
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+        self._unblock.set()
+
+
+def new_counters() -> dict:
+    return {"dropped": 0, "coalesced": 0, "slow_disconnects": 0}
+
+
+def queued_payloads(connection: ClientConnection) -> list:
+    return [payload for _, _, payload in connection.queue]
+
+
+@pytest.fixture
+def queue_size(monkeypatch):
+    monkeypatch.setattr(websocket, "OUTBOUND_QUEUE_SIZE", 2)
+
+
+def test_drop_oldest_discards_oldest_ice_candidate(queue_size, monkeypatch):
+    monkeypatch.setattr(websocket, "OVERFLOW_POLICY", "drop_oldest")
+
+    async def scenario():
+        counters = new_counters()
+        connection = ClientConnection(None, StalledWebSocket(), "room", "user", counters)
+        assert connection.enqueue("ice-1", "ice-candidate")
+        assert connection.enqueue("offer", "offer")
+        assert connection.enqueue("ice-2", "ice-candidate")
+        assert queued_payloads(connection) == ["offer", "ice-2"]
+        assert counters["dropped"] == 1
+        assert connection.dropped == 1
+
+    asyncio.run(scenario())
+
+
+def test_drop_oldest_keeps_critical_messages(queue_size, monkeypatch):
+    monkeypatch.setattr(websocket, "OVERFLOW_POLICY", "drop_oldest")
+
+    async def scenario():
+        counters = new_counters()
+        connection = ClientConnection(None, StalledWebSocket(), "room", "user", counters)
+        assert connection.enqueue("offer", "offer")
+        assert connection.enqueue("answer", "answer")
+        # Некритичное сообщение теряется само, критичное требует отключения клиента
+        assert connection.enqueue("ice", "ice-candidate")
+        assert counters["dropped"] == 1
+        assert not connection.enqueue("chat", "chat_message")
+        assert queued_payloads(connection) == ["offer", "answer"]
+
+    asyncio.run(scenario())
+
+
+def test_coalesce_replaces_queued_presence_event(queue_size, monkeypatch):
+    monkeypatch.setattr(websocket, "OVERFLOW_POLICY", "coalesce")
+
+    async def scenario():
+        counters = new_counters()
+        connection = ClientConnection(None, StalledWebSocket(), "room", "user", counters)
+        joined = {"type": "user_joined", "user_id": "7"}
+        left = {"type": "user_left", "user_id": "7"}
+        assert connection.enqueue("joined", "user_joined", websocket._coalesce_key(joined))
+        assert connection.enqueue("offer", "offer")
+        assert connection.enqueue("left", "user_left", websocket._coalesce_key(left))
+        assert queued_payloads(connection) == ["left", "offer"]
+        assert counters["coalesced"] == 1
+        assert counters["dropped"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_coalesce_falls_back_to_dropping_ice(queue_size, monkeypatch):
+    monkeypatch.setattr(websocket, "OVERFLOW_POLICY", "coalesce")
+
+    async def scenario():
+        counters = new_counters()
+        connection = ClientConnection(None, StalledWebSocket(), "room", "user", counters)
+        assert connection.enqueue("ice", "ice-candidate")
+        assert connection.enqueue("offer", "offer")
+        other = {"type": "user_joined", "user_id": "8"}
+        assert connection.enqueue("joined", "user_joined", websocket._coalesce_key(other))
+        assert queued_payloads(connection) == ["offer", "joined"]
+        assert counters["coalesced"] == 0
+        assert counters["dropped"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_disconnect_policy_rejects_any_overflow(queue_size, monkeypatch):
+    monkeypatch.setattr(websocket, "OVERFLOW_POLICY", "disconnect")
+
+    async def scenario():
+        counters = new_counters()
+        connection = ClientConnection(None, StalledWebSocket(), "room", "user", counters)
+        assert connection.enqueue("ice-1", "ice-candidate")
+        assert connection.enqueue("ice-2", "ice-candidate")
+        assert not connection.enqueue("ice-3", "ice-candidate")
+        assert counters["dropped"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_slow_consumer_is_evicted_on_broadcast(queue_size, monkeypatch):
+    monkeypatch.setattr(websocket, "OVERFLOW_POLICY", "disconnect")
+
+    async def scenario():
+        manager = ConnectionManager(backplane=InMemoryBackplane())
+        await manager.start()
+        try:
+            slow = StalledWebSocket()
+            await manager.connect(slow, "room", "slow")
+            # Писатель забирает первый кадр и зависает на отправке, следующие копятся в очереди
+            for index in range(4):
+                await manager.broadcast({"type": "chat_message", "text": str(index)}, "room")
+                await asyncio.sleep(0)
+            await asyncio.sleep(0)
+
+            assert slow not in manager.connections
+            assert "slow" not in manager.rooms.get("room", {})
+            assert manager.room_counters["room"]["slow_disconnects"] == 1
+            assert slow.close_code == SLOW_CONSUMER_CLOSE_CODE
+        finally:
+            await manager.stop()
+
+    asyncio.run(scenario())
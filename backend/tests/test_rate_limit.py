@@ -0,0 +1,100 @@
+# test_rate_limit.py
+"""Token bucket: всплеск, восстановление, отказы без списания и 429 для REST"""
+import pytest
+
+import rate_limit
+from rate_limit import RateLimiter, limiter
+
+
+class Clock:
+    """Ручные часы вместо time.monotonic"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def chat_user_limit():
+    """Бюджет чата пользователя 1/2 на время теста"""
+    limit = limiter.limits["chat.user"]
+    rate, burst = limit.rate, limit.burst
+    limiter.configure("chat.user", 1, 2)
+    yield
+    limiter.configure("chat.user", rate, burst)
+
+
+def test_bucket_allows_burst_then_refills(clock):
+    limits = RateLimiter({"chat.user": (2, 3)})
+    assert [limits.allow("chat", "u1", None) for _ in range(4)] == [None, None, None, "user"]
+
+    clock.now += 0.5
+    assert limits.allow("chat", "u1", None) is None
+    assert limits.allow("chat", "u1", None) == "user"
+    # Корзины пользователей независимы
+    assert limits.allow("chat", "u2", None) is None
+    assert limits.stats()["limits"]["chat.user"]["rejected"] >= 2
+
+
+def test_rejected_message_does_not_spend_other_budgets(clock):
+    limits = RateLimiter({"chat.user": (1, 1), "chat.room": (1, 2)})
+    assert limits.allow("chat", "u1", "room") is None
+    assert limits.allow("chat", "u1", "room") == "user"
+    # Отказ по пользователю не списал токен комнаты
+    assert limits.allow("chat", "u2", "room") is None
+    assert limits.allow("chat", "u3", "room") == "room"
+
+
+def test_connection_bucket_is_checked_first(clock):
+    limits = RateLimiter({"chat.connection": (1, 1)})
+    connection = limits.connection_limits()
+    assert limits.allow("chat", "u1", "room", connection.chat) is None
+    assert limits.allow("chat", "u1", "room", connection.chat) == "connection"
+    assert limits.allow("chat", "u1", "room") is None
+
+
+def test_configure_applies_to_existing_buckets(clock):
+    limits = RateLimiter({"chat.user": (1, 1)})
+    assert limits.allow("chat", "u1", None) is None
+    assert limits.allow("chat", "u1", None) == "user"
+
+    limits.configure("chat.user", 0, 0)
+    assert all(limits.allow("chat", "u1", None) is None for _ in range(10))
+    with pytest.raises(ValueError):
+        limits.configure("chat.user", 1, 0)
+    with pytest.raises(KeyError):
+        limits.configure("chat.unknown", 1, 1)
+
+
+def test_idle_buckets_are_swept(clock):
+    limits = RateLimiter({"chat.user": (1, 2)})
+    limits.allow("chat", "u1", None)
+    assert limits.stats()["tracked_users"]["chat"] == 1
+
+    clock.now += rate_limit.SWEEP_INTERVAL + 1
+    limits.allow("chat", "u2", None)
+    assert limits.stats()["tracked_users"]["chat"] == 1
+
+
+def test_rest_chat_message_is_rejected_with_retry_after(client, make_user, make_room, clock, chat_user_limit):
+    _, token = make_user()
+    room = make_room()
+    headers = {"Authorization": f"Bearer {token}"}
+
+    statuses = []
+    for index in range(3):
+        response = client.post(f"/api/rooms/{room}/messages", json={"content": f"m{index}", "room_id": room},
+                               headers=headers)
+        statuses.append(response.status_code)
+    assert statuses == [200, 200, 429]
+    assert response.headers["Retry-After"] == "1"
+    assert "user limit" in response.json()["detail"]
@@ -0,0 +1,91 @@
+# test_resume.py
+"""Возобновление сессии websocket: после обрыва клиент получает только пропущенные события"""
+import time
+
+import main
+
+# Код обрыва без чистого закрытия: такой сокет можно возобновить (см. CLEAN_CLOSE_CODES)
+ABNORMAL_CLOSE = 1006
+
+
+def receive_type(websocket, message_type: str) -> dict:
+    message = websocket.receive_json()
+    while message.get("type") != message_type:
+        message = websocket.receive_json()
+    return message
+
+
+def wait_parked(room_key: str, user_id: str, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        log = main.manager.room_logs.get(room_key)
+        if log is not None and user_id in log.parked:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"User {user_id} was not parked in {room_key}")
+
+
+def test_resume_replays_missed_events(client, make_user, make_room):
+    user_id, token = make_user()
+    peer_id, peer_token = make_user()
+    room = make_room()
+    room_key = f"webrtc_{room}"
+
+    with client.websocket_connect(f"/ws/webrtc/{room}/{peer_id}?token={peer_token}") as peer:
+        with client.websocket_connect(f"/ws/webrtc/{room}/{user_id}?token={token}&caps=resume") as websocket:
+            session = receive_type(websocket, "session")
+            assert session["resumed"] is False
+            receive_type(peer, "user_joined")
+            websocket.close(code=ABNORMAL_CLOSE)
+        wait_parked(room_key, str(user_id))
+
+        peer.send_json({"type": "note", "text": "missed"})
+
+        resume = f"{session['session']}:{session['seq']}"
+        with client.websocket_connect(
+                f"/ws/webrtc/{room}/{user_id}?token={token}&caps=resume&resume={resume}") as resumed:
+            assert receive_type(resumed, "session")["resumed"] is True
+            replayed = resumed.receive_json()
+            assert replayed["type"] == "note"
+            assert replayed["text"] == "missed"
+            assert replayed["from_user_id"] == str(peer_id)
+            assert replayed["seq"] > session["seq"]
+
+            # Остальные участники не видят обрыва и повторного входа: следующее для них событие - probe
+            resumed.send_json({"type": "probe"})
+            assert peer.receive_json()["type"] == "probe"
+
+
+def test_resume_from_unknown_point_falls_back_to_full_join(client, make_user, make_room):
+    user_id, token = make_user()
+    peer_id, peer_token = make_user()
+    room = make_room()
+    room_key = f"webrtc_{room}"
+
+    with client.websocket_connect(f"/ws/webrtc/{room}/{peer_id}?token={peer_token}") as peer:
+        with client.websocket_connect(f"/ws/webrtc/{room}/{user_id}?token={token}&caps=resume") as websocket:
+            receive_type(websocket, "session")
+            receive_type(peer, "user_joined")
+            websocket.close(code=ABNORMAL_CLOSE)
+        wait_parked(room_key, str(user_id))
+
+        # Журнал не знает такой сессии: клиенту нужна полная синхронизация, остальным - выход и вход
+        with client.websocket_connect(
+                f"/ws/webrtc/{room}/{user_id}?token={token}&caps=resume&resume=unknown:0") as resumed:
+            assert receive_type(resumed, "session")["resumed"] is False
+            assert receive_type(peer, "user_left")["user_id"] == str(user_id)
+            assert receive_type(peer, "user_joined")["user_id"] == str(user_id)
+
+
+def test_clean_close_is_not_parked(client, make_user, make_room):
+    user_id, token = make_user()
+    peer_id, peer_token = make_user()
+    room = make_room()
+
+    with client.websocket_connect(f"/ws/webrtc/{room}/{peer_id}?token={peer_token}") as peer:
+        with client.websocket_connect(f"/ws/webrtc/{room}/{user_id}?token={token}&caps=resume") as websocket:
+            receive_type(websocket, "session")
+            receive_type(peer, "user_joined")
+        # Закрытие клиентом (1000) - окончательный выход без ожидания переподключения
+        assert receive_type(peer, "user_left")["user_id"] == str(user_id)
+        assert str(user_id) not in main.manager.room_logs[f"webrtc_{room}"].parked
@@ -0,0 +1,143 @@
+# token_cache.py
+"""Кэш проверенных JWT: дайджест токена -> пользователь.
+
+Проверка подписи (python-jose) и поиск пользователя выполняются при первом
+предъявлении токена. Повторные REST-запросы и переподключения websocket с
+тем же токеном берут пользователя отсюда. Ключ - SHA-256 токена, сами токены
+в памяти не хранятся. Запись живет до exp токена, но не дольше
+TOKEN_CACHE_TTL: после истечения токен снова проходит полную проверку и
+отклоняется.
+
+Изменение или удаление пользователя через ORM сбрасывает все записи его
+токенов; после commit сброс рассылается остальным воркерам через шину
+(token_cache.publish подключается в main.py).
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import User
+from user_cache import CachedUser
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+
+# Ключ session.info: пользователи, чьи токены нужно сбросить и на других воркерах
+_PENDING_TOKEN_USERS = "token_cache_pending"
+
+
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+class VerifiedTokenCache:
+    """LRU проверенных токенов с учетом exp. Используется из event loop и из пула потоков"""
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, Tuple[float, CachedUser]]" = OrderedDict()
+        # user_id -> дайджесты его токенов, для сброса при изменении пользователя
+        self._by_user: Dict[int, Set[bytes]] = {}
+        self._lock = threading.Lock()
+        # Рассылка сброса токенов пользователя другим воркерам; None - воркер один
+        self.publish: Optional[Callable[[int], None]] = None
+
+    def get(self, token: str) -> Optional[CachedUser]:
+        digest = token_digest(token)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    self._remove(digest)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, token: str, user: CachedUser, expires_at: Optional[float] = None) -> CachedUser:
+        """Запись проверенного токена; expires_at - exp токена (unix-время)"""
+        lifetime = self.ttl
+        if expires_at is not None:
+            lifetime = min(lifetime, expires_at - time.time())
+        if lifetime <= 0 or self.max_size <= 0:
+            return user
+        digest = token_digest(token)
+        with self._lock:
+            self._remove(digest)
+            self._entries[digest] = (time.monotonic() + lifetime, user)
+            self._by_user.setdefault(user.id, set()).add(digest)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+        return user
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for digest in list(self._by_user.get(user_id, ())):
+                self._remove(digest)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def _remove(self, digest: bytes):
+        entry = self._entries.pop(digest, None)
+        if entry is None:
+            return
+        digests = self._by_user.get(entry[1].id)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._by_user[entry[1].id]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "users": len(self._by_user),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+token_cache = VerifiedTokenCache()
+
+
+# Новые данные пользователя (или его удаление) должны дойти и до уже проверенных токенов
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_user_tokens(mapper, connection, target):
+    token_cache.invalidate_user(target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_PENDING_TOKEN_USERS, set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_token_invalidations(session):
+    user_ids = session.info.pop(_PENDING_TOKEN_USERS, None)
+    if not user_ids:
+        return
+    for user_id in user_ids:
+        # Удаленный пользователь не должен проходить по токену, проверенному до commit
+        token_cache.invalidate_user(user_id)
+        if token_cache.publish is not None:
+            token_cache.publish(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_token_invalidations(session):
+    session.info.pop(_PENDING_TOKEN_USERS, None)
@@ -0,0 +1,171 @@
+# user_cache.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
+
+from database import AsyncSessionLocal
+from models import User
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+
+# Ключ session.info: id пользователей, изменения которых после commit рассылаются другим воркерам
+_PENDING_USERS = "user_cache_pending"
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """Неизменяемый снимок пользователя для горячих путей (без ORM-сессии)"""
+    id: int
+    name: str
+    email: str
+    created_at: Optional[datetime]
+
+    @classmethod
+    def from_model(cls, user: User) -> "CachedUser":
+        return cls(id=user.id, name=user.name, email=user.email, created_at=user.created_at)
+
+
+class UserCache:
+    """LRU-кэш пользователей с TTL. Используется из event loop и из пула потоков"""
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Рассылка сброса пользователя другим воркерам; None - воркер один
+        self.publish: Optional[Callable[[int], None]] = None
+
+    def get(self, user_id: int) -> Optional[CachedUser]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user: CachedUser) -> CachedUser:
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def load(self, db: Session, user_id: int) -> Optional[CachedUser]:
+        """Пользователь из кэша, а при промахе - из БД"""
+        user = self.get(user_id)
+        if user is not None:
+            return user
+        return self.fetch(db, user_id)
+
+    def fetch(self, db: Session, user_id: int) -> Optional[CachedUser]:
+        """Чтение пользователя из БД в обход кэша с обновлением записи"""
+        db_user = db.query(User).filter(User.id == user_id).first()
+        if db_user is None:
+            return None
+        return self.put(CachedUser.from_model(db_user))
+
+    async def fetch_async(self, db: AsyncSession, user_id: int) -> Optional[CachedUser]:
+        db_user = await db.get(User, user_id)
+        if db_user is None:
+            return None
+        return self.put(CachedUser.from_model(db_user))
+
+    def load_many(self, db: Session, user_ids: Iterable[int]) -> Dict[int, CachedUser]:
+        """Пакетная загрузка: все промахи добираются одним запросом"""
+        result, missing = self._split(user_ids)
+        if missing:
+            for db_user in db.query(User).filter(User.id.in_(missing)):
+                result[db_user.id] = self.put(CachedUser.from_model(db_user))
+        return result
+
+    async def load_many_async(self, db: AsyncSession, user_ids: Iterable[int]) -> Dict[int, CachedUser]:
+        result, missing = self._split(user_ids)
+        if missing:
+            for db_user in await db.scalars(select(User).where(User.id.in_(missing))):
+                result[db_user.id] = self.put(CachedUser.from_model(db_user))
+        return result
+
+    def _split(self, user_ids: Iterable[int]) -> Tuple[Dict[int, CachedUser], List[int]]:
+        result = {}
+        missing = []
+        for user_id in set(user_ids):
+            user = self.get(user_id)
+            if user is None:
+                missing.append(user_id)
+            else:
+                result[user_id] = user
+        return result, missing
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+async def fetch_user(user_id: int) -> Optional[CachedUser]:
+    """Промах кэша вне HTTP-запроса (websocket): чтение из БД с собственной сессией"""
+    async with AsyncSessionLocal() as db:
+        return await user_cache.fetch_async(db, user_id)
+
+
+user_cache = UserCache()
+
+
+# Любое изменение пользователя через ORM сбрасывает его запись в кэше; другие воркеры
+# узнают об этом через шину после commit (user_cache.publish подключается в main.py)
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_user(mapper, connection, target):
+    user_cache.invalidate(target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_PENDING_USERS, set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_user_invalidations(session):
+    user_ids = session.info.pop(_PENDING_USERS, None)
+    if not user_ids:
+        return
+    for user_id in user_ids:
+        # Чтение между flush и commit могло снова положить в кэш старые данные
+        user_cache.invalidate(user_id)
+        if user_cache.publish is not None:
+            user_cache.publish(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_user_invalidations(session):
+    session.info.pop(_PENDING_USERS, None)
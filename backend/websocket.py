@@ -1,42 +1,331 @@
 # websocket.py
-from fastapi import WebSocket
-from typing import Dict, List
+from fastapi import WebSocket, WebSocketDisconnect
+from typing import Awaitable, Callable, Deque, Dict, FrozenSet, Iterable, List, Optional, Tuple, Union
+from collections import deque
+import asyncio
 import logging
+import os
+import time
 from datetime import datetime
+from backplane import Backplane, create_backplane
+from codec import append_field, create_codec
+from event_log import CAP_RESUME, RESUME_GRACE, RoomEventLog
+from heartbeat import CAP_HEARTBEAT, HeartbeatWheel
+from logging_setup import log_event
+from rate_limit import limiter, message_budget
+import metrics
+
+try:
+    import msgpack
+except ImportError:  # MessagePack - необязательная зависимость, без нее доступен только JSON
+    msgpack = None
 
 logger = logging.getLogger(__name__)
 
+# Таймаут одной отправки: медленный клиент не должен задерживать рассылку по комнате
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+
+# Размер исходящей очереди соединения и политика при переполнении:
+#   drop_oldest - выбрасываем самое старое некритичное сообщение (например, устаревший ICE-кандидат)
+#   coalesce    - заменяем устаревшее событие присутствия того же пользователя, иначе как drop_oldest
+#   disconnect  - сразу отключаем медленного клиента
+OUTBOUND_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop_oldest")
+OVERFLOW_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+if OVERFLOW_POLICY not in OVERFLOW_POLICIES:
+    raise ValueError(f"WS_OVERFLOW_POLICY must be one of {OVERFLOW_POLICIES}, got {OVERFLOW_POLICY!r}")
+
+# Сообщения, которые можно потерять без поломки сигнализации
+NON_CRITICAL_TYPES = {"ice-candidate", "ice-candidates"}
+PRESENCE_TYPES = {"user_joined", "user_left"}
+
+# Код закрытия для медленного клиента (RFC 6455: Try Again Later)
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# Код закрытия соединения, не ответившего на heartbeat (как у keepalive в websockets)
+HEARTBEAT_CLOSE_CODE = 1011
+# Коды, которыми клиент закрывает сокет намеренно: после них сессия не ждет переподключения
+CLEAN_CLOSE_CODES = (1000, 1001)
+
+# Пакетная доставка ICE-кандидатов: кандидаты от одного отправителя одному получателю
+# копятся окно ICE_BATCH_WINDOW и уходят одним кадром ice-candidates. Только для
+# клиентов, заявивших при подключении capability ice-batch; 0 - выключено
+ICE_BATCH_WINDOW = float(os.getenv("WS_ICE_BATCH_WINDOW_MS", "0")) / 1000
+ICE_BATCH_MAX = int(os.getenv("WS_ICE_BATCH_MAX", "32"))
+CAP_ICE_BATCH = "ice-batch"
+
+# Клиент, предложивший этот subprotocol, получает и отправляет бинарные кадры MessagePack
+MSGPACK_SUBPROTOCOL = "conference.msgpack"
+
+
+def pack_message(message: dict) -> bytes:
+    return msgpack.packb(message)
+
+
+def select_subprotocol(websocket: WebSocket) -> Optional[str]:
+    """Subprotocol соединения: MessagePack, если клиент его предложил и библиотека установлена"""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in websocket.scope.get("subprotocols", ()):
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+def parse_capabilities(value: Optional[str]) -> FrozenSet[str]:
+    """Capability клиента из параметра подключения: ?caps=ice-batch,..."""
+    if not value:
+        return frozenset()
+    return frozenset(item.strip() for item in value.split(",") if item.strip())
+
+
+def _coalesce_key(message: dict) -> Optional[Tuple[str, str]]:
+    """Ключ, по которому более новое сообщение заменяет старое в очереди"""
+    if message.get("type") in PRESENCE_TYPES:
+        return ("presence", str(message.get("user_id")))
+    return None
+
+
+class ClientConnection:
+    """Исходящая очередь и задача-писатель одного WebSocket-соединения"""
+    __slots__ = ("manager", "websocket", "room_id", "user_id", "capabilities", "binary", "queue",
+                 "dropped", "counters", "limits", "last_seen", "pinged", "wheel_slot", "closed",
+                 "_ready", "_writer")
+
+    def __init__(self, manager: "ConnectionManager", websocket: WebSocket, room_id: str, user_id: str,
+                 counters: Dict[str, int], capabilities: FrozenSet[str] = frozenset(), binary: bool = False):
+        self.manager = manager
+        self.websocket = websocket
+        self.room_id = room_id
+        self.user_id = user_id
+        self.capabilities = capabilities
+        # Кадры MessagePack вместо текста JSON
+        self.binary = binary
+        # Элементы очереди: (тип сообщения, ключ склейки, готовый кадр: текст или байты)
+        self.queue: Deque[Tuple[Optional[str], Optional[Tuple[str, str]], Union[str, bytes]]] = deque()
+        self.dropped = 0
+        self.counters = counters
+        # Корзины ограничения частоты входящих сообщений этого соединения
+        self.limits = limiter.connection_limits()
+        # Heartbeat: время последнего входящего кадра, отправлен ли ping, слот в колесе таймеров
+        self.last_seen = 0.0
+        self.pinged = False
+        self.wheel_slot: Optional[int] = None
+        self.closed = False
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._run())
+
+    def stop(self, close_code: Optional[int] = None):
+        """Останавливает писателя; очередь отбрасывается"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self._ready.set()
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        if close_code is not None:
+            asyncio.create_task(self._close(close_code))
+
+    def enqueue(self, payload: Union[str, bytes], message_type: Optional[str] = None,
+                key: Optional[Tuple[str, str]] = None) -> bool:
+        """Ставит сообщение в очередь; False - клиент не успевает и должен быть отключен"""
+        if self.closed:
+            return True
+
+        if len(self.queue) >= OUTBOUND_QUEUE_SIZE:
+            if OVERFLOW_POLICY == "disconnect":
+                return False
+            if OVERFLOW_POLICY == "coalesce" and key is not None and self._coalesce(payload, message_type, key):
+                return True
+            if not self._drop_oldest_non_critical():
+                if message_type not in NON_CRITICAL_TYPES:
+                    return False
+                # Очередь забита критичными сообщениями - теряем само новое некритичное
+                self._count_drop()
+                return True
+
+        self.queue.append((message_type, key, payload))
+        self._ready.set()
+        return True
+
+    def _coalesce(self, payload: Union[str, bytes], message_type: Optional[str], key: Tuple[str, str]) -> bool:
+        for index, (_, queued_key, _) in enumerate(self.queue):
+            if queued_key == key:
+                self.queue[index] = (message_type, key, payload)
+                self.counters["coalesced"] += 1
+                return True
+        return False
+
+    def _drop_oldest_non_critical(self) -> bool:
+        for index, (queued_type, _, _) in enumerate(self.queue):
+            if queued_type in NON_CRITICAL_TYPES:
+                del self.queue[index]
+                self._count_drop()
+                return True
+        return False
+
+    def _count_drop(self):
+        self.dropped += 1
+        self.counters["dropped"] += 1
+        metrics.ws_dropped.inc()
+
+    async def _run(self):
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                _, _, payload = self.queue.popleft()
+                if isinstance(payload, bytes):
+                    await asyncio.wait_for(self.websocket.send_bytes(payload), timeout=SEND_TIMEOUT)
+                else:
+                    await asyncio.wait_for(self.websocket.send_text(payload), timeout=SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            metrics.ws_send_failures.inc()
+            metrics.ws_evictions.labels("send_error").inc()
+            log_event(logger, logging.WARNING, "ws.send_error", "Failed to send to user %s: %r",
+                      self.user_id, e, room_id=self.room_id, user_id=self.user_id)
+            await self.manager._safe_disconnect(self.websocket, "send error")
+
+    async def _close(self, code: int):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), timeout=SEND_TIMEOUT)
+        except Exception:
+            pass
+
+
+class _IceBatch:
+    """ICE-кандидаты одной пары (отправитель, получатель), ждущие отправки"""
+    __slots__ = ("connection", "messages", "timer")
+
+    def __init__(self, connection: ClientConnection):
+        self.connection = connection
+        self.messages: List[dict] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
-        self.room_users: Dict[str, List[str]] = {}
-        self.websocket_to_user: Dict[WebSocket, str] = {}
-        self.websocket_to_room: Dict[WebSocket, str] = {}
+    """Участники комнат и их соединения.
+
+    Индексы построены на словарях: room_id -> {user_id -> ClientConnection} и
+    WebSocket -> ClientConnection, поэтому вход, выход и адресная отправка не
+    зависят от размера комнаты. У пользователя в комнате одно соединение.
+    """
+
+    def __init__(self, backplane: Optional[Backplane] = None, codec=None):
+        # JSON-кодек горячего пути: orjson, если установлен (см. codec.py)
+        self.codec = codec or create_codec()
+        self.rooms: Dict[str, Dict[str, ClientConnection]] = {}
+        self.connections: Dict[WebSocket, ClientConnection] = {}
+        # Накапливаемые ICE-кандидаты: (room_id, от кого, кому) -> пачка
+        self.ice_batches: Dict[Tuple[str, str, str], _IceBatch] = {}
+        # Счетчики потерь по комнатам (переживают переподключения участников)
+        self.room_counters: Dict[str, Dict[str, int]] = {}
+        # Журналы событий комнат для возобновления сессий (см. event_log.py)
+        self.room_logs: Dict[str, RoomEventLog] = {}
+        # Вызываются, когда пользователь окончательно покинул комнату на этом воркере
+        self.leave_listeners: List[Callable[[str, str], Awaitable[None]]] = []
+        # Вызываются для рассылок, пришедших от других воркеров: (room_id, тип, текст)
+        self.remote_broadcast_listeners: List[Callable[[str, Optional[str], str], None]] = []
+        # Сброс записи кэша по команде другого воркера: имя кэша -> функция сброса по ключу
+        self.invalidation_listeners: Dict[str, Callable[[str], None]] = {}
+        # Цикл событий воркера: через него шлются сбросы кэшей из потоков пула
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Шина между воркерами: рассылки и присутствие в комнатах видны всем процессам
+        self.backplane = backplane or create_backplane()
+        # Один таймер на все соединения с capability heartbeat
+        self.heartbeat = HeartbeatWheel(self)
+        # ping одинаковый для всех: кодируем один раз
+        self._ping_text = self.codec.dumps({"type": "ping"})
+        self._ping_packed = pack_message({"type": "ping"}) if msgpack is not None else None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        await self.backplane.start(self._on_backplane_event)
+        self.heartbeat.start()
+        logger.info("Connection manager started with %s codec", self.codec.name)
 
-    async def connect(self, websocket: WebSocket, room_id: str, user_id: str):
-        await websocket.accept()
+    async def stop(self):
+        await self.heartbeat.stop()
+        for log in self.room_logs.values():
+            for timer in log.parked.values():
+                timer.cancel()
+            log.parked.clear()
+        await self.backplane.stop()
+        self._loop = None
+
+    def publish_invalidation(self, cache: str, key: str):
+        """Сброс записи кэша на остальных воркерах; можно вызывать из любого потока"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        event = {"op": "invalidate", "cache": cache, "key": key}
+        asyncio.run_coroutine_threadsafe(self.backplane.publish(event), loop)
+
+    async def connect(self, websocket: WebSocket, room_id: str, user_id: str,
+                      capabilities: Iterable[str] = (), resume: Optional[Tuple[str, int]] = None) -> bool:
+        """Подключение к комнате; True - сессия возобновлена по resume=(session, seq).
+
+        При возобновлении клиент получает только пропущенные события, а остальные
+        участники не узнают о переподключении.
+        """
+        subprotocol = select_subprotocol(websocket)
+        await websocket.accept(subprotocol=subprotocol)
+        
+        replay = await self._prepare_resume(room_id, user_id, resume) if resume is not None else None
+        if replay is None:
+            # Очищаем старое соединение этого пользователя
+            await self._cleanup_user_connections(user_id, room_id)
         
-        # Очищаем старые соединения этого пользователя
-        await self._cleanup_user_connections(user_id, room_id)
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = self.rooms[room_id] = {}
+            self.room_counters[room_id] = {"dropped": 0, "coalesced": 0, "slow_disconnects": 0}
+        log = self.room_logs.get(room_id)
+        if log is None:
+            log = self.room_logs[room_id] = RoomEventLog()
         
-        if room_id not in self.active_connections:
-            self.active_connections[room_id] = []
-            self.room_users[room_id] = []
+        connection = ClientConnection(self, websocket, room_id, user_id, self.room_counters[room_id],
+                                      frozenset(capabilities), binary=subprotocol == MSGPACK_SUBPROTOCOL)
+        self.connections[websocket] = connection
+        room[user_id] = connection
+        connection.start()
+        if self.heartbeat.enabled and CAP_HEARTBEAT in connection.capabilities:
+            self.heartbeat.add(connection)
         
-        self.active_connections[room_id].append(websocket)
-        self.websocket_to_user[websocket] = user_id
-        self.websocket_to_room[websocket] = room_id
+        # session и повторные события ставятся в очередь до первого await: новые события
+        # комнаты придут после них и уже с номерами больше log.seq
+        if CAP_RESUME in connection.capabilities:
+            connection.enqueue(self._encode_for(connection, {
+                "type": "session",
+                "session": log.epoch,
+                "seq": log.seq,
+                "resumed": replay is not None,
+            }), "session")
+        if replay is not None:
+            overflow = False
+            for message_type, text in replay:
+                payload = pack_message(self.codec.loads(text)) if connection.binary else text
+                overflow = not connection.enqueue(payload, message_type) or overflow
+            metrics.ws_resumes.labels("resumed").inc()
+            metrics.ws_replayed_events.inc(len(replay))
+            log_event(logger, logging.INFO, "ws.resume", "⚡ USER %s RESUMED ROOM %s (%d events replayed)",
+                      user_id, room_id, len(replay), room_id=room_id, user_id=user_id)
+            if overflow:
+                await self._evict_slow_consumer(connection)
+            return True
         
-        if user_id not in self.room_users[room_id]:
-            self.room_users[room_id].append(user_id)
+        await self.backplane.join(room_id, user_id)
         
-        logger.info(f"✅ USER {user_id} JOINED ROOM {room_id}")
-        logger.info(f"📊 Room {room_id} now has {len(self.room_users[room_id])} users: {self.room_users[room_id]}")
+        log_event(logger, logging.INFO, "ws.join", "✅ USER %s JOINED ROOM %s (%d local users)",
+                  user_id, room_id, len(room), room_id=room_id, user_id=user_id)
         
-        # Отправляем новому пользователю список существующих участников
-        existing_users = [uid for uid in self.room_users[room_id] if uid != user_id]
+        # Отправляем новому пользователю список существующих участников (со всех воркеров)
+        existing_users = [uid for uid in self.backplane.room_members(room_id) if uid != user_id]
         if existing_users:
-            logger.info(f"📋 Sending existing users {existing_users} to new user {user_id}")
             await self._send_to_websocket(websocket, {
                 "type": "existing_users",
                 "users": existing_users
@@ -47,89 +336,460 @@ class ConnectionManager:
             "type": "user_joined",
             "user_id": user_id
         }, room_id, exclude_websocket=websocket)
+        return False
 
-    async def _cleanup_user_connections(self, user_id: str, room_id: str):
-        """Удаляем старые соединения пользователя"""
-        if room_id not in self.active_connections:
-            return
-            
-        to_remove = []
-        for ws in self.active_connections[room_id]:
-            if self.websocket_to_user.get(ws) == user_id:
-                to_remove.append(ws)
+    async def _prepare_resume(self, room_id: str, user_id: str,
+                              resume: Tuple[str, int]) -> Optional[List[Tuple[Optional[str], str]]]:
+        """Пропущенные пользователем события или None, если нужен обычный вход в комнату"""
+        log = self.room_logs.get(room_id)
+        current = self.rooms.get(room_id, {}).get(user_id)
+        parked = log is not None and user_id in log.parked
+        if current is None and not parked:
+            # Ожидание переподключения истекло или пользователь был на другом воркере
+            metrics.ws_resumes.labels("expired").inc()
+            return None
+        
+        replay = log.replay(resume[0], resume[1], user_id) if log is not None else None
+        if replay is not None:
+            # Старое соединение могло еще не заметить обрыв - заменяем его без выхода из комнаты
+            self._unpark(log, user_id)
+            if current is not None:
+                await self._safe_disconnect(current.websocket, "resumed by new connection")
+            return replay
         
-        for ws in to_remove:
-            await self._safe_disconnect(ws, "replaced by new connection")
+        # Пропущенных событий в журнале уже нет: клиент синхронизируется заново, поэтому
+        # остальным объявляется выход и вход, чтобы они перестроили соединения
+        metrics.ws_resumes.labels("gap").inc()
+        self._unpark(log, user_id)
+        await self._leave(room_id, user_id)
+        if current is not None:
+            await self._safe_disconnect(current.websocket, "replaced by new connection")
+        return None
+
+    async def receive(self, websocket: WebSocket) -> Tuple[Optional[dict], Optional[str]]:
+        """Следующее сообщение клиента и его исходный текст.
+
+        Текстовый кадр - JSON, бинарный - MessagePack (исходного текста у него нет).
+        (None, None) - обрабатывать нечего: кадр отброшен ограничителем частоты
+        до разбора или это pong на heartbeat.
+        """
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.last_seen = time.monotonic()
+            if not limiter.allow_frame(connection.limits):
+                log_event(logger, logging.WARNING, "ratelimit.drop", "🚦 Frame from %s dropped by connection limit",
+                          connection.user_id, room_id=connection.room_id, user_id=connection.user_id)
+                return None, None
+        if message.get("bytes") is not None:
+            if msgpack is None:
+                raise ValueError("Binary frames require the msgpack package")
+            data, text = msgpack.unpackb(message["bytes"]), None
+        else:
+            text = message["text"]
+            data = self.codec.loads(text)
+        if data.get("type") == "pong":
+            return None, None
+        return data, text
+
+    async def admit(self, websocket: WebSocket, message_type: Optional[str], room_id: str, user_id: str) -> bool:
+        """Проверка бюджета сообщения по лимитам соединения, пользователя и комнаты"""
+        connection = self.connections.get(websocket)
+        if connection is None:
+            return True
+        budget = message_budget(message_type)
+        scope = limiter.allow(budget, user_id, room_id, connection.limits.bucket(budget))
+        if scope is None:
+            return True
+        log_event(logger, logging.WARNING, "ratelimit.drop", "🚦 %s message from %s dropped by %s limit",
+                  budget, user_id, scope, room_id=room_id, user_id=user_id)
+        if budget == "chat":
+            # Автор должен узнать, что сообщение не доставлено; сигнализация отбрасывается молча
+            await self.send_to_user({
+                "type": "rate_limited",
+                "budget": budget,
+                "scope": scope,
+                "retry_after": limiter.retry_after(budget, scope),
+            }, room_id, user_id)
+        return False
 
-    async def _safe_disconnect(self, websocket: WebSocket, reason: str = "unknown"):
+    def with_sender(self, data: dict, raw: Optional[str], user_id: str) -> Optional[str]:
+        """Текст сообщения клиента с from_user_id без повторной сериализации.
+
+        data дополняется полем from_user_id на месте; возвращенный текст (если
+        есть) передается в send_to_user/broadcast и уходит получателям как есть.
+        """
+        data["from_user_id"] = user_id
+        if raw is None:
+            return None
+        return append_field(raw, '"from_user_id":' + self.codec.dumps(user_id))
+
+    async def _cleanup_user_connections(self, user_id: str, room_id: str):
+        """Удаляем старое соединение пользователя"""
+        connection = self.rooms.get(room_id, {}).get(user_id)
+        if connection is not None:
+            await self._safe_disconnect(connection.websocket, "replaced by new connection")
+
+    async def _safe_disconnect(self, websocket: WebSocket, reason: str = "unknown",
+                               close_code: Optional[int] = None):
         """Безопасное отключение WebSocket"""
-        room_id = self.websocket_to_room.get(websocket)
-        user_id = self.websocket_to_user.get(websocket)
-        
-        if room_id and room_id in self.active_connections:
-            if websocket in self.active_connections[room_id]:
-                self.active_connections[room_id].remove(websocket)
-        
-        # Очищаем маппинги
-        if websocket in self.websocket_to_user:
-            del self.websocket_to_user[websocket]
-        if websocket in self.websocket_to_room:
-            del self.websocket_to_room[websocket]
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+        connection.stop(close_code)
+        self.heartbeat.discard(connection)
+        
+        room = self.rooms.get(connection.room_id)
+        if room is not None and room.get(connection.user_id) is connection:
+            del room[connection.user_id]
             
-        logger.info(f"🔌 Disconnected user {user_id} from room {room_id}: {reason}")
+        log_event(logger, logging.INFO, "ws.disconnect", "🔌 Disconnected user %s from room %s: %s",
+                  connection.user_id, connection.room_id, reason,
+                  room_id=connection.room_id, user_id=connection.user_id)
 
     async def _send_to_websocket(self, websocket: WebSocket, message: dict):
-        """Безопасная отправка сообщения"""
-        try:
-            await websocket.send_json(message)
-        except Exception as e:
-            logger.warning(f"Failed to send message to websocket: {e}")
-            await self._safe_disconnect(websocket, "send error")
+        """Постановка сообщения в исходящую очередь соединения"""
+        connection = self.connections.get(websocket)
+        if connection is None:
+            return
+        await self._enqueue(connection, self._encode_for(connection, message), message.get("type"),
+                            _coalesce_key(message))
+
+    def _encode_for(self, connection: ClientConnection, message: dict,
+                    text: Optional[str] = None) -> Union[str, bytes]:
+        if connection.binary:
+            return pack_message(message)
+        return text if text is not None else self.codec.dumps(message)
+
+    async def _enqueue(self, connection: ClientConnection, payload: Union[str, bytes], message_type: Optional[str],
+                       key: Optional[Tuple[str, str]]):
+        metrics.ws_messages_forwarded.labels(metrics.message_type_label(message_type)).inc()
+        if not connection.enqueue(payload, message_type, key):
+            await self._evict_slow_consumer(connection)
+
+    async def _evict_slow_consumer(self, connection: ClientConnection):
+        log_event(logger, logging.WARNING, "ws.slow_consumer", "🐢 Slow consumer %s in room %s: queue is full (%d)",
+                  connection.user_id, connection.room_id, len(connection.queue),
+                  room_id=connection.room_id, user_id=connection.user_id)
+        connection.counters["slow_disconnects"] += 1
+        metrics.ws_evictions.labels("slow_consumer").inc()
+        await self._safe_disconnect(connection.websocket, "slow consumer", close_code=SLOW_CONSUMER_CLOSE_CODE)
+
+    async def send_to_user(self, message: dict, room_id: str, user_id: str, text: Optional[str] = None) -> bool:
+        """Адресная отправка сообщения одному участнику комнаты.
 
-    async def broadcast(self, message: dict, room_id: str, exclude_websocket: WebSocket = None):
-        """Отправка сообщения всем в комнате"""
-        if room_id not in self.active_connections:
+        text - уже готовый JSON этого сообщения, если он есть (см. with_sender).
+        """
+        connection = self.rooms.get(room_id, {}).get(user_id)
+        log = self.room_logs.get(room_id)
+        parked = log is not None and user_id in log.parked
+        if log is not None and (connection is not None or parked):
+            seq, text = self._record(log, user_id, None, message.get("type"),
+                                     text if text is not None else self.codec.dumps(message))
+            message = dict(message, seq=seq)
+        if connection is None and parked:
+            # Получатель переподключается: сообщение уйдет ему из журнала
+            return True
+        if connection is not None:
+            sender = message.get("from_user_id")
+            if sender is not None:
+                if (message.get("type") == "ice-candidate" and ICE_BATCH_WINDOW > 0
+                        and CAP_ICE_BATCH in connection.capabilities):
+                    self._batch_ice_candidate(connection, str(sender), message)
+                    return True
+                # Накопленные кандидаты уходят раньше следующего сообщения той же пары
+                if self.ice_batches:
+                    self._flush_ice_batch((room_id, str(sender), user_id))
+            await self._enqueue(connection, self._encode_for(connection, message, text), message.get("type"),
+                                _coalesce_key(message))
+            return True
+        
+        node_id = self.backplane.user_node(room_id, user_id)
+        if node_id is None or node_id == self.backplane.node_id:
+            log_event(logger, logging.WARNING, "ws.no_recipient", "Recipient %s not found in room %s, %s dropped",
+                      user_id, room_id, message.get("type"), room_id=room_id, user_id=user_id)
+            return False
+        
+        # Получатель подключен к другому воркеру
+        await self.backplane.publish({
+            "op": "direct",
+            "room": room_id,
+            "user": user_id,
+            "type": message.get("type"),
+            "text": text if text is not None else self.codec.dumps(message)
+        })
+        return True
+
+    def _batch_ice_candidate(self, connection: ClientConnection, sender: str, message: dict):
+        key = (connection.room_id, sender, connection.user_id)
+        batch = self.ice_batches.get(key)
+        if batch is None or batch.connection is not connection:
+            if batch is not None:
+                self._flush_ice_batch(key)
+            batch = self.ice_batches[key] = _IceBatch(connection)
+            batch.timer = asyncio.get_running_loop().call_later(ICE_BATCH_WINDOW, self._flush_ice_batch, key)
+        batch.messages.append(message)
+        if len(batch.messages) >= ICE_BATCH_MAX:
+            self._flush_ice_batch(key)
+
+    def _flush_ice_batch(self, key: Tuple[str, str, str]):
+        """Отправляет накопленных кандидатов пары одним кадром (один кандидат - как есть)"""
+        batch = self.ice_batches.pop(key, None)
+        if batch is None:
             return
-            
-        connections = self.active_connections[room_id]
-        if not connections:
+        batch.timer.cancel()
+        connection = batch.connection
+        if connection.closed:
+            return
+        
+        if len(batch.messages) == 1:
+            message = batch.messages[0]
+        else:
+            message = {
+                "type": "ice-candidates",
+                "from_user_id": key[1],
+                "candidates": [queued.get("candidate") for queued in batch.messages],
+            }
+            if "seq" in batch.messages[-1]:
+                message["seq"] = batch.messages[-1]["seq"]
+            metrics.ws_ice_batches.inc()
+            metrics.ws_ice_batched_candidates.inc(len(batch.messages))
+        metrics.ws_messages_forwarded.labels(message["type"]).inc()
+        if not connection.enqueue(self._encode_for(connection, message), message["type"]):
+            asyncio.create_task(self._evict_slow_consumer(connection))
+
+    async def broadcast(self, message: dict, room_id: str, exclude_websocket: WebSocket = None,
+                        text: Optional[str] = None):
+        """Отправка сообщения всем в комнате (text - уже готовый JSON сообщения, если есть)"""
+        # Сериализуем один раз: этот же текст уходит в очереди соединений и в шину
+        if text is None:
+            text = self.codec.dumps(message)
+        message_type = message.get("type")
+        key = _coalesce_key(message)
+        excluded = self.connections.get(exclude_websocket)
+        
+        await self._deliver_local(room_id, text, message_type, key,
+                                  exclude_user=excluded.user_id if excluded is not None else None)
+        
+        if self.backplane.has_remote_members(room_id):
+            await self.backplane.publish({
+                "op": "broadcast",
+                "room": room_id,
+                "type": message_type,
+                "key": key,
+                "text": text,
+                "exclude_user": excluded.user_id if excluded is not None else None
+            })
+
+    async def _deliver_local(self, room_id: str, text: str, message_type: Optional[str],
+                             key: Optional[Tuple[str, str]], exclude_user: Optional[str] = None):
+        """Раскладывает готовый текст по очередям соединений этого воркера"""
+        # Номер события свой на каждом воркере: в шину уходит текст без seq
+        log = self.room_logs.get(room_id)
+        if log is not None:
+            _, text = self._record(log, None, exclude_user, message_type, text)
+        room = self.rooms.get(room_id)
+        if not room:
             return
-            
-        logger.info(f"📢 Broadcasting {message.get('type')} to {len(connections)} users in {room_id}")
         
-        for websocket in connections[:]:
-            if websocket == exclude_websocket:
+        # Отправкой занимаются писатели соединений; постановка в очередь синхронна,
+        # поэтому комнату можно обходить без копии, а медленных отключить после обхода
+        start = time.perf_counter()
+        slow = None
+        recipients = 0
+        # MessagePack-версия кадра готовится один раз на рассылку и только если есть такие получатели
+        packed = None
+        for user_id, connection in room.items():
+            if user_id == exclude_user:
                 continue
-                
-            try:
-                await websocket.send_json(message)
-            except Exception as e:
-                logger.warning(f"Failed to broadcast to user {self.websocket_to_user.get(websocket)}: {e}")
-                await self._safe_disconnect(websocket, "broadcast error")
-
-    async def disconnect(self, websocket: WebSocket, room_id: str, user_id: str):
-        """Публичный метод для отключения"""
-        user_id = user_id or self.websocket_to_user.get(websocket)
-        
-        await self._safe_disconnect(websocket, "manual disconnect")
-        
-        # Удаляем пользователя из комнаты
-        if room_id in self.room_users and user_id in self.room_users[room_id]:
-            self.room_users[room_id].remove(user_id)
-            logger.info(f"👋 User {user_id} removed from room {room_id}")
-            
-        # Уведомляем остальных о выходе пользователя
-        if room_id in self.active_connections and self.active_connections[room_id]:
+            recipients += 1
+            payload = text
+            if connection.binary:
+                if packed is None:
+                    packed = pack_message(self.codec.loads(text))
+                payload = packed
+            if not connection.enqueue(payload, message_type, key):
+                if slow is None:
+                    slow = []
+                slow.append(connection)
+        
+        if recipients:
+            metrics.ws_fanout_seconds.observe(time.perf_counter() - start)
+            metrics.ws_fanout_size.observe(recipients)
+            metrics.ws_messages_forwarded.labels(metrics.message_type_label(message_type)).inc(recipients)
+            log_event(logger, logging.INFO, "ws.broadcast", "📢 Broadcasting %s to %d users in %s",
+                      message_type, recipients, room_id, room_id=room_id)
+        if slow:
+            for connection in slow:
+                await self._evict_slow_consumer(connection)
+
+    async def _on_backplane_event(self, event: dict):
+        """События, пришедшие от других воркеров"""
+        op = event["op"]
+        if op == "invalidate":
+            listener = self.invalidation_listeners.get(event["cache"])
+            if listener is not None:
+                listener(event["key"])
+            return
+        room_id = event["room"]
+        
+        if op == "broadcast":
+            for listener in self.remote_broadcast_listeners:
+                listener(room_id, event.get("type"), event["text"])
+            key = tuple(event["key"]) if event.get("key") else None
+            await self._deliver_local(room_id, event["text"], event.get("type"), key,
+                                      exclude_user=event.get("exclude_user"))
+        elif op == "direct":
+            connection = self.rooms.get(room_id, {}).get(event["user"])
+            log = self.room_logs.get(room_id)
+            text = event["text"]
+            if log is not None and (connection is not None or event["user"] in log.parked):
+                _, text = self._record(log, event["user"], None, event.get("type"), text)
+            if connection is not None:
+                payload = pack_message(self.codec.loads(text)) if connection.binary else text
+                await self._enqueue(connection, payload, event.get("type"), None)
+        elif op == "join":
+            # Пользователь переподключился через другой воркер - здешнее соединение
+            # (или ожидание переподключения) устарело
+            log = self.room_logs.get(room_id)
+            if log is not None:
+                self._unpark(log, event["user"])
+                self._cleanup_room(room_id)
+            connection = self.rooms.get(room_id, {}).get(event["user"])
+            if connection is not None:
+                await self._safe_disconnect(connection.websocket, "replaced by connection on another worker")
+        elif op == "leave" and event.get("reason") == "node_lost":
+            # Воркер упал и не успел сообщить о выходе своих участников
+            message = {"type": "user_left", "user_id": event["user"]}
+            await self._deliver_local(room_id, self.codec.dumps(message), "user_left", _coalesce_key(message))
+
+    def _record(self, log: RoomEventLog, recipient: Optional[str], exclude_user: Optional[str],
+                message_type: Optional[str], text: str) -> Tuple[int, str]:
+        """Присваивает событию номер и записывает его в журнал; возвращает номер и текст с seq"""
+        seq = log.next_seq()
+        sequenced = append_field(text, '"seq":%d' % seq)
+        if sequenced is None:
+            sequenced = self.codec.dumps(dict(self.codec.loads(text), seq=seq))
+        log.record(seq, recipient, exclude_user, message_type, sequenced)
+        return seq, sequenced
+
+    def room_stats(self, room_id: str) -> dict:
+        """Глубина исходящих очередей, счетчики потерь и журнал событий комнаты"""
+        connections = list(self.rooms.get(room_id, {}).values())
+        depths = [len(connection.queue) for connection in connections]
+        log = self.room_logs.get(room_id)
+        return {
+            "room_id": room_id,
+            "connections": len(connections),
+            "queue_depth": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            **self.room_counters.get(room_id, {"dropped": 0, "coalesced": 0, "slow_disconnects": 0}),
+            "users": [
+                {"user_id": connection.user_id, "queue_depth": len(connection.queue), "dropped": connection.dropped}
+                for connection in connections
+            ],
+            "event_log": log.stats() if log is not None else None,
+        }
+
+    async def ping(self, connection: ClientConnection):
+        """Heartbeat-запрос клиенту; ответом служит любой входящий кадр"""
+        payload = self._ping_packed if connection.binary else self._ping_text
+        await self._enqueue(connection, payload, "ping", None)
+
+    async def reap(self, connections: List[ClientConnection]):
+        """Снимает соединения, не ответившие на heartbeat, вместе с присутствием"""
+        for connection in connections:
+            if self.connections.get(connection.websocket) is not connection:
+                continue
+            log_event(logger, logging.WARNING, "ws.heartbeat_timeout",
+                      "💀 User %s in room %s missed heartbeat (idle %.1fs)",
+                      connection.user_id, connection.room_id, time.monotonic() - connection.last_seen,
+                      room_id=connection.room_id, user_id=connection.user_id)
+            metrics.ws_evictions.labels("heartbeat_timeout").inc()
+            await self.disconnect(connection.websocket, connection.room_id, connection.user_id,
+                                  reason="heartbeat timeout", close_code=HEARTBEAT_CLOSE_CODE, resumable=True)
+
+    async def disconnect(self, websocket: WebSocket, room_id: str, user_id: str,
+                         reason: str = "manual disconnect", close_code: Optional[int] = None,
+                         resumable: bool = False):
+        """Публичный метод для отключения; повторный вызов для того же сокета ничего не делает.
+
+        resumable - сокет оборвался, а не закрыт клиентом: если клиент заявил
+        capability resume, его уход объявляется только через RESUME_GRACE секунд,
+        и за это время он может возобновить сессию.
+        """
+        connection = self.connections.get(websocket)
+        user_id = user_id or (connection.user_id if connection is not None else None)
+        park = (resumable and RESUME_GRACE > 0 and connection is not None
+                and CAP_RESUME in connection.capabilities)
+        
+        await self._safe_disconnect(websocket, reason, close_code)
+        
+        room = self.rooms.get(room_id)
+        log = self.room_logs.get(room_id)
+        # Уход объявляем, только если пользователь не переподключился новым сокетом,
+        # не ждет переподключения и его уход еще не обработан (например, при снятии по heartbeat)
+        if ((room is None or user_id not in room) and not (log is not None and user_id in log.parked)
+                and self.backplane.user_node(room_id, user_id) == self.backplane.node_id):
+            if park and log is not None:
+                self._park(log, room_id, user_id)
+            else:
+                await self._leave(room_id, user_id)
+        
+        self._cleanup_room(room_id)
+
+    async def _leave(self, room_id: str, user_id: str):
+        """Окончательный выход пользователя из комнаты"""
+        log_event(logger, logging.INFO, "ws.leave", "👋 User %s removed from room %s",
+                  user_id, room_id, room_id=room_id, user_id=user_id)
+        await self.backplane.leave(room_id, user_id)
+        
+        # Уведомляем остальных о выходе пользователя (в том числе на других воркерах)
+        if self.backplane.has_members(room_id):
             await self.broadcast({
                 "type": "user_left",
                 "user_id": user_id
             }, room_id)
-            
-        # Очищаем пустые комнаты
-        if room_id in self.active_connections and not self.active_connections[room_id]:
-            del self.active_connections[room_id]
-            if room_id in self.room_users:
-                del self.room_users[room_id]
-            logger.info(f"🏁 Room {room_id} cleaned up")
-
-manager = ConnectionManager()
\ No newline at end of file
+        for listener in self.leave_listeners:
+            await listener(room_id, user_id)
+
+    def _park(self, log: RoomEventLog, room_id: str, user_id: str):
+        """Присутствие пользователя сохраняется RESUME_GRACE секунд в ожидании переподключения"""
+        log.parked[user_id] = asyncio.get_running_loop().call_later(
+            RESUME_GRACE, lambda: asyncio.create_task(self._expire_parked(room_id, user_id)))
+        log_event(logger, logging.INFO, "ws.park", "⏸️ User %s in room %s may resume within %.0fs",
+                  user_id, room_id, RESUME_GRACE, room_id=room_id, user_id=user_id)
+
+    def _unpark(self, log: RoomEventLog, user_id: str):
+        timer = log.parked.pop(user_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    async def _expire_parked(self, room_id: str, user_id: str):
+        log = self.room_logs.get(room_id)
+        if log is None or log.parked.pop(user_id, None) is None:
+            return
+        if (user_id not in self.rooms.get(room_id, {})
+                and self.backplane.user_node(room_id, user_id) == self.backplane.node_id):
+            await self._leave(room_id, user_id)
+        self._cleanup_room(room_id)
+
+    def _cleanup_room(self, room_id: str):
+        """Удаляет пустую комнату; журнал живет, пока кто-то ждет переподключения"""
+        room = self.rooms.get(room_id)
+        if room is not None and not room:
+            del self.rooms[room_id]
+            self.room_counters.pop(room_id, None)
+            logger.info("🏁 Room %s cleaned up", room_id, extra={"room_id": room_id})
+        log = self.room_logs.get(room_id)
+        if log is not None and room_id not in self.rooms and not log.parked:
+            del self.room_logs[room_id]
+
+manager = ConnectionManager()
+
+metrics.registry.gauge("conference_active_rooms", "Rooms with websocket clients on this worker",
+                       collect=lambda: len(manager.rooms))
+metrics.registry.gauge("conference_active_websockets", "Websocket clients connected to this worker",
+                       collect=lambda: len(manager.connections))
@@ -0,0 +1,33 @@
+# ws_protocol.py
+import os
+
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+
+# permessage-deflate: SDP и JSON сигнализации хорошо сжимаются.
+# Уровень 1-9 - CPU на каждое сообщение каждому получателю; окно 9-15 бит и memLevel 1-9
+# задают память компрессора на соединение: по умолчанию ~32 КБ вместо ~256 КБ у zlib
+WS_DEFLATE = os.getenv("WS_DEFLATE", "1") == "1"
+WS_DEFLATE_LEVEL = int(os.getenv("WS_DEFLATE_LEVEL", "6"))
+WS_DEFLATE_WINDOW_BITS = int(os.getenv("WS_DEFLATE_WINDOW_BITS", "12"))
+WS_DEFLATE_MEM_LEVEL = int(os.getenv("WS_DEFLATE_MEM_LEVEL", "5"))
+
+
+def deflate_extensions() -> list:
+    if not WS_DEFLATE:
+        return []
+    return [ServerPerMessageDeflateFactory(
+        server_max_window_bits=WS_DEFLATE_WINDOW_BITS,
+        compress_settings={"level": WS_DEFLATE_LEVEL, "memLevel": WS_DEFLATE_MEM_LEVEL},
+    )]
+
+
+class CompressedWebSocketProtocol(WebSocketProtocol):
+    """Протокол uvicorn (websockets) с настраиваемым permessage-deflate.
+
+    Подключается через uvicorn.run(..., ws=CompressedWebSocketProtocol), см. run.py.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.available_extensions = deflate_extensions()
@@ -8,6 +8,7 @@ import logoIcon from './logo-icon.svg';
 
 function HomePage() {
   const [newRoomName, setNewRoomName] = useState('');
+  const [mediaRelay, setMediaRelay] = useState(false);
   const [inviteLink, setInviteLink] = useState('');
   const [loading, setLoading] = useState(false);
   const { currentUser, logout } = useAuth();
@@ -61,7 +62,8 @@ function HomePage() {
     try {
       console.log('Creating room at:', `${API_BASE}/rooms`);
       const response = await axios.post(`${API_BASE}/rooms`, {
-        name: newRoomName
+        name: newRoomName,
+        media_relay: mediaRelay
       });
       
       navigate(`/room/${response.data.id}`, { 
@@ -171,6 +173,15 @@ function HomePage() {
                 {loading ? 'Создание...' : 'Создать комнату'}
               </button>
             </div>
+            <label className="relay-option">
+              <input
+                type="checkbox"
+                checked={mediaRelay}
+                onChange={(e) => setMediaRelay(e.target.checked)}
+                disabled={loading}
+              />
+              Большая комната (видео через сервер)
+            </label>
           </section>
 
           <section className="action-section">
@@ -8,7 +8,7 @@ import { useChat } from '../hooks/useChat';
 function RoomPage() {
   const location = useLocation();
   const navigate = useNavigate();
-  const { currentUser } = useAuth();
+  const { currentUser, logout } = useAuth();
   
   const { roomId, inviteLink, roomName, isHost } = location.state || {};
   const [webrtcManager, setWebrtcManager] = useState(null);
@@ -83,6 +83,15 @@ function RoomPage() {
         handleRemoteStream,
         handleUserLeft
       );
+      // Токен истек или отозван: выходим, ProtectedRoute вернет на страницу входа
+      manager.onAuthFailure = () => {
+        manager.destroy();
+        logout();
+      };
+      manager.onReconnectFailed = () => {
+        setError('Соединение с сервером потеряно. Обновите страницу.');
+        setConnectionStatus('error');
+      };
 
       const stream = await manager.initialize();
       console.log('WebRTC initialized successfully');
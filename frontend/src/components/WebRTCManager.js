@@ -1,4 +1,12 @@
-import { WS_BASE } from '../config';
+import { API_BASE, WS_BASE } from '../config';
+
+// Переподключение после обрыва: задержка удваивается от базовой до максимальной,
+// к ней добавляется случайная часть, чтобы после перезапуска сервера клиенты не шли разом
+const RECONNECT_BASE_DELAY = 1000;
+const RECONNECT_MAX_DELAY = 30000;
+const RECONNECT_MAX_ATTEMPTS = 10;
+// Сервер отклонил соединение по политике (недействительный токен)
+const WS_POLICY_VIOLATION = 1008;
 
 class WebRTCManager {
   constructor(roomId, userId, onRemoteStream, onUserLeft) {
@@ -11,6 +19,19 @@ class WebRTCManager {
     this.peerConnections = {};
     this.websocket = null;
     this.connectedUsers = new Set();
+    // Комната с серверным ретранслятором: одна публикация и подписки вместо полной сетки
+    this.relayMode = false;
+    this.publishConnection = null;
+    // Возобновление сессии после обрыва сокета: сервер повторит события после lastSeq
+    this.session = null;
+    this.lastSeq = 0;
+    this.reconnectTimer = null;
+    this.reconnectAttempts = 0;
+    this.destroyed = false;
+    // Токен больше не принимается: пользователя нужно вернуть ко входу
+    this.onAuthFailure = null;
+    // Переподключиться не удалось за RECONNECT_MAX_ATTEMPTS попыток
+    this.onReconnectFailed = null;
     
     this.configuration = {
       iceServers: [
@@ -84,22 +105,41 @@ class WebRTCManager {
     }
   }
 
-  connectWebSocket() {
+  connectWebSocket(resume = false) {
     return new Promise((resolve, reject) => {
-      const wsUrl = `${WS_BASE}/ws/webrtc/${this.roomId}/${this.userId}`;
+      // caps: сервер может присылать ICE-кандидатов пачками (ice-candidates),
+      // проверяет соединение ping-сообщениями, на которые нужно отвечать pong,
+      // и после обрыва повторяет пропущенные события вместо повторного входа в комнату
+      let wsUrl = `${WS_BASE}/ws/webrtc/${this.roomId}/${this.userId}?caps=ice-batch,heartbeat,resume`;
+      if (resume && this.session) {
+        wsUrl += `&resume=${this.session}:${this.lastSeq}`;
+      }
       console.log('Connecting to WebSocket:', wsUrl);
       
+      // Сервер проверяет JWT при рукопожатии: токен должен принадлежать userId.
+      // Браузерный WebSocket не передает заголовки, поэтому токен идет в адресе: в консоль он не пишется, в логах сервера скрывается
+      const token = localStorage.getItem('token');
+      if (token) {
+        wsUrl += `&token=${encodeURIComponent(token)}`;
+      }
+      
+      const previous = this.websocket;
       this.websocket = new WebSocket(wsUrl);
+      let opened = false;
       
       this.websocket.onopen = () => {
         console.log('WebSocket connected');
+        opened = true;
+        this.reconnectAttempts = 0;
         
-        setTimeout(() => {
-          this.sendWebSocketMessage({
-            type: 'user_joined',
-            user_id: this.userId
-          });
-        }, 1000);
+        if (!resume) {
+          setTimeout(() => {
+            this.sendWebSocketMessage({
+              type: 'user_joined',
+              user_id: this.userId
+            });
+          }, 1000);
+        }
         
         resolve();
       };
@@ -111,11 +151,34 @@ class WebRTCManager {
 
       this.websocket.onclose = (event) => {
         console.log('WebSocket disconnected:', event.code, event.reason);
+        if (this.destroyed || event.target !== this.websocket) {
+          return;
+        }
+        if (event.code === WS_POLICY_VIOLATION) {
+          this.handleAuthFailure();
+          return;
+        }
+        if (!opened) {
+          // Отказ в рукопожатии (HTTP 403) и недоступный сервер браузер сообщает одинаково (1006):
+          // переподключаемся, только если токен еще действителен
+          this.tokenIsValid().then(valid => (valid ? this.scheduleReconnect() : this.handleAuthFailure()));
+          return;
+        }
+        this.scheduleReconnect();
       };
 
+      // Обработчик мог быть обернут снаружи (useChat) - новый сокет получает ту же обертку
+      if (previous && previous.onmessage) {
+        this.websocket.onmessage = previous.onmessage;
+        return;
+      }
+
       this.websocket.onmessage = async (event) => {
         try {
           const data = JSON.parse(event.data);
+          if (data.seq > this.lastSeq) {
+            this.lastSeq = data.seq;
+          }
           await this.handleSignalingMessage(data);
         } catch (error) {
           console.error('Error processing message:', error);
@@ -124,6 +187,60 @@ class WebRTCManager {
     });
   }
 
+  scheduleReconnect() {
+    clearTimeout(this.reconnectTimer);
+    if (this.reconnectAttempts >= RECONNECT_MAX_ATTEMPTS) {
+      console.error(`WebSocket reconnect gave up after ${this.reconnectAttempts} attempts`);
+      if (this.onReconnectFailed) {
+        this.onReconnectFailed();
+      }
+      return;
+    }
+    const ceiling = Math.min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** this.reconnectAttempts);
+    const delay = ceiling / 2 + Math.random() * ceiling / 2;
+    this.reconnectAttempts += 1;
+    this.reconnectTimer = setTimeout(() => {
+      this.connectWebSocket(true).catch(error => console.error('WebSocket reconnect failed:', error));
+    }, delay);
+  }
+
+  // false - сервер ответил 401 на тот же токен; при сетевой ошибке считаем токен действительным
+  async tokenIsValid() {
+    const token = localStorage.getItem('token');
+    if (!token) {
+      return false;
+    }
+    try {
+      const response = await fetch(`${API_BASE}/auth/me`, {
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      return response.status !== 401;
+    } catch (error) {
+      return true;
+    }
+  }
+
+  handleAuthFailure() {
+    console.warn('WebSocket rejected: token is no longer valid');
+    clearTimeout(this.reconnectTimer);
+    if (this.onAuthFailure) {
+      this.onAuthFailure();
+    }
+  }
+
+  // Сервер не смог возобновить сессию: соединения с участниками строятся заново
+  resetPeers() {
+    Object.keys(this.peerConnections).forEach(userId => this.handleUserLeft(userId));
+    this.connectedUsers.clear();
+    if (this.publishConnection) {
+      this.publishConnection.close();
+      this.publishConnection = null;
+    }
+    if (this.onResync) {
+      this.onResync();
+    }
+  }
+
   async handleWebSocketMessage(data) {
     const { type, from_user_id } = data;
     
@@ -200,6 +317,17 @@ class WebRTCManager {
     }
 
     switch (data.type) {
+      case 'ping':
+        this.sendWebSocketMessage({ type: 'pong' });
+        break;
+      case 'session':
+        if (!data.resumed && this.session) {
+          console.log('Session was not resumed, reconnecting to peers');
+          this.resetPeers();
+        }
+        this.session = data.session;
+        this.lastSeq = data.seq;
+        break;
       case 'user_joined':
         await this.handleUserJoined(data.user_id);
         break;
@@ -215,6 +343,108 @@ class WebRTCManager {
       case 'ice-candidate':
         await this.handleIceCandidate(data.candidate, data.from_user_id);
         break;
+      case 'ice-candidates':
+        for (const candidate of data.candidates) {
+          await this.handleIceCandidate(candidate, data.from_user_id);
+        }
+        break;
+      case 'media_mode':
+        await this.handleMediaMode(data);
+        break;
+      case 'publish-answer':
+        if (this.publishConnection) {
+          await this.publishConnection.setRemoteDescription(data.answer);
+        }
+        break;
+      case 'publisher_added':
+        if (data.user_id !== this.userId) {
+          this.sendWebSocketMessage({ type: 'subscribe', publisher_id: data.user_id });
+        }
+        break;
+      case 'publisher_removed':
+        this.handleUserLeft(data.user_id);
+        break;
+      case 'subscribe-offer':
+        await this.handleSubscribeOffer(data.publisher_id, data.offer);
+        break;
+      case 'rate_limited':
+        console.warn(`Message dropped by ${data.scope} ${data.budget} limit, retry in ${data.retry_after}s`);
+        break;
+      case 'relay-error':
+        console.error(`Media relay error (${data.request}): ${data.error}`);
+        break;
+    }
+  }
+
+  async handleMediaMode(data) {
+    this.relayMode = data.mode === 'relay';
+    if (!this.relayMode) return;
+
+    console.log(`Room uses media relay, publishers: ${data.publishers}`);
+    for (const publisherId of data.publishers) {
+      this.sendWebSocketMessage({ type: 'subscribe', publisher_id: publisherId });
+    }
+    await this.publishToRelay();
+  }
+
+  // Сервер не принимает trickle ICE: offer/answer отправляются со всеми кандидатами
+  waitForIceGathering(peerConnection, timeout = 3000) {
+    if (peerConnection.iceGatheringState === 'complete') return Promise.resolve();
+    return new Promise(resolve => {
+      const done = () => {
+        peerConnection.removeEventListener('icegatheringstatechange', check);
+        clearTimeout(timer);
+        resolve();
+      };
+      const check = () => {
+        if (peerConnection.iceGatheringState === 'complete') done();
+      };
+      const timer = setTimeout(done, timeout);
+      peerConnection.addEventListener('icegatheringstatechange', check);
+    });
+  }
+
+  async publishToRelay() {
+    if (this.publishConnection) {
+      this.publishConnection.close();
+    }
+    const peerConnection = new RTCPeerConnection(this.configuration);
+    if (this.localStream) {
+      this.localStream.getTracks().forEach(track => peerConnection.addTrack(track, this.localStream));
+    }
+    this.publishConnection = peerConnection;
+
+    try {
+      await peerConnection.setLocalDescription(await peerConnection.createOffer());
+      await this.waitForIceGathering(peerConnection);
+      this.sendWebSocketMessage({ type: 'publish', offer: peerConnection.localDescription });
+    } catch (error) {
+      console.error('Error publishing to media relay:', error);
+    }
+  }
+
+  async handleSubscribeOffer(publisherId, offer) {
+    if (this.peerConnections[publisherId]) {
+      this.peerConnections[publisherId].close();
+    }
+    const peerConnection = new RTCPeerConnection(this.configuration);
+    peerConnection.ontrack = (event) => {
+      const remoteStream = event.streams[0] || new MediaStream([event.track]);
+      this.onRemoteStream(publisherId, remoteStream);
+    };
+    this.peerConnections[publisherId] = peerConnection;
+
+    try {
+      await peerConnection.setRemoteDescription(offer);
+      await peerConnection.setLocalDescription(await peerConnection.createAnswer());
+      await this.waitForIceGathering(peerConnection);
+      this.sendWebSocketMessage({
+        type: 'subscribe-answer',
+        publisher_id: publisherId,
+        answer: peerConnection.localDescription
+      });
+    } catch (error) {
+      console.error(`Error subscribing to ${publisherId}:`, error);
     }
   }
 
@@ -229,6 +459,7 @@ class WebRTCManager {
   }
 
   async handleUserJoined(userId) {
+    if (this.relayMode) return;
     if (userId !== this.userId && !this.connectedUsers.has(userId)) {
       this.connectedUsers.add(userId);
       console.log(`Creating connection to new user ${userId}`);
@@ -411,6 +642,11 @@ class WebRTCManager {
       }
       
       await this.initializeMediaDevices();
+
+      if (this.relayMode) {
+        await this.publishToRelay();
+        return this.localStream;
+      }
       
       Object.keys(this.peerConnections).forEach(userId => {
         const pc = this.peerConnections[userId];
@@ -438,10 +674,16 @@ class WebRTCManager {
 
   destroy() {
     console.log('Destroying WebRTCManager');
+    this.destroyed = true;
+    clearTimeout(this.reconnectTimer);
     
     Object.values(this.peerConnections).forEach(pc => pc.close());
     this.peerConnections = {};
     this.connectedUsers.clear();
+    if (this.publishConnection) {
+      this.publishConnection.close();
+      this.publishConnection = null;
+    }
     
     if (this.localStream) {
       this.localStream.getTracks().forEach(track => track.stop());
@@ -71,6 +71,9 @@ export const useChat = (webrtcManager, currentUser, roomId) => {
     };
 
     const originalOnMessage = webrtcManager.websocket.onmessage;
+    // После обрыва сокета пропущенные сообщения повторяет сервер; история
+    // перезагружается, только если сессию не удалось возобновить
+    webrtcManager.onResync = loadMessageHistory;
     
     webrtcManager.websocket.onmessage = (event) => {
       handleWebSocketMessage(event);
@@ -84,6 +87,7 @@ export const useChat = (webrtcManager, currentUser, roomId) => {
       if (webrtcManager.websocket) {
         webrtcManager.websocket.onmessage = originalOnMessage;
       }
+      webrtcManager.onResync = null;
     };
   }, [webrtcManager, currentUser]);
 